@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+import runstate
+import tracing
+
+# Webhooks a bot has already handled, so a redelivered one can be skipped before it makes any Acuity or Google
+# request. An entry is keyed on the action, the id it's about and a fingerprint of the rest of the payload, and is
+# only recorded once the webhook was handled successfully, so a failed one is still tried again. Entries expire
+# after IDEMPOTENCY_TTL seconds. The sqlite backend keeps them in the file at IDEMPOTENCY_PATH, in the temp directory
+# by default, which on Lambda lasts as long as a warm container: long enough for the quick redeliveries, not a
+# guarantee across containers
+
+# entries are kept for a day unless IDEMPOTENCY_TTL says otherwise
+default_ttl_seconds = 24 * 60 * 60
+
+# store shared across warm invocations, see get_store
+cached_store = None
+
+class SqliteStore:
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_tables(self):
+        cursor = self.connection.cursor()
+        cursor.execute("CREATE TABLE IF NOT EXISTS handled_events (action TEXT NOT NULL, event_id TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                       "handled REAL NOT NULL, expires REAL NOT NULL, PRIMARY KEY (action, event_id, fingerprint))")
+        cursor.execute("CREATE INDEX IF NOT EXISTS handled_events_expires_idx ON handled_events (expires)")
+        self.connection.commit()
+        cursor.close()
+
+    # returns True if the event was handled and hasn't expired yet
+    def seen(self, action, event_id, fingerprint, now):
+        cursor = self.connection.cursor()
+        cursor.execute("SELECT 1 FROM handled_events WHERE action = ? AND event_id = ? AND fingerprint = ? AND expires > ?",
+                       (action, event_id, fingerprint, now))
+        found = cursor.fetchone() is not None
+        cursor.close()
+
+        return found
+
+    # record a handled event, dropping the entries that have expired
+    def record(self, action, event_id, fingerprint, now, expires):
+        cursor = self.connection.cursor()
+        cursor.execute("DELETE FROM handled_events WHERE expires <= ?", (now,))
+        cursor.execute("INSERT OR REPLACE INTO handled_events (action, event_id, fingerprint, handled, expires) VALUES (?, ?, ?, ?, ?)",
+                       (action, event_id, fingerprint, now, expires))
+        self.connection.commit()
+        cursor.close()
+
+    def close(self):
+        self.connection.close()
+
+# open the store configured by IDEMPOTENCY_BACKEND, sqlite by default
+# returns SqliteStore, or None when the backend is none and every webhook is handled
+def open_store():
+    backend = os.environ.get('IDEMPOTENCY_BACKEND', 'sqlite').lower()
+
+    if backend == 'none':
+        return None
+
+    if backend == 'sqlite':
+        path = os.environ.get('IDEMPOTENCY_PATH', os.path.join(tempfile.gettempdir(), 'idempotency.sqlite3'))
+        store = SqliteStore(sqlite3.connect(path))
+    else:
+        raise ValueError("Unknown IDEMPOTENCY_BACKEND: %s" % backend)
+
+    store.create_tables()
+    logging.debug("Opened %s idempotency backend", backend)
+
+    return store
+
+# get the configured store, opening it on first use and keeping it for warm invocations
+# returns SqliteStore, or None when the backend is none
+def get_store():
+    global cached_store
+
+    if cached_store is None:
+        cached_store = open_store()
+
+    return cached_store
+
+def ttl_seconds():
+    return float(os.environ.get('IDEMPOTENCY_TTL', default_ttl_seconds))
+
+# check whether a webhook was already handled, e.g. already_handled('scheduled', 1234, parsed_event). the store
+# failing is logged and treated as not handled, so the webhook still goes through
+# returns True if it was handled within the TTL
+def already_handled(action, event_id, payload):
+    try:
+        store = get_store()
+        if store is None:
+            return False
+
+        found = store.seen(action, str(event_id), runstate.fingerprint(payload), time.time())
+    except (sqlite3.Error, OSError) as e:
+        logging.warning("Couldn't check whether %s %s was already handled: %s", action, event_id, e)
+        return False
+
+    if found:
+        tracing.count('idempotency.duplicates')
+    return found
+
+# remember that a webhook was handled successfully
+def record_handled(action, event_id, payload):
+    try:
+        store = get_store()
+        if store is None:
+            return
+
+        now = time.time()
+        store.record(action, str(event_id), runstate.fingerprint(payload), now, now + ttl_seconds())
+    except (sqlite3.Error, OSError) as e:
+        logging.warning("Couldn't record %s %s as handled: %s", action, event_id, e)
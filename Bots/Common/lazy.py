@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import importlib.util
+import sys
+
+# import a module on first attribute access instead of at import time, so a cold start only pays for the clients
+# the invocation actually uses. e.g. gspread = lazy_import('gspread') at the top of a bot, then gspread.authorize()
+# as usual. Exceptions in except clauses are only looked up when something is raised, so they stay lazy too
+# returns the module, or the already imported module if something else imported it first
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named '%s'" % name, name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+
+    return module
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import random
+import threading
+import time
+import tracing
+
+# Google allows 60 Sheets API requests per minute per user by default. The bots all run as one service account,
+# so that's the budget. SHEETS_REQUESTS_PER_MINUTE raises it if the project's quota has been raised
+sheets_requests_per_minute = int(os.environ.get('SHEETS_REQUESTS_PER_MINUTE', '60'))
+
+# responses worth retrying: rate limited, or a server side error that usually clears up on its own
+retry_status_codes = (429, 500, 502, 503, 504)
+max_retries = 5
+backoff_seconds = 1.0
+max_backoff_seconds = 32.0
+
+# a deferred call is put off once fewer than this share of the bucket's tokens are left
+defer_below = 0.25
+
+# Token bucket limiter. tokens refill at rate per second up to capacity and each request takes one,
+# waiting for a refill if the bucket is empty. safe to share between threads, which queue up for tokens
+class TokenBucket:
+
+    def __init__(self, rate, capacity, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # tokens left right now
+    def available(self):
+        with self.lock:
+            self._refill()
+            return self.tokens
+
+    # take a token, sleeping until one is available
+    # returns seconds spent waiting
+    def take(self):
+        with self.lock:
+            self._refill()
+            waited = 0.0
+
+            if self.tokens < 1:
+                waited = (1 - self.tokens) / self.rate
+                tracing.count('sheets.throttled_seconds', waited)
+                self.sleep(waited)
+                self._refill()
+
+            self.tokens -= 1
+            return waited
+
+# one bucket for the whole process, shared by every client so warm invocations keep counting against it
+sheets_bucket = TokenBucket(sheets_requests_per_minute / 60.0, sheets_requests_per_minute)
+
+# calls put off by defer() until flush_deferred()
+deferred_calls = []
+
+# get the HTTP status of a failed request from the exception it raised, gspread's APIError and requests'
+# HTTPError both carry the response
+# returns status code, or None if there's no response
+def error_status(error):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None)
+
+# how long to wait before the next attempt. honours Retry-After when Google sends it, otherwise exponential
+# backoff with jitter so several bots retrying at once don't all come back at the same moment
+# returns seconds
+def backoff(error, attempt):
+    response = getattr(error, 'response', None)
+    retry_after = getattr(response, 'headers', {}).get('Retry-After') if response is not None else None
+
+    if retry_after and retry_after.isdigit():
+        return float(retry_after)
+
+    return min(max_backoff_seconds, backoff_seconds * (2 ** attempt)) * (0.5 + random.random() / 2)
+
+# call function, retrying on 429 and 5xx responses with backoff, up to max_retries times
+# returns whatever function returns, or raises the last error
+def call_with_retry(function, *args, service='sheets', sleep=time.sleep, **kwargs):
+    attempt = 0
+
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except Exception as error:
+            status = error_status(error)
+            if status not in retry_status_codes or attempt >= max_retries:
+                raise
+
+            delay = backoff(error, attempt)
+            attempt += 1
+            tracing.count('%s.retries' % service)
+            logging.warning("Got %s from %s, retry %s of %s in %.1f seconds", status, service, attempt, max_retries, delay)
+            sleep(delay)
+
+# put every request a gspread client makes through the Sheets token bucket and retry 429s and 5xx responses.
+# gspread 5 sends each call through Client.request, like tracing.trace_gspread. Drive requests (open by title,
+# share) have a much larger quota of their own, so they're retried but not rate limited
+# returns the same client
+def limit_gspread(client, bucket=None):
+    bucket = bucket or sheets_bucket
+    request = client.request
+
+    def limited_request(method, endpoint, *args, **kwargs):
+        def attempt():
+            if 'googleapis.com/drive' not in endpoint:
+                bucket.take()
+            return request(method, endpoint, *args, **kwargs)
+
+        return call_with_retry(attempt)
+
+    client.request = limited_request
+    return client
+
+# run a call that can wait, e.g. resizing columns, freezing the header or re-sharing a spreadsheet. it runs right away
+# while the Sheets budget is healthy, and is put off until flush_deferred() once the bucket runs low, so the writes
+# that matter get the remaining requests first
+# returns the result if it ran now, or None if it was deferred
+def defer(function, *args, bucket=None, **kwargs):
+    bucket = bucket or sheets_bucket
+
+    if bucket.available() >= bucket.capacity * defer_below:
+        return function(*args, **kwargs)
+
+    logging.debug("Sheets budget is low, deferring %s", getattr(function, '__name__', function))
+    tracing.count('sheets.deferred')
+    deferred_calls.append((function, args, kwargs))
+    return None
+
+# run every deferred call, at the end of a handler once the important writes are done. a deferred call failing is
+# logged and doesn't stop the rest
+# returns number of calls that failed
+def flush_deferred():
+    failed = 0
+
+    while deferred_calls:
+        (function, args, kwargs) = deferred_calls.pop(0)
+        try:
+            function(*args, **kwargs)
+        except Exception as e:
+            failed += 1
+            logging.warning("Deferred call %s failed: %s", getattr(function, '__name__', function), e)
+
+    return failed
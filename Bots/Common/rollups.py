@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+
+import runstate
+from array import array
+
+# Totals over records such as transactions, grouped several ways at once, e.g. by month, by category and by product.
+# The records are split into partitions, e.g. by month, and each partition is added up in a single pass: every group
+# gets a slot, and each measure (amount, fees, ...) is an array of doubles with one entry per slot. A partition's
+# totals are kept with a fingerprint of the records they came from, so once the totals are in a bot's run state the
+# next run only adds up the partitions whose records changed, usually just the current month, and adds the rest back
+# in from the state
+
+class Rollup:
+
+    def __init__(self, measures):
+        self.measures = list(measures)
+        # partition key -> {'fingerprint': ..., 'labels': [group label, ...], 'counts': array, 'columns': [array, ...]}
+        self.partitions = {}
+
+    # add up records, each a tuple of the group labels it counts towards (tuples such as ('Stripe', 'Month',
+    # '2024-05')) and its values in the order of the measures. blank values count as 0
+    # returns dict of labels, counts and columns, one entry per group
+    def total(self, records):
+        slots = {}
+        labels = []
+        counts = array('q')
+        columns = [array('d') for measure in self.measures]
+
+        for (groups, values) in records:
+            values = [float(value or 0) for value in values]
+
+            for group in groups:
+                slot = slots.get(group)
+                if slot is None:
+                    slot = slots[group] = len(labels)
+                    labels.append(list(group))
+                    counts.append(0)
+                    for column in columns:
+                        column.append(0.0)
+
+                counts[slot] += 1
+                for (column, value) in zip(columns, values):
+                    column[slot] += value
+
+        return {'labels': labels, 'counts': counts, 'columns': columns}
+
+    # bring the totals up to date with partitions, a dict of partition key to the JSON-able items in it.
+    # make_records(key, items) turns a partition's items into records for total(), and is only called for
+    # partitions that are new or whose items changed. partitions that are no longer there are dropped
+    # returns tuple of the number of partitions added up and the number dropped
+    def update(self, partitions, make_records):
+        changed = 0
+
+        for (key, items) in partitions.items():
+            fingerprint = runstate.fingerprint(items)
+            if key in self.partitions and self.partitions[key]['fingerprint'] == fingerprint:
+                continue
+
+            self.partitions[key] = dict(self.total(make_records(key, items)), fingerprint=fingerprint)
+            changed += 1
+
+        dropped = [key for key in self.partitions if key not in partitions]
+        for key in dropped:
+            del self.partitions[key]
+
+        return (changed, len(dropped))
+
+    # the totals across every partition as rows of group label, count and one rounded value per measure, sorted by
+    # label
+    # returns list of rows
+    def rows(self):
+        totals = {}
+
+        for partition in self.partitions.values():
+            for (slot, label) in enumerate(partition['labels']):
+                total = totals.setdefault(tuple(label), [0] + [0.0] * len(self.measures))
+                total[0] += partition['counts'][slot]
+                for (index, column) in enumerate(partition['columns']):
+                    total[index + 1] += column[slot]
+
+        return [list(label) + [total[0]] + [round(value, 2) for value in total[1:]] for (label, total) in sorted(totals.items())]
+
+    # returns dict that serializes to JSON
+    def to_state(self):
+        partitions = {}
+        for (key, partition) in self.partitions.items():
+            partitions[key] = {
+                'fingerprint': partition['fingerprint'],
+                'labels': partition['labels'],
+                'counts': list(partition['counts']),
+                'columns': [list(column) for column in partition['columns']],
+            }
+
+        return {'measures': self.measures, 'partitions': partitions}
+
+    # rebuild a rollup from to_state(). state for different measures, or none, gives an empty rollup
+    # returns Rollup
+    @classmethod
+    def from_state(cls, state, measures):
+        rollup = cls(measures)
+        if not state or state.get('measures') != rollup.measures:
+            return rollup
+
+        for (key, partition) in state['partitions'].items():
+            rollup.partitions[key] = {
+                'fingerprint': partition['fingerprint'],
+                'labels': partition['labels'],
+                'counts': array('q', partition['counts']),
+                'columns': [array('d', column) for column in partition['columns']],
+            }
+
+        return rollup
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+# Small JSON documents a bot keeps between runs, e.g. fingerprints of what it last wrote. With RUN_STATE_BUCKET set
+# they live in S3 under runstate/<name>.json, otherwise in a file under RUN_STATE_DIR (the temp directory by default),
+# which on Lambda only lasts as long as a warm container
+
+def state_key(name):
+    return 'runstate/%s.json' % name
+
+# boto3 comes with the Lambda runtime, so it isn't in any requirements.txt. it's only imported when RUN_STATE_BUCKET
+# is set, so local runs with the file backend don't need it
+def s3_client():
+    import boto3
+    return boto3.client('s3')
+
+# read a bot's run state. a missing or unreadable state is an empty one, the bot just does a full run
+# returns dict
+def load(name):
+    bucket = os.environ.get('RUN_STATE_BUCKET')
+
+    try:
+        if bucket:
+            s3 = s3_client()
+            try:
+                body = s3.get_object(Bucket=bucket, Key=state_key(name))['Body'].read()
+            except s3.exceptions.NoSuchKey:
+                return {}
+            return json.loads(body)
+
+        path = os.path.join(os.environ.get('RUN_STATE_DIR', tempfile.gettempdir()), state_key(name))
+        if not os.path.exists(path):
+            return {}
+        with open(path) as state_file:
+            return json.load(state_file)
+    except Exception as e:
+        logging.warning("Couldn't read run state %s, starting from scratch: %s", name, e)
+        return {}
+
+# save a bot's run state. failing to save is logged and otherwise ignored, the next run is a full one
+def save(name, state):
+    bucket = os.environ.get('RUN_STATE_BUCKET')
+    body = json.dumps(state, sort_keys=True)
+
+    try:
+        if bucket:
+            s3_client().put_object(Bucket=bucket, Key=state_key(name), Body=body.encode('utf-8'), ContentType='application/json')
+            return
+
+        path = os.path.join(os.environ.get('RUN_STATE_DIR', tempfile.gettempdir()), state_key(name))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # through a temporary file so an interrupted write can't leave it half written
+        with open(path + '.tmp', 'w') as state_file:
+            state_file.write(body)
+        os.replace(path + '.tmp', path)
+    except Exception as e:
+        logging.warning("Couldn't save run state %s: %s", name, e)
+
+# stable hash of some JSON-able values, e.g. a worksheet's header and rows. the same values always give the same
+# fingerprint, across runs and Python versions
+# returns hex string
+def fingerprint(*values):
+    encoded = json.dumps(values, separators=(',', ':'), ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
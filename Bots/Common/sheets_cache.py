@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import tracing
+from lazy import lazy_import
+
+gspread = lazy_import('gspread')
+
+# Values read out of spreadsheets, kept until the spreadsheet changes. Before a cached read is reused, Drive is asked
+# for the spreadsheet's version, which is one small Drive request instead of opening the spreadsheet, fetching its
+# metadata and reading the values. Entries live in memory for warm invocations and in files under READ_CACHE_DIR
+# (a directory in the temp directory by default) for the next container to start from
+
+# (spreadsheet id, cells) -> {'version': ..., 'worksheets': [[worksheet id, title, values], ...]}
+entries = {}
+
+# spreadsheet title -> id, so a cached read doesn't need to look the spreadsheet up by name
+spreadsheet_ids = {}
+
+def cache_dir():
+    return os.environ.get('READ_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sheets_cache'))
+
+def cache_path(name):
+    return os.path.join(cache_dir(), hashlib.sha256(name.encode('utf-8')).hexdigest() + '.json')
+
+# read a cache file, a missing or unreadable one is the same as nothing cached
+# returns the stored value or None
+def load_file(name):
+    try:
+        with open(cache_path(name)) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return None
+
+# write a cache file through a temporary file, failing quietly since the cache is only ever a shortcut
+def save_file(name, value):
+    path = cache_path(name)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as cache_file:
+            json.dump(value, cache_file)
+        os.replace(path + '.tmp', path)
+    except OSError as e:
+        logging.debug("Couldn't write read cache %s: %s", path, e)
+
+# look up a spreadsheet's id by title, from memory, disk, or by opening it
+# returns tuple of id and the opened spreadsheet if it had to be opened, or raises SpreadsheetNotFound
+def spreadsheet_id(client, spreadsheet_title):
+    if spreadsheet_title not in spreadsheet_ids:
+        cached_id = load_file('id:' + spreadsheet_title)
+        if cached_id:
+            spreadsheet_ids[spreadsheet_title] = cached_id
+
+    if spreadsheet_title in spreadsheet_ids:
+        return (spreadsheet_ids[spreadsheet_title], None)
+
+    spreadsheet = client.open(spreadsheet_title)
+    spreadsheet_ids[spreadsheet_title] = spreadsheet.id
+    save_file('id:' + spreadsheet_title, spreadsheet.id)
+    return (spreadsheet.id, spreadsheet)
+
+# forget a spreadsheet's id, e.g. once it's been deleted or trashed
+def forget_spreadsheet(spreadsheet_title):
+    spreadsheet_ids.pop(spreadsheet_title, None)
+    save_file('id:' + spreadsheet_title, None)
+
+# ask Drive for the spreadsheet's current version
+# returns version string, or None if the spreadsheet is gone
+def current_version(client, spreadsheet_id):
+    try:
+        response = client.request('get', '%s/%s' % (gspread.urls.DRIVE_FILES_API_V3_URL, spreadsheet_id),
+                                  params={'fields': 'modifiedTime,version,trashed', 'supportsAllDrives': True})
+    except gspread.exceptions.APIError as e:
+        if getattr(e.response, 'status_code', None) == 404:
+            return None
+        raise
+
+    metadata = response.json()
+    if metadata.get('trashed'):
+        return None
+    return '%s/%s' % (metadata.get('version'), metadata.get('modifiedTime'))
+
+# read a range from every worksheet of a spreadsheet, e.g. cells 'A:A' for the order ids in column A, or '' for
+# whole worksheets. worksheet_titles limits it to those worksheets. served from the cache while the spreadsheet's
+# version hasn't changed, otherwise read with one metadata and one values_batch_get request and cached
+# returns list of (worksheet id, worksheet title, list of rows), or raises SpreadsheetNotFound
+def read_worksheets(client, spreadsheet_title, cells='', worksheet_titles=None):
+    (sheet_id, spreadsheet) = spreadsheet_id(client, spreadsheet_title)
+    version = current_version(client, sheet_id)
+
+    if version is None:
+        # the id we had is stale, look the title up again
+        logging.info("Spreadsheet %s is gone, looking up '%s' again", sheet_id, spreadsheet_title)
+        forget_spreadsheet(spreadsheet_title)
+        (sheet_id, spreadsheet) = spreadsheet_id(client, spreadsheet_title)
+        version = current_version(client, sheet_id)
+
+    key = json.dumps([sheet_id, cells, sorted(worksheet_titles) if worksheet_titles else None])
+    entry = entries.get(key) or load_file(key)
+
+    if entry and entry['version'] == version:
+        logging.debug("Read cache hit for %s %s", spreadsheet_title, cells)
+        tracing.count('sheets.cache_hits')
+        entries[key] = entry
+        return [tuple(worksheet) for worksheet in entry['worksheets']]
+
+    tracing.count('sheets.cache_misses')
+    if spreadsheet is None:
+        spreadsheet = client.open_by_key(sheet_id)
+
+    worksheets = [sheet for sheet in spreadsheet.worksheets() if worksheet_titles is None or sheet.title in worksheet_titles]
+    ranges = ["'%s'!%s" % (sheet.title.replace("'", "''"), cells) if cells else "'%s'" % sheet.title.replace("'", "''") for sheet in worksheets]
+    value_ranges = spreadsheet.values_batch_get(ranges)['valueRanges'] if ranges else []
+
+    entry = {
+        'version': version,
+        'worksheets': [[sheet.id, sheet.title, value_range.get('values', [])] for (sheet, value_range) in zip(worksheets, value_ranges)],
+    }
+    entries[key] = entry
+    save_file(key, entry)
+
+    return [tuple(worksheet) for worksheet in entry['worksheets']]
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import re
+import time
+import tracing
+import ratelimit
+from concurrent.futures import ThreadPoolExecutor
+
+# Collects whole-worksheet rewrites and commits them a spreadsheet at a time. Writing a worksheet one gspread call at
+# a time (add it, clear, resize, append the header, append the rows, freeze, auto-resize) is about seven Sheets
+# requests; planned together, every worksheet of a spreadsheet takes one batchUpdate for the grid, one
+# values.batchUpdate for the cells, and one more batchUpdate to auto-resize the columns once they're filled in
+
+# Google turns away requests over 10 MB and suggests keeping them to 2 MB, so the cells of a large write are split
+# into values.batchUpdate requests of about this many bytes, estimated from their JSON
+max_request_bytes = 2 * 2 ** 20
+
+# requests of a large write sent at the same time. each one still takes a token from the Sheets bucket and is retried
+# on its own by ratelimit.limit_gspread(), so a failed request doesn't mean sending the rest again
+write_workers = int(os.environ.get('SHEETS_WRITE_WORKERS', '4'))
+
+# metadata gspread reads when it opens a spreadsheet, kept for write_spreadsheet so it doesn't read it straight away
+# again. only used this long after it was read, in seconds, which is long enough for opening and then writing
+opened_metadata_max_age = 30
+
+# spreadsheet id -> (time read, metadata), see keep_opened_metadata
+opened_metadata = {}
+
+# Sheets API url for a spreadsheet, capturing its id and whatever follows it, e.g. ':batchUpdate' or '/values/...'
+spreadsheet_url = re.compile(r'https://sheets\.googleapis\.com/v4/spreadsheets/([^/:?]+)(.*)')
+
+# keep the metadata a gspread client reads when opening a spreadsheet, for write_spreadsheet to use instead of
+# reading it again. any other request that could change the spreadsheet drops what was kept
+# returns the client
+def keep_opened_metadata(client):
+    request = client.request
+
+    def keeping_request(method, endpoint, *args, **kwargs):
+        response = request(method, endpoint, *args, **kwargs)
+
+        match = spreadsheet_url.match(endpoint)
+        if match and method.lower() == 'get':
+            if match.group(2) == '' and kwargs.get('params') == {'includeGridData': 'false'}:
+                opened_metadata[match.group(1)] = (time.monotonic(), response.json())
+        elif match:
+            opened_metadata.pop(match.group(1), None)
+
+        return response
+
+    client.request = keeping_request
+    return client
+
+# the metadata of a spreadsheet: what was kept when it was opened if that was just now, otherwise read from Sheets
+# returns metadata dictionary
+def spreadsheet_metadata(spreadsheet):
+    (read, metadata) = opened_metadata.pop(spreadsheet.id, (None, None))
+    if metadata is not None and time.monotonic() - read < opened_metadata_max_age:
+        return metadata
+
+    return spreadsheet.fetch_sheet_metadata()
+
+# quote a worksheet title for an A1 range, doubling any single quotes in it
+# returns string
+def quote_title(title):
+    return "'%s'" % title.replace("'", "''")
+
+class WritePlan:
+
+    def __init__(self):
+        # spreadsheet title -> {'share_perms': [...], 'worksheets': [...]}, in the order they were planned
+        self.spreadsheets = {}
+
+    # plan rewriting a worksheet with a header row and rows. on_written is called once the spreadsheet's writes have
+    # gone through, e.g. to record the fingerprint of what was written
+    def write_worksheet(self, spreadsheet_title, worksheet_title, header_row, rows, share_perms=[], on_written=None):
+        planned = self.spreadsheets.setdefault(spreadsheet_title, {'share_perms': [], 'worksheets': []})
+        for email in share_perms:
+            if email not in planned['share_perms']:
+                planned['share_perms'].append(email)
+
+        planned['worksheets'] = [worksheet for worksheet in planned['worksheets'] if worksheet['title'] != worksheet_title]
+        planned['worksheets'].append({
+            'title': worksheet_title,
+            'header_row': header_row,
+            'rows': rows,
+            'on_written': on_written,
+        })
+
+    # commit every planned spreadsheet. open_spreadsheet(title, share_perms) returns a gspread Spreadsheet. a
+    # spreadsheet that fails is logged and the rest are still written
+    # returns number of spreadsheets that failed
+    def commit(self, open_spreadsheet):
+        failed = 0
+
+        while self.spreadsheets:
+            (spreadsheet_title, planned) = next(iter(self.spreadsheets.items()))
+            del self.spreadsheets[spreadsheet_title]
+
+            try:
+                spreadsheet = open_spreadsheet(spreadsheet_title, planned['share_perms'])
+                write_spreadsheet(spreadsheet, planned['worksheets'])
+            except Exception as e:
+                logging.error("Failure updating google sheets for %s: %s", spreadsheet_title, e)
+                failed += 1
+                continue
+
+            for worksheet in planned['worksheets']:
+                if worksheet['on_written']:
+                    worksheet['on_written']()
+
+        return failed
+
+# pad every row out to width, so the cells a shorter row doesn't reach are cleared rather than left as they were
+# returns list of rows
+def padded(rows, width):
+    return [list(row) + [''] * (width - len(row)) for row in rows]
+
+# split the values for some worksheets into values.batchUpdate bodies of at most max_bytes each. a worksheet that
+# doesn't fit is cut into blocks at row boundaries, each written to an explicit A1 range
+# returns list of lists of {'range': ..., 'values': [...]}
+def value_requests(data, max_bytes=None):
+    max_bytes = max_bytes or max_request_bytes
+    requests = []
+    current = []
+    size = 0
+
+    for item in data:
+        block = None
+        for (index, row) in enumerate(item['values']):
+            row_bytes = len(json.dumps(row, default=str)) + 1
+            if current and size + row_bytes > max_bytes:
+                requests.append(current)
+                (current, size, block) = ([], 0, None)
+
+            if block is None:
+                block = {'range': '%s!A%s' % (quote_title(item['title']), index + 1), 'values': []}
+                current.append(block)
+            block['values'].append(row)
+            size += row_bytes
+
+    if current:
+        requests.append(current)
+    return requests
+
+# write values into worksheets whose grid is already big enough, in one request if they fit and otherwise in
+# size-bounded requests up to write_workers at a time. every request is tried even if another one fails
+def write_values(spreadsheet, data):
+    requests = value_requests(data)
+
+    def send(blocks):
+        return spreadsheet.values_batch_update(body={'valueInputOption': 'USER_ENTERED', 'data': blocks})
+
+    if len(requests) == 1:
+        send(requests[0])
+        return
+
+    logging.info("Writing %s rows to %s in %s requests", sum(len(item['values']) for item in data), spreadsheet.title, len(requests))
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, min(write_workers, len(requests)))) as executor:
+        for (blocks, future) in [(blocks, executor.submit(send, blocks)) for blocks in requests]:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error("Failed writing %s: %s", ', '.join(block['range'] for block in blocks), e)
+                errors.append(e)
+
+    if errors:
+        raise errors[0]
+
+# rewrite the planned worksheets of one spreadsheet. the grid comes first: new worksheets are added with their size
+# and frozen header, existing ones are resized to exactly the rows and columns being written, which drops anything
+# left over from a longer previous run. then the values, then the auto-resize, which can wait
+def write_spreadsheet(spreadsheet, worksheets):
+    existing = {}
+    for sheet in spreadsheet_metadata(spreadsheet)['sheets']:
+        existing[sheet['properties']['title']] = sheet['properties']['sheetId']
+    next_sheet_id = max(existing.values(), default=0) + 1
+
+    structure = []
+    data = []
+    resize = []
+
+    for worksheet in worksheets:
+        width = max([len(worksheet['header_row'])] + [len(row) for row in worksheet['rows']])
+        grid = {
+            'rowCount': len(worksheet['rows']) + 1,
+            'columnCount': width,
+            # Sheets won't freeze every row of a worksheet, so a header on its own isn't frozen
+            'frozenRowCount': 1 if worksheet['rows'] else 0,
+        }
+
+        if worksheet['title'] in existing:
+            sheet_id = existing[worksheet['title']]
+            structure.append({'updateSheetProperties': {
+                'properties': {'sheetId': sheet_id, 'gridProperties': grid},
+                'fields': 'gridProperties.rowCount,gridProperties.columnCount,gridProperties.frozenRowCount',
+            }})
+        else:
+            # choosing the new worksheet's id means the values and resize below can refer to it without a reply
+            sheet_id = next_sheet_id
+            next_sheet_id += 1
+            logging.debug("Added worksheet: %s", worksheet['title'])
+            structure.append({'addSheet': {'properties': {'sheetId': sheet_id, 'title': worksheet['title'], 'gridProperties': grid}}})
+
+        data.append({
+            'title': worksheet['title'],
+            'values': padded([worksheet['header_row']] + worksheet['rows'], width),
+        })
+        resize.append({'autoResizeDimensions': {
+            'dimensions': {'sheetId': sheet_id, 'dimension': 'COLUMNS', 'startIndex': 0, 'endIndex': width},
+        }})
+        tracing.count('sheets.rows', len(worksheet['rows']))
+
+    spreadsheet.batch_update({'requests': structure})
+    write_values(spreadsheet, data)
+    ratelimit.defer(spreadsheet.batch_update, {'requests': resize})
+
+# rewrite a single worksheet straight away, for scripts that write one at a time
+def rewrite_worksheet(spreadsheet, worksheet_title, header_row, rows):
+    write_spreadsheet(spreadsheet, [{'title': worksheet_title, 'header_row': header_row, 'rows': rows}])
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import sqlite3
+import tempfile
+import tracing
+from contextlib import contextmanager
+
+# Tables the bots keep in the SQL backend. Columns follow the spreadsheet headers the bots write, in the same order,
+# so a formatted spreadsheet row can be stored as-is. Every table is keyed on year plus the order number/id, or plus
+# the columns in 'key' where one order has more than one row
+tables = {
+    'memberships': {
+        'columns': [
+                        'order_no',
+                        'primary_name',
+                        'primary_email',
+                        'secondary_name',
+                        'secondary_email',
+                        'membership_type',
+                        'renewal_type',
+                        'home_address',
+                        'home_phone',
+                        'cell_phone',
+                        'emergency_contact',
+                        'emergency_phone',
+                        'child_1_name',
+                        'child_1_dob',
+                        'child_2_name',
+                        'child_2_dob',
+                        'child_3_name',
+                        'child_3_dob',
+                        'child_4_name',
+                        'child_4_dob',
+                        'child_5_name',
+                        'child_5_dob',
+                        'child_photo_approved',
+                    ],
+        'indexes': ['primary_email', 'secondary_email'],
+    },
+    'moorings': {
+        'columns': [
+                        'order_no',
+                        'name',
+                        'email',
+                        'phone',
+                        'mooring_row',
+                        'color_position',
+                        'boat_type',
+                        'boat_color',
+                        'town_permit_no',
+                        'services',
+                    ],
+        'indexes': ['email'],
+    },
+    'reservations': {
+        'columns': [
+                        'order_id',
+                        'name',
+                        'email',
+                        'phone',
+                        'date_requested',
+                        'time_in',
+                        'time_out',
+                        'type',
+                        'member_status',
+                    ],
+        'indexes': ['email'],
+    },
+    # lessons and races have a form per appointment type, with different questions, so the answers are kept as JSON
+    # keyed by question name rather than as a column each
+    'lessons': {
+        'columns': [
+                        'order_id',
+                        'name',
+                        'email',
+                        'phone',
+                        'date_requested',
+                        'type',
+                        'responses',
+                    ],
+        'indexes': ['email'],
+    },
+    # the All Transactions ledger, with the webhook action that wrote each row. a canceled lesson has its
+    # order.completed row and its canceled row, like the ledger worksheet does
+    'lesson_transactions': {
+        'columns': [
+                        'order_id',
+                        'name',
+                        'email',
+                        'phone',
+                        'type',
+                        'order_placed',
+                        'list_price',
+                        'amount_paid',
+                        'paid',
+                        'member_status',
+                        'action',
+                    ],
+        'key': ['order_id', 'action'],
+        'indexes': ['email'],
+    },
+}
+
+# keys per DELETE statement, well under SQLite's limit on bound parameters
+delete_chunk_size = 500
+
+# store shared across warm invocations, see get_store
+cached_store = None
+
+# the columns a table is keyed on, besides year
+# returns list of column names
+def key_columns(table):
+    return tables[table].get('key', tables[table]['columns'][:1])
+
+# Storage backed by a SQL database, either Postgres or SQLite
+# rows are lists in the same order as the table columns, not including year. find and delete take values of the first
+# column, so they cover every row of an order in a table keyed on more than that
+class SqlStore:
+
+    def __init__(self, connection, placeholder):
+        self.connection = connection
+        self.placeholder = placeholder
+
+    # a cursor for one unit of work, committed when the block finishes and rolled back if anything in it fails.
+    # without the rollback a failed statement leaves a Postgres connection kept for warm invocations in an aborted
+    # transaction, and every statement after it fails too
+    @contextmanager
+    def cursor(self):
+        cursor = self.connection.cursor()
+        try:
+            yield cursor
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+        finally:
+            cursor.close()
+
+    # create every table and index if they don't already exist
+    def create_tables(self):
+        with self.cursor() as cursor:
+            for table, definition in tables.items():
+                key = ", ".join(key_columns(table))
+                columns = ", ".join("%s TEXT" % column for column in definition['columns'])
+                cursor.execute("CREATE TABLE IF NOT EXISTS %s (year INTEGER NOT NULL, %s, PRIMARY KEY (year, %s))" % (table, columns, key))
+
+                for column in definition['indexes']:
+                    cursor.execute("CREATE INDEX IF NOT EXISTS %s_%s_idx ON %s (year, %s)" % (table, column, table, column))
+
+    # replace every row for a year with rows, e.g. after a full sync from squarespace
+    # returns number of rows written
+    def replace(self, table, year, rows):
+        with tracing.span('storage.replace'), self.cursor() as cursor:
+            cursor.execute("DELETE FROM %s WHERE year = %s" % (table, self.placeholder), (year,))
+            self._insert(cursor, table, year, rows, conflict=None)
+        tracing.count('storage.rows', len(rows))
+
+        logging.debug("Replaced %s rows in %s for %s", len(rows), table, year)
+        return len(rows)
+
+    # insert rows for a year, overwriting any row that already has the same key
+    # returns number of rows written
+    def upsert(self, table, year, rows):
+        with tracing.span('storage.upsert'), self.cursor() as cursor:
+            self._insert(cursor, table, year, rows, conflict='update')
+        tracing.count('storage.rows', len(rows))
+
+        logging.debug("Upserted %s rows in %s for %s", len(rows), table, year)
+        return len(rows)
+
+    # insert rows for a year, leaving any row that already has the same key as it was, e.g. a ledger entry from a
+    # redelivered webhook
+    # returns number of rows written
+    def insert(self, table, year, rows):
+        with tracing.span('storage.insert'), self.cursor() as cursor:
+            written = self._insert(cursor, table, year, rows, conflict='ignore')
+        tracing.count('storage.rows', written)
+
+        logging.debug("Inserted %s rows in %s for %s", written, table, year)
+        return written
+
+    # delete rows for a year by key, a chunk of keys per statement. executemany would only report the rowcount of
+    # the last statement under psycopg2
+    # returns number of rows deleted
+    def delete(self, table, year, keys):
+        key = tables[table]['columns'][0]
+        keys = [str(value) for value in keys]
+        deleted = 0
+
+        with tracing.span('storage.delete'), self.cursor() as cursor:
+            for start in range(0, len(keys), delete_chunk_size):
+                chunk = keys[start:start + delete_chunk_size]
+                placeholders = ", ".join([self.placeholder] * len(chunk))
+                cursor.execute("DELETE FROM %s WHERE year = %s AND %s IN (%s)" % (table, self.placeholder, key, placeholders), [year] + chunk)
+                deleted += cursor.rowcount
+        tracing.count('storage.rows', deleted)
+
+        logging.debug("Deleted %s rows from %s for %s", deleted, table, year)
+        return deleted
+
+    # look up one row for a year by key
+    # returns row in list, or None if not found
+    def find(self, table, year, key_value):
+        columns = tables[table]['columns']
+
+        with tracing.span('storage.find'), self.cursor() as cursor:
+            cursor.execute("SELECT %s FROM %s WHERE year = %s AND %s = %s" % (", ".join(columns), table, self.placeholder, columns[0], self.placeholder), (year, str(key_value)))
+            row = cursor.fetchone()
+
+        return list(row) if row else None
+
+    # check whether any of the columns holds value for a year, e.g. an email in either membership email column
+    # returns True if found
+    def contains(self, table, year, columns, value):
+        conditions = " OR ".join("%s = %s" % (column, self.placeholder) for column in columns)
+
+        with tracing.span('storage.contains'), self.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM %s WHERE year = %s AND (%s) LIMIT 1" % (table, self.placeholder, conditions), [year] + [value] * len(columns))
+            found = cursor.fetchone() is not None
+
+        return found
+
+    # every row for a year, e.g. to change a column across the rows that match on something other than the key
+    # returns list of rows
+    def rows(self, table, year):
+        columns = tables[table]['columns']
+
+        with tracing.span('storage.rows'), self.cursor() as cursor:
+            cursor.execute("SELECT %s FROM %s WHERE year = %s ORDER BY %s" % (", ".join(columns), table, self.placeholder, columns[0]), (year,))
+            found = [list(row) for row in cursor.fetchall()]
+
+        return found
+
+    # collect every value held in the columns for a year
+    # returns set of values
+    def values(self, table, year, columns):
+        with tracing.span('storage.values'), self.cursor() as cursor:
+            cursor.execute("SELECT %s FROM %s WHERE year = %s" % (", ".join(columns), table, self.placeholder), (year,))
+            found = set()
+            for row in cursor.fetchall():
+                found.update(row)
+
+        return found
+
+    def close(self):
+        self.connection.close()
+
+    # conflict is None to fail on a key that's already there, 'update' to overwrite its row or 'ignore' to keep it
+    # returns number of rows written
+    def _insert(self, cursor, table, year, rows, conflict):
+        columns = tables[table]['columns']
+        key = key_columns(table)
+        placeholders = ", ".join([self.placeholder] * (len(columns) + 1))
+        statement = "INSERT INTO %s (year, %s) VALUES (%s)" % (table, ", ".join(columns), placeholders)
+
+        if conflict == 'update':
+            updates = ", ".join("%s = excluded.%s" % (column, column) for column in columns if column not in key)
+            statement += " ON CONFLICT (year, %s) DO UPDATE SET %s" % (", ".join(key), updates)
+        elif conflict == 'ignore':
+            statement += " ON CONFLICT (year, %s) DO NOTHING" % ", ".join(key)
+
+        # spreadsheet rows can carry ints and floats, everything is stored as text like the sheets do
+        values = []
+        for row in rows:
+            if len(row) != len(columns):
+                raise ValueError("Row for %s has %s values, expected %s" % (table, len(row), len(columns)))
+            values.append([year] + ['' if value is None else str(value) for value in row])
+
+        if conflict != 'ignore':
+            cursor.executemany(statement, values)
+            return len(values)
+
+        # executemany's rowcount is only the last statement's under psycopg2, so rows are inserted one at a time to
+        # leave the skipped ones out of the count. ignore is for a webhook's row or two, not for a sync
+        written = 0
+        for row in values:
+            cursor.execute(statement, row)
+            written += cursor.rowcount
+
+        return written
+
+# open the SQL store configured by STORAGE_BACKEND
+# sqlite uses the file in STORAGE_PATH, postgres connects with the libpq connection string in STORAGE_URL
+# returns SqlStore, or None when the backend is sheets (the default) and the bots write Google Sheets directly
+def open_store():
+    backend = os.environ.get('STORAGE_BACKEND', 'sheets').lower()
+
+    if backend == 'sheets':
+        return None
+
+    if backend == 'sqlite':
+        connection = sqlite3.connect(os.environ.get('STORAGE_PATH', os.path.join(tempfile.gettempdir(), 'syc.sqlite3')))
+        store = SqlStore(connection, '?')
+    elif backend == 'postgres':
+        import psycopg2
+        connection = psycopg2.connect(os.environ.get('STORAGE_URL'))
+        store = SqlStore(connection, '%s')
+    else:
+        raise ValueError("Unknown STORAGE_BACKEND: %s" % backend)
+
+    store.create_tables()
+    logging.info("Opened %s storage backend", backend)
+
+    return store
+
+# get the configured store, opening it on first use and keeping it for warm invocations
+# returns SqlStore, or None when the backend is sheets
+def get_store():
+    global cached_store
+
+    if cached_store is None:
+        cached_store = open_store()
+
+    return cached_store
+
+# write rows to the configured store, the one place the bots' writers hand their rows to storage. mode is the SqlStore
+# method that writes them: replace, upsert or insert, or delete with rows being the keys to delete. nothing is written
+# with the sheets backend
+# returns True if the bots should still write the spreadsheets
+def persist(table, year, rows, mode='upsert'):
+    store = get_store()
+    if store:
+        getattr(store, mode)(table, year, rows)
+
+    return sheets_export_enabled()
+
+# with a SQL backend the Google Sheets become an optional export. SHEETS_EXPORT=false turns them off
+# returns True if the bots should still write the spreadsheets
+def sheets_export_enabled():
+    if os.environ.get('STORAGE_BACKEND', 'sheets').lower() == 'sheets':
+        return True
+
+    return os.environ.get('SHEETS_EXPORT', 'true').lower() != 'false'
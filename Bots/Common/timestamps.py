@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import functools
+from datetime import datetime
+from lazy import lazy_import
+
+parsedate = lazy_import('dateutil.parser')
+
+# Timestamp parsing and formatting for the parsers, which see the same few timestamps over and over: every order is
+# parsed once per worksheet, and a season's payments fall on a few hundred days. datetime.fromisoformat is much
+# faster than dateutil but, before Python 3.11, doesn't take a Z suffix or a +HHMM offset, so those are rewritten
+# first and anything else it can't read still goes to dateutil
+
+# parse an ISO 8601 timestamp such as Squarespace's 2024-05-01T14:03:22.125Z or Acuity's 2024-05-01T10:00:00-0400.
+# repeated strings come from the cache, datetimes are immutable so sharing them is safe
+# returns datetime
+@functools.lru_cache(maxsize=65536)
+def parse(timestamp):
+    text = timestamp
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    elif 'T' in text and len(text) > 5 and text[-5] in '+-' and text[-4:].isdigit():
+        text = text[:-2] + ':' + text[-2:]
+
+    try:
+        return datetime.fromisoformat(text)
+    except ValueError:
+        return parsedate.isoparse(timestamp)
+
+@functools.lru_cache(maxsize=4096)
+def format_day(day, pattern):
+    return day.strftime(pattern)
+
+# format the date part of a datetime, e.g. format_date(moment, "%B %d %Y"). each day is formatted once per pattern,
+# so the pattern should only use the date: year, month, day and weekday
+# returns string
+def format_date(moment, pattern):
+    return format_day(moment.date(), pattern)
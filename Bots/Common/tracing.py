@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+# timings and counters for the current invocation, cleared by start()
+# spans is {span name: {'calls': n, 'errors': n, 'seconds': total, 'max_seconds': slowest}}
+# counters is {counter name: total}, e.g. 'sheets.rows' or 'acuity.bytes'
+spans = {}
+counters = {}
+invocation = {}
+
+# calls can be made from several threads at once, e.g. sheets_writer's parallel writes
+lock = threading.Lock()
+
+# begin a new invocation, dropping whatever the last warm invocation recorded
+def start(name, **fields):
+    spans.clear()
+    counters.clear()
+    invocation.clear()
+    invocation.update(fields)
+    invocation['name'] = name
+    invocation['started'] = time.perf_counter()
+
+# time one external call, e.g. with tracing.span('sheets.values_batch_update'):
+# spans are named <service>.<call>, and each one also counts towards <service>.calls
+@contextmanager
+def span(name):
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+
+        with lock:
+            timing = spans.get(name)
+            if timing is None:
+                timing = spans[name] = {'calls': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+            timing['calls'] += 1
+            timing['errors'] += failed
+            timing['seconds'] += elapsed
+            timing['max_seconds'] = max(timing['max_seconds'], elapsed)
+
+        count(name.split('.')[0] + '.calls')
+
+# add to a counter, e.g. tracing.count('sheets.rows', len(rows)) or tracing.count('acuity.retries')
+def count(name, amount=1):
+    with lock:
+        counters[name] = counters.get(name, 0) + amount
+
+# build the summary for the invocation so far
+# returns dict that serializes to JSON
+def summary(**fields):
+    result = {key: value for key, value in invocation.items() if key != 'started'}
+    result.update(fields)
+
+    if 'started' in invocation:
+        result['seconds'] = round(time.perf_counter() - invocation['started'], 4)
+
+    result['spans'] = {
+        name: dict(timing, seconds=round(timing['seconds'], 4), max_seconds=round(timing['max_seconds'], 4))
+        for name, timing in spans.items()
+    }
+    result['counters'] = dict(counters)
+
+    return result
+
+# print the invocation summary as one JSON line, so CloudWatch Logs Insights can query it whatever LOGLEVEL is set to
+# returns the summary
+def finish(**fields):
+    result = summary(**fields)
+    print(json.dumps({'trace': result}, sort_keys=True))
+    return result
+
+# time every Google API request a gspread client makes. gspread 5 sends each Sheets and Drive call through
+# Client.request, so wrapping it there covers opens, reads, writes, shares and batch updates alike
+# returns the same client
+def trace_gspread(client):
+    request = client.request
+
+    def traced_request(method, endpoint, *args, **kwargs):
+        service = 'drive' if 'googleapis.com/drive' in endpoint else 'sheets'
+        with span('%s.%s' % (service, method.lower())):
+            response = request(method, endpoint, *args, **kwargs)
+        count('%s.bytes' % service, len(response.content))
+        return response
+
+    client.request = traced_request
+    return client
@@ -1,16 +1,27 @@
 #!/usr/bin/env python3
 
 
+import base64
+import json
 import os
 import sys
 import logging
-import requests
-import gspread
-import stripe
-from gspread.exceptions import *
-from oauth2client.service_account import ServiceAccountCredentials
+import ratelimit
+import rollups
+import runstate
+import sheets_writer
+import storage
+import time
+import timestamps
+import tracing
 from datetime import date, datetime, timedelta
-from dateutil import parser as parsedate
+from lazy import lazy_import
+
+# heavy clients are imported on first use to keep cold starts short, see Common/lazy.py
+gspread = lazy_import('gspread')
+requests = lazy_import('requests')
+service_account = lazy_import('oauth2client.service_account')
+stripe = lazy_import('stripe')
 
 filter_type_members = [
                         'Family Membership',
@@ -142,6 +153,43 @@ spreadsheet_header_stripe_transactions = [
                         'Txn Id',
                     ]
 
+spreadsheet_header_payment_reconciliation = [
+                        'Stripe Charge Id',
+                        'Status',
+                        'Order Id',
+                        'Customer Email',
+                        'Paid On',
+                        'Squarespace Total',
+                        'Stripe Total',
+                        'Squarespace Fees',
+                        'Stripe Fees',
+                        'Fee Difference',
+                        'Txn Id',
+                    ]
+
+spreadsheet_header_summary = [
+                        'Source',
+                        'Grouping',
+                        'Value',
+                        'Count',
+                        'Total',
+                        'Fees',
+                        'Net',
+                        'Discounts',
+                    ]
+
+# what the summary adds up for each group, the columns after Count in the summary worksheet
+summary_measures = ['Total', 'Fees', 'Net', 'Discounts']
+
+# reconciliation statuses, in the order the worksheet lists them so the ones needing a look come first
+payment_statuses = [
+                        'Fee discrepancy',
+                        'Amount discrepancy',
+                        'Squarespace only',
+                        'Stripe only',
+                        'Matched',
+                    ]
+
 admin_email_accts = [
                         'commodore@sherbornyachtclub.org',
                         'info@sherbornyachtclub.org',
@@ -157,67 +205,141 @@ treasurer_email_accts = [
                         ]
 
 date_string = "%B %d %Y"
+month_string = "%Y-%m"
+
+# worksheets the sync functions have rewritten, written out a spreadsheet at a time by write_planned()
+write_plan = sheets_writer.WritePlan()
 
-def get_spreadsheet(spreadsheet_title, addtl_share_perms=[], notify_users=False):
+# fingerprints of the rows each worksheet was last written with, kept in the run state between hourly runs
+# a worksheet is rewritten anyway once its fingerprint is this old, which puts back any hand edits
+fingerprint_max_age = 24 * 60 * 60
+run_state = {}
+
+# parsed Squarespace and Stripe transactions from this run, and the Squarespace orders they're for, kept for the
+# payment reconciliation and the summary
+parsed_payments = {}
+
+# worksheets this run left alone because nothing changed, reported at the end of the run
+skipped_targets = []
+
+def get_spreadsheet(spreadsheet_title, addtl_share_perms=[], notify_users=False, reshare=True):
 
     # define the scope
     scope = ['https://spreadsheets.google.com/feeds','https://www.googleapis.com/auth/drive']
 
     # add credentials to the account
-    credentials = ServiceAccountCredentials.from_json_keyfile_name('googleCreds.json', scope)
+    credentials = service_account.ServiceAccountCredentials.from_json_keyfile_name('googleCreds.json', scope)
 
     # authorize the clientsheet
-    client = gspread.authorize(credentials)
+    # the metadata read while opening is kept for sheets_writer, which would otherwise read it again to write
+    client = sheets_writer.keep_opened_metadata(ratelimit.limit_gspread(tracing.trace_gspread(gspread.authorize(credentials))))
 
     # get the instance of the Spreadsheet
     try:
         handler = client.open(spreadsheet_title)
-    except SpreadsheetNotFound:
+    except gspread.exceptions.SpreadsheetNotFound:
         # only notify users if we had to create a new sheet
         notify_users = True
         handler = client.create(spreadsheet_title)
 
-    logging.info("Sheet '%s' available at: %s" % (spreadsheet_title, handler.url))
+    logging.info("Sheet '%s' available at: %s", spreadsheet_title, handler.url)
 
+    # re-sharing an existing spreadsheet every run can wait if the Sheets budget is low, a new one is shared right away
+    # single order updates don't re-share at all, the hourly run takes care of that
     email_perms = admin_email_accts + addtl_share_perms
     for email in email_perms:
-        handler.share(email, perm_type='user', role='reader', notify=notify_users)
+        if not notify_users and not reshare:
+            break
+        elif notify_users:
+            handler.share(email, perm_type='user', role='reader', notify=notify_users)
+        else:
+            ratelimit.defer(handler.share, email, perm_type='user', role='reader', notify=notify_users)
 
     logging.debug("Found spreadsheet and returning handler")
     return handler
 
-def update_spreadsheet(spreadsheet, worksheet_title, header_row, rows_to_add):
-
-    # make a spreadsheet for the year if necessary
-    # set the target_sheet for the sheet we'll be writing to
-    worksheets = spreadsheet.worksheets()
+# check the rows for a worksheet against the fingerprint of what the last run wrote to it
+# returns the new fingerprint to record once the write succeeds, or None if the worksheet hasn't changed
+def fingerprint_if_changed(spreadsheet_title, worksheet_title, header_row, rows):
+    target = "%s/%s" % (spreadsheet_title, worksheet_title)
+    fingerprint = runstate.fingerprint(header_row, rows)
+
+    last = run_state.get('fingerprints', {}).get(target)
+    if last and last['fingerprint'] == fingerprint and time.time() - last['written'] < fingerprint_max_age:
+        logging.info("No changes for %s since %s, skipping it", target, datetime.fromtimestamp(last['written']))
+        skipped_targets.append(target)
+        tracing.count('sheets.skipped')
+        return None
+
+    return fingerprint
+
+# remember the fingerprint of the rows a worksheet was just written with
+def record_fingerprint(spreadsheet_title, worksheet_title, fingerprint):
+    target = "%s/%s" % (spreadsheet_title, worksheet_title)
+    run_state.setdefault('fingerprints', {})[target] = {'fingerprint': fingerprint, 'written': int(time.time())}
+
+# write out every worksheet the sync functions planned, each spreadsheet in a few batched requests
+# returns 0 if successful
+def write_planned():
+    if write_plan.commit(get_spreadsheet):
+        return 1
+    return 0
 
+# add or update rows in a worksheet, matching them on the order number in column A, instead of rewriting the whole
+# worksheet. the worksheet is created with its header if it doesn't exist yet
+# returns tuple of counts of rows updated and added
+def upsert_rows(spreadsheet, worksheet_title, header_row, rows):
     target_sheet = None
-    for sheet in worksheets:
+    for sheet in spreadsheet.worksheets():
         if sheet.title == worksheet_title:
-            logging.debug("Found target_sheet: %s" % target_sheet)
             target_sheet = sheet
 
-    # If sheet was not found create it
-    if not target_sheet:
-        logging.debug("Added worksheet: %s" % worksheet_title)
-        target_sheet = spreadsheet.add_worksheet(title=worksheet_title, rows=1, cols=len(rows_to_add[0]))
+    if target_sheet is None:
+        logging.debug("Added worksheet: %s", worksheet_title)
+        target_sheet = spreadsheet.add_worksheet(title=worksheet_title, rows=1, cols=len(header_row))
+        target_sheet.append_row(header_row, value_input_option='USER_ENTERED')
+        ratelimit.defer(target_sheet.freeze, rows=1)
+        order_numbers = [str(header_row[0])]
+    else:
+        order_numbers = target_sheet.col_values(1)
+
+    updates = []
+    additions = []
+    for row in rows:
+        if str(row[0]) in order_numbers:
+            updates.append({'range': "%s!A%s" % (sheets_writer.quote_title(worksheet_title), order_numbers.index(str(row[0])) + 1), 'values': [row]})
+        else:
+            additions.append(row)
+
+    if updates:
+        spreadsheet.values_batch_update(body={'valueInputOption': 'USER_ENTERED', 'data': updates})
+    if additions:
+        target_sheet.append_rows(additions, value_input_option='USER_ENTERED', table_range='A1')
+
+    tracing.count('sheets.rows', len(rows))
+    return (len(updates), len(additions))
 
+# mark the existing mooring rows of everyone in emails as having mooring services, for services bought on an order
+# of their own. rows are matched with email_key, the same join format_moorings makes in a full sync
+# returns number of rows changed
+def mark_mooring_services(spreadsheet, emails):
     try:
-        target_sheet.delete_rows(1)
-    except Exception as e:
-        logging.debug("Caught exception deleting the first row: %s" % e)
+        target_sheet = spreadsheet.worksheet('Moorings')
+    except gspread.exceptions.WorksheetNotFound:
+        return 0
 
-    target_sheet.clear()
-    target_sheet.resize(rows=1)
-    target_sheet.append_row(header_row, value_input_option='USER-ENTERED')
+    services_column = spreadsheet_header_moorings.index('Services')
+    updates = []
+    for (index, row) in enumerate(target_sheet.get_all_values()[1:], start=2):
+        row = row + [''] * (len(spreadsheet_header_moorings) - len(row))
+        if email_key(row[2]) in emails and row[services_column] != 'Yes':
+            updates.append({'range': "%s!%s" % (sheets_writer.quote_title(target_sheet.title), gspread.utils.rowcol_to_a1(index, services_column + 1)), 'values': [['Yes']]})
 
-    start_row = 1
-    target_sheet.append_rows(rows_to_add, value_input_option='USER-ENTERED', table_range='A{}'.format(start_row))
-    target_sheet.columns_auto_resize(0, len(rows_to_add[0]))
-    target_sheet.freeze(rows=1)
+    if updates:
+        spreadsheet.values_batch_update(body={'valueInputOption': 'USER_ENTERED', 'data': updates})
 
-    return True
+    tracing.count('sheets.rows', len(updates))
+    return len(updates)
 
 ## function to get a nested list of all orders from squarespace
 ## returns: dictionary of orders from json result
@@ -231,7 +353,9 @@ def get_squarespace_items(api_endpoint, json_return, parameters):
         "User-Agent": "MembershipBot"
     }
 
-    response = requests.get(api_endpoint, headers=headers, params=parameters)
+    with tracing.span('squarespace.get'):
+        response = requests.get(api_endpoint, headers=headers, params=parameters)
+    tracing.count('squarespace.bytes', len(response.content))
     if response.raise_for_status():
         pass
     else:
@@ -244,10 +368,10 @@ def get_squarespace_items(api_endpoint, json_return, parameters):
         if json_data['pagination']['hasNextPage']:
             return (item_list + get_squarespace_items(json_data['pagination']['nextPageUrl'], json_return, None))
     else:
-        logging.error("Return status from response was requests.get was NOT OK: %s" % response.status_code)
+        logging.error("Return status from response was requests.get was NOT OK: %s", response.status_code)
         return False
 
-    logging.debug("Got item_list from get_squarespace_items of: %s" % item_list)
+    logging.debug("Got item_list from get_squarespace_items of: %s", item_list)
     return item_list
 
 def parse_squarespace_orders(unparsed_orders, filter_types):
@@ -308,7 +432,7 @@ def parse_squarespace_orders(unparsed_orders, filter_types):
 
         parsed_order['home_address'] = street_address + ", " + member['billingAddress']['city'] + ", " + member['billingAddress']['state'] + " " + member['billingAddress']['postalCode']
 
-        parsed_order['year'] = parsedate.isoparse(member['modifiedOn']).year
+        parsed_order['year'] = timestamps.parse(member['modifiedOn']).year
         parsed_order['fulfillment'] = member['fulfillmentStatus']
         parsed_order['price_paid'] = member['grandTotal']['value']
         parsed_order['price_discount'] = member['discountTotal']['value']
@@ -387,7 +511,7 @@ def parse_squarespace_orders(unparsed_orders, filter_types):
         if add_member_to_list:
             parsed_orderlist.append(parsed_order)
 
-    logging.debug("Returning parsed_orderlist from parse_squarespace_orders: %s" % parsed_orderlist)
+    logging.debug("Returning parsed_orderlist from parse_squarespace_orders: %s", parsed_orderlist)
     return parsed_orderlist
 
 def parse_squarespace_transactions(unparsed_transactions):
@@ -408,9 +532,11 @@ def parse_squarespace_transactions(unparsed_transactions):
                             'payments_processing_fees': '',
                             'payments_paidon': '',
                             'payments_externalid': '',
+                            'month': '',
                             }
 
         parsed_transaction['order_id'] = tx['salesOrderId']
+        parsed_transaction['month'] = timestamps.format_date(timestamps.parse(tx['createdOn']), month_string)
         parsed_transaction['email'] = tx['customerEmail']
         parsed_transaction['total'] = float(tx['total']['value'])
         parsed_transaction['total_tax'] = float(tx['totalTaxes']['value'])
@@ -432,7 +558,9 @@ def parse_squarespace_transactions(unparsed_transactions):
         try:
             parsed_transaction['payments_creditcard'] = tx['payments'][0]['creditCardType']
             parsed_transaction['payments_provider'] = tx['payments'][0]['provider']
-            parsed_transaction['payments_paidon'] = parsedate.isoparse(tx['payments'][0]['paidOn']).strftime(date_string)
+            paid = timestamps.parse(tx['payments'][0]['paidOn'])
+            parsed_transaction['payments_paidon'] = timestamps.format_date(paid, date_string)
+            parsed_transaction['month'] = timestamps.format_date(paid, month_string)
             parsed_transaction['payments_externalid'] = tx['payments'][0]['externalTransactionId']
 
             fees = 0
@@ -445,7 +573,7 @@ def parse_squarespace_transactions(unparsed_transactions):
 
         parsed_tx_list.append(parsed_transaction)
 
-    logging.debug("Returning parsed_tx_list from parse_squarespace_transactions: %s" % parsed_tx_list)
+    logging.debug("Returning parsed_tx_list from parse_squarespace_transactions: %s", parsed_tx_list)
     return parsed_tx_list
 
 def parse_stripe_transactions(unparsed_transactions, year):
@@ -464,10 +592,13 @@ def parse_stripe_transactions(unparsed_transactions, year):
                             'payments_available': '',
                             'payments_externalid': '',
                             'payments_processing_fees': '',
+                            'month': '',
                             }
 
-        parsed_transaction['payments_paidon'] = datetime.fromtimestamp(tx['created']).strftime(date_string)
-        parsed_transaction['payments_available'] = datetime.fromtimestamp(tx['available_on']).strftime(date_string)
+        created = datetime.fromtimestamp(tx['created'])
+        parsed_transaction['payments_paidon'] = timestamps.format_date(created, date_string)
+        parsed_transaction['month'] = timestamps.format_date(created, month_string)
+        parsed_transaction['payments_available'] = timestamps.format_date(datetime.fromtimestamp(tx['available_on']), date_string)
 
         parsed_transaction['order_id'] = tx['id']
         parsed_transaction['description'] = tx['description']
@@ -482,10 +613,10 @@ def parse_stripe_transactions(unparsed_transactions, year):
         parsed_transaction['type'] = tx['type']
         parsed_transaction['payments_externalid'] = tx['source']
 
-        if (datetime.fromtimestamp(tx['created']).year) == year:
+        if created.year == year:
             parsed_tx_list.append(parsed_transaction)
 
-    logging.debug("Returning parsed_tx_list from parse_stripe_transactions: %s" % parsed_tx_list)
+    logging.debug("Returning parsed_tx_list from parse_stripe_transactions: %s", parsed_tx_list)
     return parsed_tx_list
 
 def sync_stripe_transactions(transacts_in_json, year):
@@ -495,6 +626,7 @@ def sync_stripe_transactions(transacts_in_json, year):
 
     formatted_transacts = []
     parsed_transacts = parse_stripe_transactions(transacts_in_json, year)
+    parsed_payments['stripe'] = parsed_transacts
 
     for tx in parsed_transacts:
         formatted_tx = [
@@ -511,26 +643,20 @@ def sync_stripe_transactions(transacts_in_json, year):
                         ]
         formatted_transacts.append(formatted_tx)
 
-    # get the spreadsheet handler
-    gs = get_spreadsheet(spreadsheet_title, treasurer_email_accts)
-
-    # update the google sheet
-    # check for column 1 for non-duplicate entries
-    try:
-        update_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_transacts)
-    except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
-        return 1
+    # skip the worksheet entirely if the rows are the same ones the last run wrote
+    fingerprint = fingerprint_if_changed(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_transacts)
+    if fingerprint is None:
+        return 0
 
+    # written together with the spreadsheet's other worksheets by write_planned(), which records the fingerprint
+    write_plan.write_worksheet(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_transacts, treasurer_email_accts,
+                               on_written=lambda: record_fingerprint(spreadsheet_title, worksheet_title, fingerprint))
     return 0
 
-def sync_memberships(orders_in_json, year):
-    spreadsheet_title = "SYC Waterfront - Year %s" % year
-    worksheet_title = 'Memberships'
-    spreadsheet_header = spreadsheet_header_members
-
+# format orders parsed with filter_type_members into memberships worksheet rows
+# returns list of rows
+def format_memberships(parsed_orders):
     formatted_orders = []
-    parsed_orders = parse_squarespace_orders(orders_in_json, filter_type_members)
     for order in parsed_orders:
         formatted_order = [
                             order['order_no'],
@@ -559,31 +685,49 @@ def sync_memberships(orders_in_json, year):
                             ]
         formatted_orders.append(formatted_order)
 
+    return formatted_orders
+
+def sync_memberships(orders_in_json, year):
+    spreadsheet_title = "SYC Waterfront - Year %s" % year
+    worksheet_title = 'Memberships'
+    spreadsheet_header = spreadsheet_header_members
+
+    formatted_orders = format_memberships(parse_squarespace_orders(orders_in_json, filter_type_members))
+
     if not formatted_orders:
         return 0
 
-    # get the spreadsheet handler
-    gs = get_spreadsheet(spreadsheet_title, waterfront_email_accts)
+    if not storage.persist('memberships', year, formatted_orders, mode='replace'):
+        return 0
 
-    # update the google sheet
-    # check for column 1 for non-duplicate entries
-    try:
-        logging.debug("Writing out to memberships spreadsheet: %s" % formatted_orders)
-        update_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_orders)
-    except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
-        return 1
+    # skip the worksheet entirely if the rows are the same ones the last run wrote
+    fingerprint = fingerprint_if_changed(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_orders)
+    if fingerprint is None:
+        return 0
 
+    # written together with the spreadsheet's other worksheets by write_planned(), which records the fingerprint
+    logging.debug("Planning memberships spreadsheet: %s", formatted_orders)
+    write_plan.write_worksheet(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_orders, waterfront_email_accts,
+                               on_written=lambda: record_fingerprint(spreadsheet_title, worksheet_title, fingerprint))
     return 0
 
-def sync_moorings(orders_in_json, year):
-    spreadsheet_title = "SYC Waterfront - Year %s" % year
-    worksheet_title = 'Moorings'
-    spreadsheet_header = spreadsheet_header_moorings
+# normalize an email for matching orders from the same person, Squarespace keeps whatever case and spacing was typed
+# returns string
+def email_key(email):
+    return (email or '').strip().lower()
 
+# format orders parsed with filter_type_moorings_all into moorings worksheet rows. mooring services bought on a
+# separate order are joined onto every mooring row with the same email, through an index of the rows built once.
+# services on a canceled order don't count
+# returns list of rows
+def format_moorings(parsed_orders):
     formatted_orders = []
-    parsed_orders = parse_squarespace_orders(orders_in_json, filter_type_moorings_all)
+    moorings_by_email = {}
+
     for order in parsed_orders:
+        if order['mooring_location'] == '':
+            continue
+
         formatted_order = [
                             order['order_no'],
                             order['name'],
@@ -596,40 +740,46 @@ def sync_moorings(orders_in_json, year):
                             order['town_permit_no'],
                             order['mooring_svcs'],
                             ]
+        formatted_orders.append(formatted_order)
+        moorings_by_email.setdefault(email_key(order['email']), []).append(formatted_order)
 
-        if order['mooring_location'] != '':
-            formatted_orders.append(formatted_order)
+    for order in parsed_orders:
+        if order['mooring_location'] != '' or order['mooring_svcs'] != 'Yes' or order['fulfillment'] == 'CANCELED':
+            continue
+
+        for formatted_order in moorings_by_email.get(email_key(order['email']), []):
+            formatted_order[9] = 'Yes'
+
+    return formatted_orders
+
+def sync_moorings(orders_in_json, year):
+    spreadsheet_title = "SYC Waterfront - Year %s" % year
+    worksheet_title = 'Moorings'
+    spreadsheet_header = spreadsheet_header_moorings
 
-    for unformatted_order in parsed_orders:
-        if ((unformatted_order['mooring_location'] == '') and (unformatted_order['mooring_svcs'] == 'yes')):
-            # Loop through the formatted orders list and update for mooring services
-            for formatted_order in formatted_orders:
-                if unformatted_order['email'] == formatted_order[2]:
-                    formatted_order[8] = 'yes'
+    formatted_orders = format_moorings(parse_squarespace_orders(orders_in_json, filter_type_moorings_all))
 
     if not formatted_orders:
         return 0
 
-    # get the spreadsheet handler
-    gs = get_spreadsheet(spreadsheet_title, waterfront_email_accts)
+    if not storage.persist('moorings', year, formatted_orders, mode='replace'):
+        return 0
 
-    # update the google sheet
-    try:
-        logging.debug("Writing out to mooring spreadsheet: %s" % formatted_orders)
-        update_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_orders)
-    except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
-        return 1
+    # skip the worksheet entirely if the rows are the same ones the last run wrote
+    fingerprint = fingerprint_if_changed(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_orders)
+    if fingerprint is None:
+        return 0
 
+    # written together with the spreadsheet's other worksheets by write_planned(), which records the fingerprint
+    logging.debug("Planning mooring spreadsheet: %s", formatted_orders)
+    write_plan.write_worksheet(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_orders, waterfront_email_accts,
+                               on_written=lambda: record_fingerprint(spreadsheet_title, worksheet_title, fingerprint))
     return 0
 
-def sync_orders(orders_in_json, year):
-    spreadsheet_title = 'SYC Orders'
-    worksheet_title = "Year %s" % year
-    spreadsheet_header = spreadsheet_header_orders
-
+# format orders parsed with filter_type_orders into orders worksheet rows
+# returns list of rows
+def format_orders(parsed_orders):
     formatted_orders = []
-    parsed_orders = parse_squarespace_orders(orders_in_json, filter_type_orders)
     for order in parsed_orders:
         formatted_order = [
                             order['order_no'],
@@ -667,18 +817,24 @@ def sync_orders(orders_in_json, year):
                             ]
         formatted_orders.append(formatted_order)
 
-    # get the spreadsheet handler
-    gs = get_spreadsheet(spreadsheet_title)
+    return formatted_orders
 
-    # update the google sheet
-    # check for column 1 for non-duplicate entries
-    try:
-        logging.debug("Writing out to squarespace orders spreadsheet: %s" % formatted_orders)
-        update_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_orders)
-    except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
-        return 1
+def sync_orders(orders_in_json, year):
+    spreadsheet_title = 'SYC Orders'
+    worksheet_title = "Year %s" % year
+    spreadsheet_header = spreadsheet_header_orders
 
+    formatted_orders = format_orders(parse_squarespace_orders(orders_in_json, filter_type_orders))
+
+    # skip the worksheet entirely if the rows are the same ones the last run wrote
+    fingerprint = fingerprint_if_changed(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_orders)
+    if fingerprint is None:
+        return 0
+
+    # written together with the spreadsheet's other worksheets by write_planned(), which records the fingerprint
+    logging.debug("Planning squarespace orders spreadsheet: %s", formatted_orders)
+    write_plan.write_worksheet(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_orders,
+                               on_written=lambda: record_fingerprint(spreadsheet_title, worksheet_title, fingerprint))
     return 0
 
 def sync_squarespace_transactions(transacts_in_json, year):
@@ -688,6 +844,7 @@ def sync_squarespace_transactions(transacts_in_json, year):
 
     formatted_transacts = []
     parsed_transacts = parse_squarespace_transactions(transacts_in_json)
+    parsed_payments['squarespace'] = parsed_transacts
 
     for tx in parsed_transacts:
         formatted_tx = [
@@ -707,21 +864,174 @@ def sync_squarespace_transactions(transacts_in_json, year):
                         ]
         formatted_transacts.append(formatted_tx)
 
-    # get the spreadsheet handler
-    gs = get_spreadsheet(spreadsheet_title, treasurer_email_accts)
+    # skip the worksheet entirely if the rows are the same ones the last run wrote
+    fingerprint = fingerprint_if_changed(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_transacts)
+    if fingerprint is None:
+        return 0
 
-    # update the google sheet
-    # check for column 1 for non-duplicate entries
-    try:
-        logging.debug("Writing out to squarespace transactions spreadsheet: %s" % formatted_transacts)
-        update_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_transacts)
-    except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
-        return 1
+    # written together with the spreadsheet's other worksheets by write_planned(), which records the fingerprint
+    logging.debug("Planning squarespace transactions spreadsheet: %s", formatted_transacts)
+    write_plan.write_worksheet(spreadsheet_title, worksheet_title, spreadsheet_header, formatted_transacts, treasurer_email_accts,
+                               on_written=lambda: record_fingerprint(spreadsheet_title, worksheet_title, fingerprint))
 
     logging.info("Finished writing out squarespace transactions")
     return 0
 
+# match Squarespace payments to Stripe charges on charge id. Stripe charges are indexed by source id once, then each
+# Squarespace payment paid through Stripe looks its charge up, so both lists are walked once. voided payments and
+# ones through other providers aren't expected in Stripe, and only Stripe charges are expected in Squarespace
+# returns tuple of reconciliation rows grouped by status, and report dictionary of counts and totals per status
+def reconcile_payments(squarespace_transacts, stripe_transacts):
+    charges = {}
+    for tx in stripe_transacts:
+        if tx['type'] == 'charge' and tx['payments_externalid']:
+            charges.setdefault(tx['payments_externalid'], []).append(tx)
+
+    rows_by_status = {status: [] for status in payment_statuses}
+
+    for tx in squarespace_transacts:
+        charge_id = tx['payments_externalid']
+        if not charge_id or tx['voided'] == 'Yes' or str(tx['payments_provider']).upper() != 'STRIPE':
+            continue
+
+        matches = charges.get(charge_id)
+        if not matches:
+            rows_by_status['Squarespace only'].append([charge_id, 'Squarespace only', tx['order_id'], tx['email'], tx['payments_paidon'],
+                                                       tx['total'], '', tx['payments_processing_fees'], '', '', ''])
+            continue
+
+        charge = matches.pop(0)
+        if not matches:
+            del charges[charge_id]
+
+        fee_difference = round(float(tx['payments_processing_fees'] or 0) - charge['payments_processing_fees'], 2)
+        if abs(float(tx['total'] or 0) - charge['total']) >= 0.005:
+            status = 'Amount discrepancy'
+        elif abs(fee_difference) >= 0.005:
+            status = 'Fee discrepancy'
+        else:
+            status = 'Matched'
+
+        rows_by_status[status].append([charge_id, status, tx['order_id'], tx['email'] or charge['email'].strip(), tx['payments_paidon'],
+                                       tx['total'], charge['total'], tx['payments_processing_fees'], charge['payments_processing_fees'],
+                                       fee_difference, charge['order_id']])
+
+    for matches in charges.values():
+        for charge in matches:
+            rows_by_status['Stripe only'].append([charge['payments_externalid'], 'Stripe only', '', charge['email'].strip(), charge['payments_paidon'],
+                                                  '', charge['total'], '', charge['payments_processing_fees'], '', charge['order_id']])
+
+    report = {}
+    for (status, rows) in rows_by_status.items():
+        report[status] = {
+            'count': len(rows),
+            'squarespace_total': round(sum(row[5] for row in rows if row[5] != ''), 2),
+            'stripe_total': round(sum(row[6] for row in rows if row[6] != ''), 2),
+            'fee_difference': round(sum(row[9] for row in rows if row[9] != ''), 2),
+        }
+
+    return ([row for status in payment_statuses for row in rows_by_status[status]], report)
+
+# write the payment reconciliation worksheet from the transactions this run parsed, next to the Squarespace and
+# Stripe worksheets it matches up, and log the discrepancy report
+# returns 0 if successful
+def sync_payment_reconciliation(year):
+    spreadsheet_title = 'SYC Transactions'
+    worksheet_title = "Reconciliation %s" % year
+    spreadsheet_header = spreadsheet_header_payment_reconciliation
+
+    if 'squarespace' not in parsed_payments or 'stripe' not in parsed_payments:
+        logging.warning("Need both Squarespace and Stripe transactions to reconcile payments, skipping it")
+        return 1
+
+    (reconciled, report) = reconcile_payments(parsed_payments['squarespace'], parsed_payments['stripe'])
+
+    for status in payment_statuses:
+        logging.info("Payment reconciliation: %s %s, Squarespace $%.2f, Stripe $%.2f, fee difference $%.2f", report[status]['count'], status.lower(),
+                     report[status]['squarespace_total'], report[status]['stripe_total'], report[status]['fee_difference'])
+    tracing.count('payments.discrepancies', sum(report[status]['count'] for status in payment_statuses if status != 'Matched'))
+
+    # skip the worksheet entirely if the rows are the same ones the last run wrote
+    fingerprint = fingerprint_if_changed(spreadsheet_title, worksheet_title, spreadsheet_header, reconciled)
+    if fingerprint is None:
+        return 0
+
+    # written together with the spreadsheet's other worksheets by write_planned(), which records the fingerprint
+    write_plan.write_worksheet(spreadsheet_title, worksheet_title, spreadsheet_header, reconciled, treasurer_email_accts,
+                               on_written=lambda: record_fingerprint(spreadsheet_title, worksheet_title, fingerprint))
+    return 0
+
+# split what the summary adds up from this year's transactions into months: the amounts of each Squarespace payment
+# with the product name and amount of its order's line items, so a changed order changes its month too, and the
+# reporting category and amounts of each Stripe balance transaction. voided payments didn't bring anything in and
+# aren't counted
+# returns dict of month to list of [source, category, total, fees, net, discounts, list of [product name, amount]]
+def summary_partitions(squarespace_transacts, stripe_transacts, orders):
+    line_items = {}
+    for order in orders:
+        line_items[order['id']] = [[line_item['productName'], float(line_item['unitPricePaid']['value']) * line_item.get('quantity', 1)]
+                                   for line_item in order['lineItems']]
+
+    partitions = {}
+    for tx in squarespace_transacts:
+        if tx['voided'] != 'Yes':
+            partitions.setdefault(tx['month'], []).append(['Squarespace', '', tx['total'], tx['payments_processing_fees'], tx['total_netpayment'],
+                                                           tx['discounts'], line_items.get(tx['order_id'], [])])
+
+    for tx in stripe_transacts:
+        partitions.setdefault(tx['month'], []).append(['Stripe', tx['category'], tx['total'], tx['payments_processing_fees'], tx['total_netpayment'],
+                                                       '', []])
+
+    return partitions
+
+# turn a month of summary_partitions() into records for the rollup. Squarespace payments count towards the month and
+# their line items towards their products. Stripe balance transactions count towards the month and their reporting
+# category, except that payouts only move money to the bank so they're left out of the month
+# returns generator of (group labels, values for summary_measures)
+def summary_records(month, items):
+    for (source, category, total, fees, net, discounts, line_items) in items:
+        if source == 'Squarespace':
+            yield ((('Squarespace', 'Month', month),), (total, fees, net, discounts))
+            for (product, amount) in line_items:
+                yield ((('Squarespace', 'Product', product),), (amount, 0, amount, 0))
+        elif category == 'payout':
+            yield ((('Stripe', 'Category', category),), (total, fees, net, discounts))
+        else:
+            yield ((('Stripe', 'Month', month), ('Stripe', 'Category', category)), (total, fees, net, discounts))
+
+# write the summary worksheet of totals by month, category and product. the totals are kept in the run state a month
+# at a time, so a run only adds up again the months whose transactions changed since the last one, see
+# Common/rollups.py
+# returns 0 if successful
+def sync_summary(year):
+    spreadsheet_title = 'SYC Transactions'
+    worksheet_title = "Summary %s" % year
+    spreadsheet_header = spreadsheet_header_summary
+
+    if 'squarespace' not in parsed_payments or 'stripe' not in parsed_payments or 'orders' not in parsed_payments:
+        logging.warning("Need Squarespace orders and transactions and Stripe transactions to summarize payments, skipping it")
+        return 1
+
+    # only this year's totals are kept, a new year starts from nothing
+    rollup = rollups.Rollup.from_state(run_state.get('summaries', {}).get(str(year)), summary_measures)
+
+    partitions = summary_partitions(parsed_payments['squarespace'], parsed_payments['stripe'], parsed_payments['orders'])
+    (changed, dropped) = rollup.update(partitions, summary_records)
+    logging.info("Summary %s: added up %s of %s months, dropped %s", year, changed, len(partitions), dropped)
+
+    run_state['summaries'] = {str(year): rollup.to_state()}
+    summary = rollup.rows()
+
+    # skip the worksheet entirely if the rows are the same ones the last run wrote
+    fingerprint = fingerprint_if_changed(spreadsheet_title, worksheet_title, spreadsheet_header, summary)
+    if fingerprint is None:
+        return 0
+
+    # written together with the spreadsheet's other worksheets by write_planned(), which records the fingerprint
+    write_plan.write_worksheet(spreadsheet_title, worksheet_title, spreadsheet_header, summary, treasurer_email_accts,
+                               on_written=lambda: record_fingerprint(spreadsheet_title, worksheet_title, fingerprint))
+    return 0
+
 def sync_squarespace(year):
     orders_api_endpoint = "https://api.squarespace.com/1.0/commerce/orders"
     transactions_api_endpoint = "https://api.squarespace.com/1.0/commerce/transactions"
@@ -747,9 +1057,11 @@ def sync_squarespace(year):
             return 0
 
     except requests.exceptions.HTTPError as error:
-        logging.error("Failed to get new members: %s" % error)
+        logging.error("Failed to get new members: %s", error)
         return 1
 
+    parsed_payments['orders'] = orders
+
     # Sync orders
     if sync_orders(orders, year) == 0:
         logging.info("Finished writing out Squarespace orders report")
@@ -773,13 +1085,13 @@ def sync_squarespace(year):
     try:
         json_var = 'documents'
         transactions = get_squarespace_items(transactions_api_endpoint, json_var, request_parameters)
-        logging.debug("Got raw transactions: %s" % transactions)
+        logging.debug("Got raw transactions: %s", transactions)
         if not transactions:
             logging.warning("No transactions since the beginning of the year")
             return 0
 
     except requests.exceptions.HTTPError as error:
-        logging.error("Failed to get new members: %s" % error)
+        logging.error("Failed to get new members: %s", error)
         return 1
 
     # Sync transactions
@@ -788,19 +1100,103 @@ def sync_squarespace(year):
 
     return 0
 
+# add or update one order in the orders, memberships and moorings worksheets, for an order webhook or an order
+# OrderBot passes on. rows are matched on order number, so the same order arriving twice just rewrites its rows
+# returns 0 if successful
+def sync_order(order):
+    year = timestamps.parse(order['modifiedOn']).year
+    waterfront_title = "SYC Waterfront - Year %s" % year
+    parsed_moorings = parse_squarespace_orders([order], filter_type_moorings_all)
+
+    # mooring services on an order without a mooring go onto the moorings already listed under the same email
+    services_emails = set(email_key(parsed['email']) for parsed in parsed_moorings
+                          if parsed['mooring_location'] == '' and parsed['mooring_svcs'] == 'Yes' and parsed['fulfillment'] != 'CANCELED')
+
+    # spreadsheet title, share permissions and (worksheet title, header, rows, storage table) for each worksheet
+    targets = [
+        ('SYC Orders', [], [
+            ("Year %s" % year, spreadsheet_header_orders, format_orders(parse_squarespace_orders([order], filter_type_orders)), None),
+        ]),
+        (waterfront_title, waterfront_email_accts, [
+            ('Memberships', spreadsheet_header_members, format_memberships(parse_squarespace_orders([order], filter_type_members)), 'memberships'),
+            ('Moorings', spreadsheet_header_moorings, format_moorings(parsed_moorings), 'moorings'),
+        ]),
+    ]
+
+    return_value = 0
+
+    for (spreadsheet_title, share_perms, worksheets) in targets:
+        worksheets = [worksheet for worksheet in worksheets if worksheet[2]]
+        if not worksheets:
+            continue
+
+        for (worksheet_title, header_row, rows, table) in worksheets:
+            if table:
+                storage.persist(table, year, rows)
+
+        if not storage.sheets_export_enabled():
+            continue
+
+        try:
+            gs = get_spreadsheet(spreadsheet_title, share_perms, reshare=False)
+            for (worksheet_title, header_row, rows, table) in worksheets:
+                (updated, added) = upsert_rows(gs, worksheet_title, header_row, rows)
+                logging.info("Order %s: updated %s and added %s rows in %s/%s", order['orderNumber'], updated, added, spreadsheet_title, worksheet_title)
+        except Exception as e:
+            logging.error("Failure updating google sheets for order %s: %s", order['orderNumber'], e)
+            return_value = 1
+
+    if services_emails:
+        store = storage.get_store()
+        if store:
+            services_column = spreadsheet_header_moorings.index('Services')
+            rows = [row for row in store.rows('moorings', year) if email_key(row[2]) in services_emails and row[services_column] != 'Yes']
+            for row in rows:
+                row[services_column] = 'Yes'
+            if rows:
+                storage.persist('moorings', year, rows)
+
+        if storage.sheets_export_enabled():
+            try:
+                updated = mark_mooring_services(get_spreadsheet(waterfront_title, waterfront_email_accts, reshare=False), services_emails)
+                logging.info("Order %s: marked mooring services on %s rows in %s/Moorings", order['orderNumber'], updated, waterfront_title)
+            except Exception as e:
+                logging.error("Failure updating google sheets for order %s: %s", order['orderNumber'], e)
+                return_value = 1
+
+    return return_value
+
+# pull a single Squarespace order out of an invocation: {"job": "order", "order": {...}} from OrderBot, or the order
+# webhook itself through API Gateway with the order as the body, the same one OrderBot gets
+# returns order dictionary, or None for a scheduled run
+def order_from_event(event):
+    if event.get('job') == 'order':
+        return event['order']
+
+    if 'body' in event:
+        body = event['body']
+        if event.get('isBase64Encoded'):
+            body = base64.b64decode(body).decode('utf-8')
+        return json.loads(body)
+
+    return None
+
 def sync_stripe(year):
     stripe.api_key = os.environ.get('STRIPE_API_KEY')
 
+    # auto_paging_iter fetches the next page as the loop reaches it, so the span covers every page request
     transactions = []
-    for tx in stripe.BalanceTransaction.auto_paging_iter():
-        if datetime.fromtimestamp(tx['created']).year:
-            transactions.append(tx)
+    with tracing.span('stripe.balance_transactions'):
+        for tx in stripe.BalanceTransaction.auto_paging_iter():
+            if datetime.fromtimestamp(tx['created']).year:
+                transactions.append(tx)
+    tracing.count('stripe.rows', len(transactions))
 
     if not transactions:
         logging.info("No transactions since the beginning of the year")
         return 0
 
-    logging.debug("Stripe transactions found: %s" % transactions)
+    logging.debug("Stripe transactions found: %s", transactions)
 
     return sync_stripe_transactions(transactions, year)
 
@@ -821,6 +1217,12 @@ def main():
     year = datetime.now().year
     #year = 2021
 
+    run_state.clear()
+    run_state.update(runstate.load('MembershipBot'))
+    skipped_targets.clear()
+    write_plan.spreadsheets.clear()
+    parsed_payments.clear()
+
     if sync_squarespace(year) == 0:
         logging.info("Finished writing out Squarespace transactions report")
     else:
@@ -831,15 +1233,59 @@ def main():
     else:
         logging.warning("Error while writing out Stripe transactions report")
 
+    if sync_payment_reconciliation(year) == 0:
+        logging.info("Finished reconciling Squarespace and Stripe payments")
+    else:
+        logging.warning("Error reconciling Squarespace and Stripe payments")
+
+    if sync_summary(year) == 0:
+        logging.info("Finished summarizing Squarespace and Stripe payments")
+    else:
+        logging.warning("Error summarizing Squarespace and Stripe payments")
+
+    # the orders, waterfront and transactions spreadsheets, each written in one go
+    if write_planned() == 0:
+        logging.info("Finished writing out the spreadsheets")
+    else:
+        logging.warning("Error writing out the spreadsheets")
+
+    runstate.save('MembershipBot', run_state)
+    if skipped_targets:
+        logging.info("Skipped %s unchanged worksheets: %s", len(skipped_targets), ', '.join(skipped_targets))
+
     return 0
 
 def handler(event, context):
-    return main()
+    tracing.start('MembershipBot', job=event.get('job'))
+
+    # a single order from a webhook or OrderBot, otherwise the hourly full sync
+    try:
+        order = order_from_event(event)
+    except (ValueError, KeyError) as e:
+        logging.error("Couldn't read an order from the event: %s", e)
+        tracing.finish(return_value=1)
+        return {'statusCode': 400, 'body': json.dumps("Invalid order: %s" % e)}
+
+    if order is None:
+        return_value = main()
+    else:
+        logging.basicConfig(level=os.environ.get('LOGLEVEL', 'INFO').upper())
+        skipped_targets.clear()
+        return_value = sync_order(order)
+
+    ratelimit.flush_deferred()
+    tracing.finish(return_value=return_value, skipped=list(skipped_targets))
+
+    # webhooks through API Gateway need an HTTP response
+    if 'body' in event:
+        return {'statusCode': 200 if return_value == 0 else 500, 'body': json.dumps(return_value)}
+    return return_value
 
 if __name__ == "__main__":
     return_val = 1
     try:
         return_val = main()
+        ratelimit.flush_deferred()
     except KeyboardInterrupt:
         logging.critical("Caught a control-C. Bailing out")
 
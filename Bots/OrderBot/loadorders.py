@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+Author: Brent Holden
+Description: Backfill syc_orders from the Squarespace orders API, for orders placed before OrderBot's webhook was set up.
+Pages through the orders API, maps each order with the same order_mapping OrderBot uses, and loads the line items in
+batches through COPY into a staging table followed by one upsert. The cursor of the next page is saved to a checkpoint
+file after every batch, so an interrupted load picks up where it stopped.
+
+Usage: PYTHONPATH=../Common SQUARESPACE_API_KEY=... DB_USER=... DB_PASS=... DB_SERVER=... ./loadorders.py [--modified-after ISO --modified-before ISO]
+
+Needs requests on top of requirements.txt, which only lists what the Lambda image needs:
+    pip install -r requirements.txt 'requests>=2.31,<3'
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import psycopg2
+import requests
+from psycopg2 import sql
+
+import orderbot
+import tracing
+from order_mapping import order_columns, orders_rows
+
+orders_api_endpoint = 'https://api.squarespace.com/1.0/commerce/orders'
+
+def get_order_pages(parameters, cursor=None):
+    """
+    Page through the Squarespace orders API, the same requests get_squarespace_items in MembershipBot makes, as a loop
+    instead of recursion so nothing is held in memory between pages. A saved cursor resumes from that page; Squarespace
+    doesn't accept filters alongside a cursor, the cursor already carries them.
+    Yields (orders, next_cursor) per page, next_cursor is None on the last page.
+    """
+    headers = {
+        "Authorization": "Bearer " + os.environ.get('SQUARESPACE_API_KEY'),
+        "User-Agent": "OrderBot"
+    }
+
+    params = {'cursor': cursor} if cursor else parameters
+    while True:
+        with tracing.span('squarespace.get'):
+            response = requests.get(orders_api_endpoint, headers=headers, params=params)
+        tracing.count('squarespace.bytes', len(response.content))
+        response.raise_for_status()
+        json_data = response.json()
+
+        pagination = json_data['pagination']
+        next_cursor = pagination.get('nextPageCursor') if pagination['hasNextPage'] else None
+        yield json_data['result'], next_cursor
+
+        if next_cursor is None:
+            return
+        params = {'cursor': next_cursor}
+
+def copy_value(value):
+    """
+    Format one value for COPY's text format: None becomes \\N and backslashes, tabs and newlines are escaped.
+    """
+    if value is None:
+        return '\\N'
+
+    text = str(value)
+    # most values have nothing to escape, checking first skips four string copies per value
+    if '\\' in text or '\t' in text or '\n' in text or '\r' in text:
+        text = text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return text
+
+def load_batch(conn, orders):
+    """
+    Load orders in one transaction: COPY their line items into a staging table, upsert them into syc_orders, then
+    refresh syc_members and syc_order_rollup the same way the webhook handler does. An order that shows up twice in
+    a batch, e.g. one modified while the range was being paged through, is only loaded once, as its last copy: one
+    upsert can't update the same row twice.
+    Returns the number of line items loaded.
+    """
+    orders = list({order['id']: order for order in orders}.values())
+    rows = orders_rows(orders)
+
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    columns = sql.SQL(', ').join(map(sql.Identifier, order_columns))
+    updates = sql.SQL(', ').join(
+        sql.SQL("{} = EXCLUDED.{}").format(sql.Identifier(column), sql.Identifier(column))
+        for column in order_columns if column not in ('id', 'created_on')
+    )
+
+    cursor = conn.cursor()
+    try:
+        with tracing.span('postgres.load_batch'):
+            # one partition check per year in the batch rather than per order
+            created_by_year = {order['createdOn'][:4]: order['createdOn'] for order in orders}
+            years = set(orderbot.ensure_partition(cursor, created_on) for created_on in created_by_year.values())
+
+            cursor.execute("CREATE TEMP TABLE IF NOT EXISTS syc_orders_staging (LIKE syc_orders INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+            cursor.copy_expert(sql.SQL("COPY syc_orders_staging ({}) FROM STDIN").format(columns), buffer)
+            cursor.execute(sql.SQL("""
+                INSERT INTO syc_orders ({columns})
+                SELECT {columns} FROM syc_orders_staging
+                ON CONFLICT (id, created_on) DO UPDATE SET {updates}
+            """).format(columns=columns, updates=updates))
+
+            orderbot.upsert_members(cursor, orders)
+            orderbot.upsert_order_rollups(cursor, orders)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    tracing.count('postgres.rows', len(rows))
+    orderbot.partition_years.update(years)
+    return len(rows)
+
+def read_checkpoint(path):
+    """
+    Read the checkpoint left by an earlier run. Returns a dict with the cursor to resume from and the count loaded so far.
+    """
+    if not os.path.exists(path):
+        return {'cursor': None, 'line_items': 0}
+
+    with open(path) as checkpoint:
+        return json.load(checkpoint)
+
+def write_checkpoint(path, checkpoint):
+    """
+    Save the checkpoint, through a temporary file so an interrupted write can't leave it half written.
+    """
+    with open(path + '.tmp', 'w') as temp:
+        json.dump(checkpoint, temp)
+    os.replace(path + '.tmp', path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill syc_orders from the Squarespace orders API")
+    parser.add_argument('--modified-after', help="only load orders modified after this ISO 8601 time, needs --modified-before")
+    parser.add_argument('--modified-before', help="only load orders modified before this ISO 8601 time, needs --modified-after")
+    parser.add_argument('--batch-size', type=int, default=5000, help="line items to buffer before each COPY (default 5000)")
+    parser.add_argument('--checkpoint', default='loadorders.checkpoint.json', help="file to save progress in")
+    args = parser.parse_args()
+
+    if not os.environ.get('SQUARESPACE_API_KEY'):
+        print("Failed to pass SQUARESPACE_API_KEY")
+        return 1
+
+    if bool(args.modified_after) != bool(args.modified_before):
+        print("--modified-after and --modified-before have to be passed together")
+        return 1
+
+    parameters = {}
+    if args.modified_after:
+        parameters = {'modifiedAfter': args.modified_after, 'modifiedBefore': args.modified_before}
+
+    checkpoint = read_checkpoint(args.checkpoint)
+    if checkpoint['cursor']:
+        print(f"Resuming from checkpoint after {checkpoint['line_items']} line items")
+
+    tracing.start('loadorders')
+    conn = psycopg2.connect(orderbot.db_conn_string())
+    started = time.time()
+    loaded = 0
+    orders = []
+    line_items = 0
+
+    try:
+        for page, next_cursor in get_order_pages(parameters, checkpoint['cursor']):
+            orders.extend(page)
+            line_items += sum(len(order['lineItems']) for order in page)
+
+            # only flush on page boundaries, so the saved cursor never skips an order that wasn't loaded
+            if line_items >= args.batch_size or next_cursor is None:
+                if orders:
+                    loaded += load_batch(conn, orders)
+                checkpoint = {'cursor': next_cursor, 'line_items': checkpoint['line_items'] + line_items}
+                write_checkpoint(args.checkpoint, checkpoint)
+                print(f"Loaded {loaded} line items ({loaded / (time.time() - started):.0f}/sec)")
+                orders = []
+                line_items = 0
+    except (requests.exceptions.RequestException, psycopg2.Error) as e:
+        print(f"Failed to load orders: {str(e)}")
+        return 1
+    finally:
+        conn.close()
+
+    # the whole range is in, the next run starts over
+    if os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+    print(f"Finished loading {checkpoint['line_items']} line items")
+    tracing.finish()
+    return 0
+
+if __name__ == "__main__":
+    return_val = 1
+    try:
+        return_val = main()
+    except KeyboardInterrupt:
+        print("Caught a control-C. Bailing out")
+
+    sys.exit(return_val)
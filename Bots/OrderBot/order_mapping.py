@@ -0,0 +1,144 @@
+"""
+Author: Brent Holden
+Description: Mapping from a Squarespace order payload to syc_orders rows, shared by the OrderBot webhook handler and
+the loadorders bulk loader. Order-level fields are read into locals once per order, so the line item loop only builds
+tuples rather than looking every order field up again per line item.
+"""
+
+import json
+
+# Marks a key that's missing from the payload, as opposed to one that's there and null
+missing = object()
+
+def label_map(items, key):
+    """
+    Fold a customizations or variantOptions list into a {label: value} map for the custom_fields and variant_fields columns.
+    """
+    return {item[key]: item['value'] for item in items or [] if item.get(key) is not None}
+
+def product_category(product_name):
+    """
+    Categorize a line item by product name, using the same matches the Retool queries used to make with ILIKE.
+    """
+    product_name = (product_name or '').lower()
+
+    if 'mooring services' in product_name:
+        return 'mooring_services'
+    if 'moorings' in product_name:
+        return 'mooring'
+    if 'membership' in product_name:
+        return 'membership'
+    return 'other'
+
+# syc_orders columns, in the order order_rows() and orders_rows() fill them in. Tests/test_order_mapping.py checks the
+# two stay in step
+column_map = [
+    'id',
+    'order_number',
+    'created_on',
+    'modified_on',
+    'channel',
+    'testmode',
+    'customer_email',
+    'billing_first_name',
+    'billing_last_name',
+    'billing_address1',
+    'billing_address2',
+    'billing_city',
+    'billing_state',
+    'billing_country_code',
+    'billing_postal_code',
+    'billing_phone',
+    'fulfillment_status',
+    'line_item_id',
+    'variant_id',
+    'variant_options',
+    'sku',
+    'product_id',
+    'product_name',
+    'quantity',
+    'unit_price_paid',
+    'image_url',
+    'line_item_type',
+    'customizations',
+    'subtotal',
+    'shipping_total',
+    'discount_total',
+    'tax_total',
+    'refunded_total',
+    'grand_total',
+    'channel_name',
+    'external_order_reference',
+    'fulfilled_on',
+    'price_tax_interpretation',
+    'custom_fields',
+    'variant_fields',
+    'product_category',
+]
+
+# the name OrderBot and loadorders build their INSERT statements from
+order_columns = column_map
+
+def order_rows(order):
+    """
+    Map one Squarespace order to syc_orders rows, one tuple per line item in column_map order.
+    """
+    order_number = order['orderNumber']
+    created_on = order['createdOn']
+    modified_on = order['modifiedOn']
+    channel = order['channel']
+    testmode = order['testmode']
+    customer_email = order['customerEmail']
+    billing = order['billingAddress']
+    billing_first_name = billing['firstName']
+    billing_last_name = billing['lastName']
+    billing_address1 = billing['address1']
+    billing_address2 = billing['address2']
+    billing_city = billing['city']
+    billing_state = billing['state']
+    billing_country_code = billing['countryCode']
+    billing_postal_code = billing['postalCode']
+    billing_phone = billing['phone']
+    fulfillment_status = order['fulfillmentStatus']
+    subtotal = order['subtotal']['value']
+    shipping_total = order['shippingTotal']['value']
+    discount_total = order['discountTotal']['value']
+    tax_total = order['taxTotal']['value']
+    refunded_total = order['refundedTotal']['value']
+    grand_total = order['grandTotal']['value']
+    channel_name = order['channelName']
+    external_order_reference = order['externalOrderReference']
+    fulfilled_on = order['fulfilledOn']
+    price_tax_interpretation = order['priceTaxInterpretation']
+
+    rows = []
+    for line_item in order['lineItems']:
+        customizations = line_item['customizations']
+        # a missing variantOptions is stored as NULL, one that's there and null as 'null'
+        variant_options = line_item.get('variantOptions', missing)
+
+        rows.append((
+            line_item['id'], order_number, created_on, modified_on, channel, testmode, customer_email,
+            billing_first_name, billing_last_name, billing_address1, billing_address2, billing_city, billing_state,
+            billing_country_code, billing_postal_code, billing_phone, fulfillment_status,
+            line_item['id'], line_item['variantId'], None if variant_options is missing else json.dumps(variant_options),
+            line_item['sku'], line_item['productId'], line_item['productName'], line_item['quantity'],
+            line_item['unitPricePaid']['value'], line_item['imageUrl'], line_item['lineItemType'], json.dumps(customizations),
+            subtotal, shipping_total, discount_total, tax_total, refunded_total, grand_total, channel_name,
+            external_order_reference, fulfilled_on, price_tax_interpretation,
+            json.dumps(label_map(customizations, 'label')),
+            json.dumps(label_map(None if variant_options is missing else variant_options, 'optionName')),
+            product_category(line_item['productName']),
+        ))
+
+    return rows
+
+def orders_rows(orders):
+    """
+    Map a list of Squarespace orders to syc_orders rows, returning every order's rows in one list.
+    """
+    rows = []
+    for order in orders:
+        rows.extend(order_rows(order))
+
+    return rows
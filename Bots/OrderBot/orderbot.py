@@ -6,17 +6,215 @@ Description: AWS Lambda function to insert order data into PostgreSQL database.
 import json
 import os
 import psycopg2
+import tracing
 from psycopg2 import sql
+from psycopg2.extras import execute_values
 
-def handler(event, context):
-    # Get database credentials from environment variables
+from order_mapping import label_map, order_columns, order_rows, product_category
+
+# Customization labels that name a person on a membership, with the member_index and relationship they're filed under in syc_members
+member_name_labels = {
+    'Primary Member Name': (0, 'Primary Member'),
+    'Secondary Member Name': (1, 'Secondary Member'),
+    'Child Family Member #1': (2, 'Child Member'),
+    'Child Family Member #2': (3, 'Child Member'),
+    'Child Family Member #3': (4, 'Child Member'),
+    'Child Family Member #4': (5, 'Child Member'),
+    'Child Family Member #5': (6, 'Child Member'),
+}
+
+# One syc_orders row per line item, built once from order_columns
+insert_query = sql.SQL("INSERT INTO syc_orders ({}) VALUES ({})").format(
+    sql.SQL(', ').join(map(sql.Identifier, order_columns)),
+    sql.SQL(', ').join(sql.Placeholder() * len(order_columns))
+)
+
+# Database connection kept across warm invocations, see get_connection
+db_connection = None
+
+# Years with a syc_orders partition already in place, kept across warm invocations so the check runs once per year
+partition_years = set()
+
+# MembershipBot function that gets each inserted order to update its worksheets, unset to skip the hand-off. OrderBot's
+# role needs lambda:InvokeFunction on it
+membership_bot_function = os.environ.get("MEMBERSHIP_BOT_FUNCTION")
+
+# Lambda client kept across warm invocations, see notify_membership_bot
+lambda_client = None
+
+def ensure_partition(cursor, created_on):
+    """
+    Create the syc_orders partition for the year of created_on if this container hasn't seen that year yet.
+    Returns the year, which should only be added to partition_years once the transaction commits.
+    """
+    year = int(created_on[:4])
+    if year not in partition_years:
+        cursor.execute("SELECT create_syc_orders_partition(%s)", (year,))
+    return year
+
+def member_rows(order):
+    """
+    Build the syc_members rows for every person named on the membership line items of an order.
+    """
+    rows = []
+
+    for line_item in order['lineItems']:
+        if 'membership' not in (line_item['productName'] or '').lower():
+            continue
+
+        customizations = line_item.get('customizations') or []
+        fields = label_map(customizations, 'label')
+
+        for position, customization in enumerate(customizations):
+            if customization['label'] not in member_name_labels or not customization['value']:
+                continue
+
+            (member_index, relationship) = member_name_labels[customization['label']]
+
+            # A child's date of birth is the customization right after their name
+            date_of_birth = None
+            if relationship == 'Child Member' and position + 1 < len(customizations):
+                date_of_birth = customizations[position + 1]['value']
+
+            rows.append((
+                line_item['id'], member_index, relationship, customization['value'], date_of_birth,
+                order['orderNumber'], order['createdOn'], line_item['productName'], fields.get('Confirm Membership Type'),
+                fields.get('Primary Address', fields.get('Address')), fields.get('Home Phone'), fields.get('Cell Phone'),
+                fields.get('Primary Member Name'), fields.get('Primary Email'), fields.get('Emergency Contact Name'),
+                fields.get('Emergency Contact Phone'), fields.get('SYC Photography')
+            ))
+
+    return rows
+
+def upsert_members(cursor, orders):
+    """
+    Replace the syc_members rows for the line items of orders, so Member Lookup can search names by index.
+    """
+    line_item_ids = [line_item['id'] for order in orders for line_item in order['lineItems']]
+    rows = [row for order in orders for row in member_rows(order)]
+
+    cursor.execute("DELETE FROM syc_members WHERE line_item_id = ANY(%s)", (line_item_ids,))
+    if rows:
+        execute_values(cursor, """
+            INSERT INTO syc_members (
+                line_item_id, member_index, relationship, member_name, date_of_birth, order_number, created_on,
+                product_name, renewal_type, home_address, home_phone, cell_phone, primary_name, primary_email,
+                emergency_contact, emergency_phone, child_photo
+            ) VALUES %s
+        """, rows, page_size=1000)
+
+def upsert_order_rollups(cursor, orders):
+    """
+    Record what was bought on each order in syc_order_rollup, replacing the flags if the order was seen before.
+    """
+    rows = []
+    for order in orders:
+        categories = set(product_category(line_item['productName']) for line_item in order['lineItems'])
+        rows.append((
+            order['orderNumber'], order['createdOn'], order['customerEmail'],
+            'membership' in categories, 'mooring' in categories, 'mooring_services' in categories
+        ))
+
+    execute_values(cursor, """
+        INSERT INTO syc_order_rollup (
+            order_number, created_on, customer_email, has_membership, has_mooring, has_mooring_services
+        ) VALUES %s
+        ON CONFLICT (order_number) DO UPDATE SET
+            customer_email = EXCLUDED.customer_email,
+            has_membership = EXCLUDED.has_membership,
+            has_mooring = EXCLUDED.has_mooring,
+            has_mooring_services = EXCLUDED.has_mooring_services
+    """, rows, page_size=1000)
+
+def db_conn_string():
+    """
+    Build the Retool database connection string from the DB_USER, DB_PASS and DB_SERVER environment variables.
+    """
     db_user = os.environ.get("DB_USER")
     db_password = os.environ.get("DB_PASS")
     db_server = os.environ.get("DB_SERVER")
 
-    # Construct the connection string
-    db_conn_string = f'postgresql://{db_user}:{db_password}@{db_server}.us-west-2.retooldb.com/retool?sslmode=require'
+    return f'postgresql://{db_user}:{db_password}@{db_server}.us-west-2.retooldb.com/retool?sslmode=require'
+
+def get_connection():
+    """
+    Return the database connection, opening it on the first invocation. Lambda keeps module state between warm
+    invocations, so later orders skip the TLS handshake and login to the Retool database.
+    """
+    global db_connection
+
+    if db_connection is None or db_connection.closed:
+        with tracing.span('postgres.connect'):
+            db_connection = psycopg2.connect(db_conn_string())
+    return db_connection
+
+def close_connection():
+    """
+    Drop the kept database connection so the next get_connection() opens a new one.
+    """
+    global db_connection
+
+    if db_connection is not None and not db_connection.closed:
+        db_connection.close()
+    db_connection = None
 
+def insert_order(conn, payload):
+    """
+    Insert every line item of an order into syc_orders, keep syc_members and syc_order_rollup in step, and commit.
+    """
+    rows = order_rows(payload)
+
+    with tracing.span('postgres.insert_order'), conn.cursor() as cursor:
+        year = ensure_partition(cursor, payload['createdOn'])
+
+        for values in rows:
+            #print(f"Executing query with values: {values}")  # Debug log to show the values being inserted
+            cursor.execute(insert_query, values)
+            print("Data inserted successfully")
+
+        # Keep the member name index and order rollup in step with the order
+        upsert_members(cursor, [payload])
+        upsert_order_rollups(cursor, [payload])
+
+        conn.commit()
+
+    tracing.count('postgres.rows', len(rows))
+    partition_years.add(year)
+
+def notify_membership_bot(payload):
+    """
+    Hand the order to MembershipBot so it updates just that order's worksheet rows. The invoke is asynchronous and a
+    failure only gets logged, MembershipBot's hourly run picks up anything missed.
+    """
+    global lambda_client
+
+    if not membership_bot_function:
+        return
+
+    try:
+        with tracing.span('lambda.invoke'):
+            if lambda_client is None:
+                # boto3 comes with the Lambda runtime
+                import boto3
+                lambda_client = boto3.client('lambda')
+            lambda_client.invoke(
+                FunctionName=membership_bot_function,
+                InvocationType='Event',
+                Payload=json.dumps({'job': 'order', 'order': payload}).encode('utf-8')
+            )
+    except Exception as e:
+        print(f"Error notifying {membership_bot_function}: {str(e)}")
+
+def handler(event, context):
+    tracing.start('OrderBot')
+    response = handle_order(event)
+    tracing.finish(status_code=response['statusCode'])
+    return response
+
+def handle_order(event):
+    """
+    Insert the order in a Squarespace webhook event. Returns the Lambda response.
+    """
     # Parse the JSON payload
     try:
         payload = json.loads(event['body'])
@@ -26,10 +224,9 @@ def handler(event, context):
             'body': json.dumps(f"Invalid JSON: {str(e)}")
         }
     
-    # Connect to the database
+    # Connect to the database, or reuse the connection from an earlier invocation
     try:
-        conn = psycopg2.connect(db_conn_string)
-        cursor = conn.cursor()
+        conn = get_connection()
     except Exception as e:
         return {
             'statusCode': 500,
@@ -38,54 +235,24 @@ def handler(event, context):
     
     # Insert data into the table
     try:
-        for line_item in payload['lineItems']:
-            # Handle missing variantOptions
-            variant_options = json.dumps(line_item['variantOptions']) if 'variantOptions' in line_item else None
-            
-            query = sql.SQL("""
-                INSERT INTO syc_orders (
-                    id, order_number, created_on, modified_on, channel, testmode, customer_email,
-                    billing_first_name, billing_last_name, billing_address1, billing_address2,
-                    billing_city, billing_state, billing_country_code, billing_postal_code, billing_phone,
-                    fulfillment_status, line_item_id, variant_id, variant_options, sku, product_id, product_name,
-                    quantity, unit_price_paid, image_url, line_item_type, customizations, subtotal, shipping_total,
-                    discount_total, tax_total, refunded_total, grand_total, channel_name, external_order_reference,
-                    fulfilled_on, price_tax_interpretation
-                ) VALUES (
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-                )
-            """)
-            values = (
-                line_item['id'], payload['orderNumber'], payload['createdOn'], payload['modifiedOn'], payload['channel'], payload['testmode'],
-                payload['customerEmail'], payload['billingAddress']['firstName'], payload['billingAddress']['lastName'],
-                payload['billingAddress']['address1'], payload['billingAddress']['address2'], payload['billingAddress']['city'],
-                payload['billingAddress']['state'], payload['billingAddress']['countryCode'], payload['billingAddress']['postalCode'],
-                payload['billingAddress']['phone'], payload['fulfillmentStatus'], line_item['id'], line_item['variantId'],
-                variant_options, line_item['sku'], line_item['productId'], line_item['productName'], line_item['quantity'],
-                line_item['unitPricePaid']['value'], line_item['imageUrl'], line_item['lineItemType'],
-                json.dumps(line_item['customizations']), payload['subtotal']['value'], payload['shippingTotal']['value'],
-                payload['discountTotal']['value'], payload['taxTotal']['value'], payload['refundedTotal']['value'],
-                payload['grandTotal']['value'], payload['channelName'], payload['externalOrderReference'], payload['fulfilledOn'],
-                payload['priceTaxInterpretation']
-            )
-            #print(f"Executing query with values: {values}")  # Debug log to show the values being inserted
-            cursor.execute(query, values)
-            print("Data inserted successfully")
-        conn.commit()
+        try:
+            insert_order(conn, payload)
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            # The kept connection may have been dropped by the server while this container sat idle
+            close_connection()
+            conn = get_connection()
+            insert_order(conn, payload)
     except Exception as e:
-        cursor.close()
-        conn.close()
+        if not conn.closed:
+            conn.rollback()
         print(f"Error inserting data: {str(e)}")  # Debug log to show the error
         return {
             'statusCode': 500,
             'body': json.dumps(f"Error inserting data: {str(e)}")
         }
-    
-    # Close the database connection
-    cursor.close()
-    conn.close()
-    
+
+    notify_membership_bot(payload)
+
     return {
         'statusCode': 200,
         'body': json.dumps('Data inserted successfully!')
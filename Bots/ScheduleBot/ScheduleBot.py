@@ -4,18 +4,24 @@ import base64
 import os
 import sys
 import logging
-import google
-import gspread
-import stripe
 import json
-import requests
-import logging
 import re
-from requests.auth import HTTPBasicAuth
-from gspread.exceptions import *
-from oauth2client.service_account import ServiceAccountCredentials
+import idempotency
+import ratelimit
+import sheets_cache
+import sheets_writer
+import storage
+import timestamps
+import tracing
 from datetime import date, datetime, timedelta
-from dateutil import parser as parsedate
+from lazy import lazy_import
+
+# heavy clients are imported on first use to keep cold starts short, see Common/lazy.py
+google_auth_exceptions = lazy_import('google.auth.exceptions')
+gspread = lazy_import('gspread')
+parsedate = lazy_import('dateutil.parser')
+requests = lazy_import('requests')
+service_account = lazy_import('oauth2client.service_account')
 
 
 spreadsheet_header_waterfront_lessons = [
@@ -73,13 +79,23 @@ waterfront_email_accts = [
                         'waterfront@sherbornyachtclub.org',
                         ]
 
+# Acuity caps the number of appointments returned per request, so we ask for this many at a time
+acuity_page_size = 1000
+
+# actions whose handling appends rows, so a redelivered webhook for one is skipped once it's been handled
+idempotent_actions = ['scheduled', 'canceled', 'order.completed']
+
+# lessons and races worksheet schemas, keyed by Acuity appointment type id, with the form questions each was built
+# from. see get_appointment_schema
+appointment_schemas = {}
+
 # get Google auth client
 # returns client
 # will not cause exception unless an action is performed against the API. that's nice
 def auth_google(credentials):
     scope = ['https://spreadsheets.google.com/feeds','https://www.googleapis.com/auth/drive']
-    credentials = ServiceAccountCredentials.from_json_keyfile_name(credentials, scope)
-    client = gspread.authorize(credentials)
+    credentials = service_account.ServiceAccountCredentials.from_json_keyfile_name(credentials, scope)
+    client = ratelimit.limit_gspread(tracing.trace_gspread(gspread.authorize(credentials)))
 
     return client
 
@@ -88,7 +104,7 @@ def auth_google(credentials):
 def create_spreadsheet(client, spreadsheet_title, notify_users=False, addtl_share_perms=None):
 
     handler = client.create(spreadsheet_title)
-    logging.info("Sheet '%s' available at: %s" % (spreadsheet_title, handler.url))
+    logging.info("Sheet '%s' available at: %s", spreadsheet_title, handler.url)
 
     for email in admin_email_accts:
         handler.share(email, perm_type='user', role='writer', notify=notify_users)
@@ -105,7 +121,7 @@ def get_spreadsheet(client, spreadsheet_title):
 
     handler = client.open(spreadsheet_title)
 
-    logging.info("Sheet '%s' available at: %s" % (spreadsheet_title, handler.url))
+    logging.info("Sheet '%s' available at: %s", spreadsheet_title, handler.url)
     logging.debug("Retrieved spreadsheet and returning handler to caller")
 
     return handler
@@ -119,59 +135,128 @@ def get_or_create_spreadsheet(client, spreadsheet_title, notify_users=False, add
     except:
         handler = create_spreadsheet(client, spreadsheet_title, notify_users, addtl_share_perms)
 
-    logging.info("Sheet '%s' available at: %s" % (spreadsheet_title, handler.url))
+    logging.info("Sheet '%s' available at: %s", spreadsheet_title, handler.url)
     logging.debug("Retrieved spreadsheet and returning handler to caller")
 
     return handler
 
-# remove a row from spreadsheet, required spreadsheet title, worksheet id, and the row in int
+# remove an order's row from spreadsheet, required spreadsheet title, worksheet id, and the order id
 # returns True if successful
-def remove_row_from_spreadsheet(client, spreadsheet_title, worksheet_id, row):
+def remove_row_from_spreadsheet(client, spreadsheet_title, worksheet_id, order_id):
     logging.debug("Entering remove_row_from_spreadsheet")
 
-    logging.debug("Row value is: %s" % row)
+    logging.debug("Order id is: %s", order_id)
+
+    return remove_rows_from_spreadsheet(client, spreadsheet_title, {worksheet_id: [order_id]})
+
+# remove the rows of many orders from a spreadsheet in one batch_update. required spreadsheet title and a dictionary of worksheet id to list of order ids
+# the rows come from reading column A again right before the delete, not from the cached read the orders were found
+# with. if someone else added or removed rows since, the cached row numbers would delete the wrong appointments
+# returns True if successful
+def remove_rows_from_spreadsheet(client, spreadsheet_title, order_ids_by_worksheet):
+    logging.debug("Entering remove_rows_from_spreadsheet")
 
     gs = get_spreadsheet(client, spreadsheet_title)
-    worksheet = gs.get_worksheet_by_id(worksheet_id)
-    logging.debug("Worksheet opened: %s" % worksheet)
 
-    # Check to see if it's just the header row and the item, or just the row to be deleted itself
-    if ((worksheet.row_count <= 2) and (worksheet.frozen_row_count == 1)) or worksheet.row_count == 1:
-        logging.info("This remove_rows is going to fail because there are %s rows in sheet. I'm going to remove the worksheet entirely" % worksheet.row_count)
-        gs.del_worksheet(worksheet)
+    worksheets = [worksheet for worksheet in gs.worksheets() if worksheet.id in order_ids_by_worksheet]
+    if not worksheets:
+        logging.warning("Couldn't find any of the worksheets to remove rows from in %s", spreadsheet_title)
+        return False
 
-    else:
-        try:
-            result = worksheet.delete_rows(row)
-            logging.debug("Deleted row: %s" % row)
-        except gspread.exceptions.APIError as api_error:
-            logging.warning("Got Google API error: %s" % api_error)
-            return False
+    value_ranges = gs.values_batch_get(["%s!A:A" % sheets_writer.quote_title(worksheet.title) for worksheet in worksheets])['valueRanges']
+
+    delete_requests = []
+    removed = 0
+    for worksheet, value_range in zip(worksheets, value_ranges):
+        order_ids = set(str(order_id) for order_id in order_ids_by_worksheet[worksheet.id])
+        values = value_range.get('values', [])
+        rows = [row for row, cells in enumerate(values, start=1) if row > 1 and cells and cells[0] in order_ids]
+
+        missing = order_ids - set(values[row - 1][0] for row in rows)
+        if missing:
+            logging.warning("Orders %s are no longer in worksheet %s, leaving them", sorted(missing), worksheet.title)
+        if not rows:
+            continue
+
+        logging.debug("Removing rows %s from worksheet: %s", rows, worksheet)
+        delete_requests += delete_rows_requests(worksheet, rows)
+        removed += len(rows)
+
+    if not delete_requests:
+        return False
+
+    try:
+        gs.batch_update({'requests': delete_requests})
+    except gspread.exceptions.APIError as api_error:
+        logging.warning("Got Google API error: %s", api_error)
+        return False
 
-    logging.info("Appointment removed")
+    tracing.count('sheets.rows', removed)
+    logging.info("Removed %s rows from %s", removed, spreadsheet_title)
 
     return True
 
+# build the requests to delete a list of rows from a worksheet, for use with spreadsheet.batch_update
+# rows are deleted bottom up so earlier deletes don't shift the rows of later ones. neighbouring rows are merged into one range
+# google won't delete every unfrozen row in a worksheet, so if that's what's being asked we remove the worksheet entirely
+# returns list of requests
+def delete_rows_requests(worksheet, rows):
+    rows = sorted(set(rows), reverse=True)
+
+    if worksheet.row_count - len(rows) <= worksheet.frozen_row_count:
+        logging.info("Removing every row from worksheet %s with %s rows. Removing the worksheet entirely", worksheet.title, worksheet.row_count)
+        return [{'deleteSheet': {'sheetId': worksheet.id}}]
+
+    delete_requests = []
+    for row in rows:
+        if delete_requests and delete_requests[-1]['deleteDimension']['range']['startIndex'] == row:
+            delete_requests[-1]['deleteDimension']['range']['startIndex'] = row - 1
+        else:
+            delete_requests.append({
+                'deleteDimension': {
+                    'range': {
+                        'sheetId': worksheet.id,
+                        'dimension': 'ROWS',
+                        'startIndex': row - 1,
+                        'endIndex': row,
+                    }
+                }
+            })
+
+    return delete_requests
+
 # update the row, required spreadsheet title, worksheet id, the row in int, appointment dictionary returned by find_order_by_id
+# the row was found with a cached read, so column A is read again first. if the order has moved since, e.g. a row
+# above it was removed, the update follows it rather than overwriting whichever appointment is there now
 # returns True if successful
 def update_row_in_spreadsheet(client, spreadsheet_title, worksheet_id, row, appointment):
     logging.debug("Entering update_row_in_spreadsheet")
 
-    logging.debug("Row value is: %s" % row)
+    logging.debug("Row value is: %s", row)
 
     gs = get_spreadsheet(client, spreadsheet_title)
     worksheet = gs.get_worksheet_by_id(worksheet_id)
-    logging.debug("Worksheet opened: %s" % worksheet)
+    logging.debug("Worksheet opened: %s", worksheet)
 
     try:
+        order_ids = worksheet.col_values(1)
+        order_id = str(appointment[0])
+        if row > len(order_ids) or order_ids[row - 1] != order_id:
+            if order_id not in order_ids[1:]:
+                logging.warning("Order %s is no longer in worksheet %s, not updating it", order_id, worksheet.title)
+                return False
+
+            logging.info("Order %s moved from row %s to %s since it was found", order_id, row, order_ids.index(order_id, 1) + 1)
+            row = order_ids.index(order_id, 1) + 1
+
         for index, value in enumerate(appointment):
             # write at index+1 because google sheet columns start at 1, indexes start at 0
-            logging.debug("Updating row %s, cell %s with value %s: " % (row, index+1, value))
+            logging.debug("Updating row %s, cell %s with value %s: ", row, index+1, value)
             worksheet.update_cell(row, index+1, value)
 
-        logging.debug("Updated row: %s" % row)
+        logging.debug("Updated row: %s", row)
     except gspread.exceptions.APIError as api_error:
-        logging.warning("Got Google API error: %s" % api_error)
+        logging.warning("Got Google API error: %s", api_error)
         return False
 
     logging.info("Appointment updated")
@@ -190,24 +275,25 @@ def append_row_to_spreadsheet(spreadsheet, worksheet_title, header_row, row_to_a
     target_sheet = None
     for sheet in worksheets:
         if sheet.title == worksheet_title:
-            logging.debug("Found target_sheet: %s" % target_sheet)
+            logging.debug("Found target_sheet: %s", target_sheet)
             target_sheet = sheet
 
-    logging.debug("target_sheet is: %s" % target_sheet)
+    logging.debug("target_sheet is: %s", target_sheet)
 
     # If sheet was not found create it
     if target_sheet is None:
-        logging.warning("Couldn't find worksheet %s. Creating" % worksheet_title)
+        logging.warning("Couldn't find worksheet %s. Creating", worksheet_title)
         target_sheet = spreadsheet.add_worksheet(title=worksheet_title, rows=1, cols=len(row_to_add))
         target_sheet.append_row(header_row, value_input_option='USER-ENTERED')
     else:
-        logging.debug("Found target_sheet: %s" % target_sheet)
+        logging.debug("Found target_sheet: %s", target_sheet)
 
-    logging.debug("Ready to append_row: %s" % row_to_add)
+    logging.debug("Ready to append_row: %s", row_to_add)
     start_row = 1
     target_sheet.append_row(row_to_add, value_input_option='USER-ENTERED', table_range='A{}'.format(start_row))
-    target_sheet.columns_auto_resize(0, len(row_to_add))
-    target_sheet.freeze(rows=1)
+    tracing.count('sheets.rows')
+    ratelimit.defer(target_sheet.columns_auto_resize, 0, len(row_to_add))
+    ratelimit.defer(target_sheet.freeze, rows=1)
     logging.info("Updated Google Sheet successfully")
 
     return True
@@ -224,7 +310,9 @@ def get_appointment_by_id(id):
         "User-Agent": "ScheduleBot"
     }
 
-    response = requests.get(api_endpoint + str(id), headers=headers, auth=HTTPBasicAuth(user, api_key))
+    with tracing.span('acuity.get_appointment'):
+        response = requests.get(api_endpoint + str(id), headers=headers, auth=requests.auth.HTTPBasicAuth(user, api_key))
+    tracing.count('acuity.bytes', len(response.content))
     if response.raise_for_status():
         pass
     else:
@@ -233,81 +321,115 @@ def get_appointment_by_id(id):
     if response.status_code == requests.codes.ok:
         appointment = json_data
     else:
-        logging.error("Return status from response was requests.get was NOT OK: %s" % response.status_code)
+        logging.error("Return status from response was requests.get was NOT OK: %s", response.status_code)
         appointment = {}
 
-    logging.debug("Returning appointment from get_appointment_by_id: %s" % appointment)
+    logging.debug("Returning appointment from get_appointment_by_id: %s", appointment)
     return appointment
 
+## function to get every appointment between two dates (inclusive) from acuity
+## acuity has no page cursor, so if a page comes back full we split the date range in half and fetch each side
+## returns: list of appointment dictionaries
+def get_appointments(min_date, max_date, canceled=False):
+    api_endpoint = 'https://acuityscheduling.com/api/v1/appointments'
+
+    user = os.environ.get('ACUITY_API_USER')
+    api_key = os.environ.get('ACUITY_API_KEY')
+
+    headers = {
+        "User-Agent": "ScheduleBot"
+    }
+
+    parameters = {
+        "minDate": min_date.isoformat(),
+        "maxDate": max_date.isoformat(),
+        "max": acuity_page_size,
+        "canceled": "true" if canceled else "false",
+        "direction": "ASC",
+    }
+
+    with tracing.span('acuity.get_appointments'):
+        response = requests.get(api_endpoint, headers=headers, params=parameters, auth=requests.auth.HTTPBasicAuth(user, api_key))
+    tracing.count('acuity.bytes', len(response.content))
+    response.raise_for_status()
+    appointments = response.json()
+
+    if len(appointments) >= acuity_page_size:
+        if min_date < max_date:
+            midpoint = min_date + timedelta(days=(max_date - min_date).days // 2)
+            logging.debug("Page from %s to %s was full, splitting at %s", min_date, midpoint, max_date)
+            return get_appointments(min_date, midpoint, canceled) + get_appointments(midpoint + timedelta(days=1), max_date, canceled)
+
+        logging.warning("Got a full page of %s appointments for a single day %s. Some may be missing", len(appointments), min_date)
+
+    logging.debug("Got %s appointments from %s to %s", len(appointments), min_date, max_date)
+    return appointments
+
 # function to find order by id in int. takes in order id in int, and list of spreadsheet names to search
-# returns tuples of spreadsheet title, worksheet id, and row id in int if found
+# returns tuples of spreadsheet title, worksheet id, and cell if found
 def find_order_by_id(client, order_id, spreadsheet_names):
-    # This functions expects an order id in the form of a string and a list of spreadsheet names to go looking in
-    found = False
+    logging.debug("Started find_order_by_id with id: %s and spreadsheet_names: %s", order_id, spreadsheet_names)
 
-    logging.debug("Started find_order_by_id with id: %s and spreadsheet_names: %s" % (order_id, spreadsheet_names))
+    found = find_orders_by_ids(client, [order_id], spreadsheet_names)
+
+    if str(order_id) not in found:
+        logging.debug("Returning: None")
+        return None
+
+    (spreadsheet_title, worksheet_id, row) = found[str(order_id)]
+    cell = gspread.Cell(row, 1, str(order_id))
+
+    logging.debug("Returning: %s, %s, %s", spreadsheet_title, worksheet_id, cell)
+
+    return (spreadsheet_title, worksheet_id, cell)
+
+# function to find many orders at once. takes in a list of order ids, and list of spreadsheet names to search
+# the first column of every worksheet in a spreadsheet is read with one batch_get rather than a find per worksheet,
+# and reused from sheets_cache until the spreadsheet changes
+# returns dictionary of order id in string to tuple of spreadsheet title, worksheet id, and row in int for every order found
+def find_orders_by_ids(client, order_ids, spreadsheet_names):
+    wanted = set(str(order_id) for order_id in order_ids)
+    found = {}
+
+    logging.debug("Started find_orders_by_ids with %s ids and spreadsheet_names: %s", len(wanted), spreadsheet_names)
 
     for spreadsheet in spreadsheet_names:
-        # get the instance of the Spreadsheet
         try:
-            gs = client.open(spreadsheet)
-            logging.debug("Opened sheet '%s' available at: %s" % (spreadsheet, gs.url))
-
-            worksheets = gs.worksheets()
-            logging.debug("Got worksheets of: %s" % worksheets)
-
-            print("Spreadsheet title is: %s" % spreadsheet)
-
-            logging.debug("Now hunting for order id %s in worksheets: %s" % (order_id, worksheets))
-            for worksheet in worksheets:
-                logging.debug("Opening worksheet: %s" % worksheet)
-                cell = worksheet.find(str(order_id), in_column=1)
-                if cell:
-                    found = True
-                    spreadsheet_title = spreadsheet
-                    worksheet_id = worksheet.id
-                    row = cell
-                    logging.debug("Found order and returning: %s, %s, %s" % (spreadsheet_title, worksheet_id, row))
-
-        except SpreadsheetNotFound:
-            logging.warning("Got an error trying to open spreadsheet %s in worksheets: %s")
-            pass
-
-    if found is False:
-        logging.debug("Returning: %s" % found)
-        return None
+            worksheets = sheets_cache.read_worksheets(client, spreadsheet, 'A:A')
+        except gspread.exceptions.SpreadsheetNotFound:
+            logging.warning("Got an error trying to open spreadsheet %s", spreadsheet)
+            continue
+
+        logging.debug("Now hunting for %s order ids in worksheets: %s", len(wanted), [title for (worksheet_id, title, values) in worksheets])
 
-    logging.debug("Returning: %s, %s, %s" % (spreadsheet_title, worksheet_id, row))
+        for (worksheet_id, title, rows) in worksheets:
+            for row, values in enumerate(rows, start=1):
+                if values and values[0] in wanted and values[0] not in found:
+                    found[values[0]] = (spreadsheet, worksheet_id, row)
 
-    return (spreadsheet_title, worksheet_id, row)
+    logging.debug("Returning %s found orders: %s", len(found), found)
+
+    return found
 
 # verifies membership. takes in email in string returned from find_order_by_id dictionary and year
 # returns True if found in the membership spreadsheet
 def verify_member(client, email, year):
     found = False
 
-    logging.debug("Started verify_member with email: %s" % email)
+    logging.debug("Started verify_member with email: %s", email)
 
-    try:
-        logging.debug("Opening spreadsheet: SYC Waterfront - Year %s" % year)
-        members_spreadsheet = get_spreadsheet(client, "SYC Waterfront - Year %s" % year)
-        members_worksheet = 'Memberships'
-        worksheets = members_spreadsheet.worksheets()
-
-        for sheet in worksheets:
-            if sheet.title == members_worksheet:
-                logging.debug("FOUND membership sheet: %s" % sheet)
-
-                if sheet.findall(email):
-                    found = True
-                    logging.info("Found %s in membership spreadsheet for" % email)
-                else:
-                    logging.info("Didn't find %s in membership spreadsheet for" % email)
-            else:
-                logging.debug("DID NOT FIND membership sheet: %s" % sheet)
+    # the SQL backend has the membership emails indexed, so skip the spreadsheet scan
+    store = storage.get_store()
+    if store:
+        found = store.contains('memberships', year, ['primary_email', 'secondary_email'], email)
+        logging.info("Membership lookup for %s in storage returned: %s", email, found)
+        return found
 
-    except ValueError:
-        logging.warning("Couldn't open up membership spreadsheet for membership verification")
+    if email in get_member_emails(client, year):
+        found = True
+        logging.info("Found %s in membership spreadsheet for", email)
+    else:
+        logging.info("Didn't find %s in membership spreadsheet for", email)
 
     return found
 
@@ -316,71 +438,59 @@ def verify_member(client, email, year):
 def add_lesson_race(client, appointment):
     logging.debug("Entering add_lesson_race")
 
-    year = parsedate.isoparse(appointment['datetime']).year
-    logging.debug("Year in add_lesson_race was: %s" % year)
+    year = timestamps.parse(appointment['datetime']).year
+    logging.debug("Year in add_lesson_race was: %s", year)
 
     spreadsheet_title = "SYC Sailing Lessons and Races - %s" % year
-    spreadsheet_header = spreadsheet_header_waterfront_lessons
 
     unscrubbed_worksheet_title = appointment['type']
-    logging.debug("Worksheet title before sanitization was: %s" % unscrubbed_worksheet_title)
+    logging.debug("Worksheet title before sanitization was: %s", unscrubbed_worksheet_title)
 
     worksheet_title = (re.sub(r"\W+|_", " ", unscrubbed_worksheet_title))
-    logging.debug("Worksheet title after sanitization was: %s" % worksheet_title)
+    logging.debug("Worksheet title after sanitization was: %s", worksheet_title)
 
-    formatted_appt = [
-                        appointment['id'],
-                        appointment['firstName'] + " " + appointment['lastName'],
-                        appointment['email'],
-                        appointment['phone'],
-                        appointment['date'],
-                    ]
-
-    for form in appointment['forms']:
-        logging.info("Parsing through the forms and adding them to the spreadsheet")
-        logging.debug("FOUND FORM: %s" % form)
+    logging.info("Parsing through the forms and adding them to the spreadsheet")
+    (spreadsheet_header, formatted_appt) = format_lesson_race(appointment)
 
-        for question in form['values']:
-            logging.debug("FOUND QUESTION: %s" % question['name'])
-            spreadsheet_header.append(question['name'])
-            logging.debug("FOUND RESPONSE: %s" % question['value'])
-            formatted_appt.append(question['value'])
+    if not storage.persist('lessons', year, [format_lesson_record(worksheet_title, spreadsheet_header, formatted_appt)]):
+        return 0
 
     # get the spreadsheet handler
     gs = get_or_create_spreadsheet(client, spreadsheet_title)
 
     logging.debug("Got spreadsheet in add_lesson_race")
-    logging.debug("Ready to write out header: %s" % spreadsheet_header)
+    logging.debug("Ready to write out header: %s", spreadsheet_header)
 
-    logging.debug("Ready to write out row: %s" % formatted_appt)
+    logging.debug("Ready to write out row: %s", formatted_appt)
     # update the google sheet
     try:
-        logging.debug("Writing out to lessons spreadsheet: %s" % formatted_appt)
-        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s" % (spreadsheet_title, worksheet_title, spreadsheet_header, formatted_appt))
+        logging.debug("Writing out to lessons spreadsheet: %s", formatted_appt)
+        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s", spreadsheet_title, worksheet_title, spreadsheet_header, formatted_appt)
         append_row_to_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_appt)
     except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
+        logging.error("Failure updating google sheets: %s", e)
         return 1
 
     return 0
 
-# add lesson or race transaction to the spreadsheet. takes in dictionary appointment returned by find_order_by_id
+# add lesson or race transaction to the spreadsheet. takes in dictionary appointment returned by find_order_by_id and
+# the webhook action it came with, which keeps a cancellation's ledger row apart from the order's in storage
 # returns true if successful
-def add_lesson_transaction(client, appointment):
+def add_lesson_transaction(client, appointment, action):
     logging.debug("Entering add_lesson_transaction")
 
-    year = parsedate.isoparse(appointment['datetime']).year
-    logging.debug("Year in add_lesson_transaction was: %s" % year)
+    year = timestamps.parse(appointment['datetime']).year
+    logging.debug("Year in add_lesson_transaction was: %s", year)
 
     spreadsheet_title = "SYC Lessons and Races Transactions - %s" % year
     spreadsheet_header = spreadsheet_header_lesson_transactions
-    logging.debug("Ready to write out header: %s" % spreadsheet_header)
+    logging.debug("Ready to write out header: %s", spreadsheet_header)
 
     unscrubbed_worksheet_title = appointment['type']
-    logging.debug("Worksheet title before sanitization was: %s" % unscrubbed_worksheet_title)
+    logging.debug("Worksheet title before sanitization was: %s", unscrubbed_worksheet_title)
 
     worksheet_title = (re.sub(r"\W+|_", " ", unscrubbed_worksheet_title))
-    logging.debug("Worksheet title after sanitization was: %s" % worksheet_title)
+    logging.debug("Worksheet title after sanitization was: %s", worksheet_title)
 
     # Default to non-member, revise if we find them
     membership = 'Non-Member'
@@ -418,24 +528,27 @@ def add_lesson_transaction(client, appointment):
                         membership,
                     ]
 
+    if not storage.persist('lesson_transactions', year, [formatted_transaction + [action]], mode='insert'):
+        return 0
+
     # get the spreadsheet handler
     gs = get_or_create_spreadsheet(client, spreadsheet_title)
     logging.debug("Got spreadsheet in add_lesson_race")
-    logging.debug("Ready to write out header: %s" % spreadsheet_header)
+    logging.debug("Ready to write out header: %s", spreadsheet_header)
 
-    logging.debug("Ready to write out row: %s" % formatted_appt)
+    logging.debug("Ready to write out row: %s", formatted_appt)
     # update the google sheet
     try:
-        logging.debug("Writing out to lessons spreadsheet: %s" % formatted_appt)
+        logging.debug("Writing out to lessons spreadsheet: %s", formatted_appt)
 
-        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s" % (spreadsheet_title, worksheet_title, spreadsheet_header, formatted_appt))
+        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s", spreadsheet_title, worksheet_title, spreadsheet_header, formatted_appt)
         append_row_to_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_appt)
 
-        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s" % (spreadsheet_title, ledger_title, ledger_header, formatted_transaction))
+        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s", spreadsheet_title, ledger_title, ledger_header, formatted_transaction)
         append_row_to_spreadsheet(gs, ledger_title, ledger_header, formatted_transaction)
 
     except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
+        logging.error("Failure updating google sheets: %s", e)
         return 1
 
     return 0
@@ -444,8 +557,8 @@ def add_lesson_transaction(client, appointment):
 # returns true if successful
 def add_reservation(client, appointment):
 
-    year = parsedate.isoparse(appointment['datetime']).year
-    logging.debug("Year in add_reservation was: %s" % year)
+    year = timestamps.parse(appointment['datetime']).year
+    logging.debug("Year in add_reservation was: %s", year)
 
     spreadsheet_title = "SYC Waterfront - Year %s" % year
     worksheet_title = 'Reservations'
@@ -455,17 +568,10 @@ def add_reservation(client, appointment):
     if verify_member(client, appointment['email'], year):
         membership = 'Member'
 
-    formatted_appt = [
-                        appointment['id'],
-                        appointment['firstName'] + " " + appointment['lastName'],
-                        appointment['email'],
-                        appointment['phone'],
-                        appointment['date'],
-                        appointment['time'],
-                        appointment['endTime'],
-                        appointment['type'],
-                        membership,
-                    ]
+    formatted_appt = format_reservation(appointment, membership)
+
+    if not storage.persist('reservations', year, [formatted_appt]):
+        return 0
 
     # get the spreadsheet handler
     gs = get_or_create_spreadsheet(client, spreadsheet_title, addtl_share_perms=waterfront_email_accts)
@@ -473,11 +579,11 @@ def add_reservation(client, appointment):
 
     # update the google sheet
     try:
-        logging.debug("Writing out to lessons spreadsheet: %s" % formatted_appt)
-        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s" % (spreadsheet_title, worksheet_title, spreadsheet_header, formatted_appt))
+        logging.debug("Writing out to lessons spreadsheet: %s", formatted_appt)
+        logging.debug("Spreadsheet info: Spreadsheet Title: %s, Worksheet Title: %s, Header: %s, Row to Append: %s", spreadsheet_title, worksheet_title, spreadsheet_header, formatted_appt)
         append_row_to_spreadsheet(gs, worksheet_title, spreadsheet_header, formatted_appt)
     except Exception as e:
-        logging.error("Failure updating google sheets: %s" % e)
+        logging.error("Failure updating google sheets: %s", e)
         return 1
 
     return 0
@@ -486,22 +592,14 @@ def add_reservation(client, appointment):
 # returns true if successful
 def update_appointment(client, appointment):
 
-    year = parsedate.isoparse(appointment['datetime']).year
-    logging.debug("Year in update_appointment was: %s" % year)
+    year = timestamps.parse(appointment['datetime']).year
+    logging.debug("Year in update_appointment was: %s", year)
 
     spreadsheet_titles = [
                             "SYC Waterfront - Year %s" % year,
                             "SYC Sailing Lessons and Races - %s" % year,
                             ]
 
-    # get the spreadsheet information
-    try:
-        (spreadsheet, worksheet_id, cell) = find_order_by_id(client, appointment['id'], spreadsheet_titles)
-        logging.debug("FOUND IT!")
-    except TypeError:
-        logging.warning("Could not find order in find_order_by_id")
-        return 1
-
     # Parse the updated appointment into the same format as we expect
     # Sailing and racing appointments include forms, where reservations do not
     # This is where we add the additional fields with forms if forms is defined
@@ -511,33 +609,28 @@ def update_appointment(client, appointment):
     if verify_member(client, appointment['email'], year):
         membership = 'Member'
 
-    formatted_appt = [
-                        appointment['id'],
-                        appointment['firstName'] + " " + appointment['lastName'],
-                        appointment['email'],
-                        appointment['phone'],
-                        appointment['date'],
-                    ]
-
     if appointment['forms'] != []:
-        for form in appointment['forms']:
-            logging.info("Parsing through the forms and adding them to the spreadsheet")
-            logging.debug("FOUND FORM: %s" % form)
+        logging.info("Parsing through the forms and adding them to the spreadsheet")
+        (header, formatted_appt) = format_lesson_race(appointment)
+        export = storage.persist('lessons', year, [format_lesson_record(re.sub(r"\W+|_", " ", appointment['type']), header, formatted_appt)])
+    else:
+        formatted_appt = format_reservation(appointment, membership)
+        export = storage.persist('reservations', year, [formatted_appt])
 
-            for question in form['values']:
-                logging.debug("FOUND QUESTION: %s" % question['name'])
-                logging.debug("FOUND RESPONSE: %s" % question['value'])
-                formatted_appt.append(question['value'])
+    if not export:
+        return 0
 
-    else:
-        formatted_appt.append(appointment['time'])
-        formatted_appt.append(appointment['endTime'])
-        formatted_appt.append(appointment['type'])
-        formatted_appt.append(membership)
+    # get the spreadsheet information
+    try:
+        (spreadsheet, worksheet_id, cell) = find_order_by_id(client, appointment['id'], spreadsheet_titles)
+        logging.debug("FOUND IT!")
+    except TypeError:
+        logging.warning("Could not find order in find_order_by_id")
+        return 1
 
     # Time to remove the row from the sheet
     if not update_row_in_spreadsheet(client, spreadsheet, worksheet_id, cell.row, formatted_appt):
-        logging.info("Updated row %s from spreadsheet %s worksheet %s with values: %s" % (cell.row, spreadsheet, worksheet_id, formatted_appt))
+        logging.info("Updated row %s from spreadsheet %s worksheet %s with values: %s", cell.row, spreadsheet, worksheet_id, formatted_appt)
 
     return 0
 
@@ -545,27 +638,316 @@ def update_appointment(client, appointment):
 # returns true if successful
 def remove_appointment(client, appointment):
 
-    year = parsedate.isoparse(appointment['datetime']).year
-    logging.debug("Year in remove_appointment was: %s" % year)
+    year = timestamps.parse(appointment['datetime']).year
+    logging.debug("Year in remove_appointment was: %s", year)
+
+    return remove_appointments(client, [appointment['id']], year)
+
+# removes many appointments at once, e.g. every race in a regatta that was cancelled. takes in a list of appointment ids and the year
+# rows are found with one read per spreadsheet and removed with one batch_update per spreadsheet
+# returns 0 if every appointment was found and removed
+def remove_appointments(client, appointment_ids, year):
 
     spreadsheet_titles = [
                             "SYC Waterfront - Year %s" % year,
                             "SYC Sailing Lessons and Races - %s" % year,
                             ]
 
-    # get the spreadsheet information
+    # an id is either a reservation or a lesson, so it's deleted from both
+    storage.persist('reservations', year, appointment_ids, mode='delete')
+    if not storage.persist('lessons', year, appointment_ids, mode='delete'):
+        return 0
+
+    found = find_orders_by_ids(client, appointment_ids, spreadsheet_titles)
+
+    return_value = 0
+    for appointment_id in appointment_ids:
+        if str(appointment_id) not in found:
+            logging.warning("Could not find order %s in find_orders_by_ids", appointment_id)
+            return_value = 1
+
+    order_ids_by_spreadsheet = {}
+    for (order_id, (spreadsheet, worksheet_id, row)) in found.items():
+        order_ids_by_spreadsheet.setdefault(spreadsheet, {}).setdefault(worksheet_id, []).append(order_id)
+
+    # Time to remove the rows from the sheets
+    for spreadsheet, order_ids_by_worksheet in order_ids_by_spreadsheet.items():
+        if not remove_rows_from_spreadsheet(client, spreadsheet, order_ids_by_worksheet):
+            logging.warning("Failed to remove orders %s from spreadsheet %s", order_ids_by_worksheet, spreadsheet)
+            return_value = 1
+
+    return return_value
+
+# get the worksheet schema for an appointment's type, building it from the form definitions attached to the
+# appointment the first time we see the type. schemas are cached for the life of the container, and built again if
+# an appointment's form questions no longer match the cached ones, e.g. after a question was added or renamed
+# returns tuple of header and form field ids in tuples
+def get_appointment_schema(appointment):
+    type_id = appointment['appointmentTypeID']
+    questions = tuple((question['fieldID'], question['name']) for form in appointment['forms'] for question in form['values'])
+
+    cached = appointment_schemas.get(type_id)
+    if cached is not None and cached[2] != questions:
+        logging.info("Form questions changed for appointment type %s, building its schema again", type_id)
+        cached = None
+
+    if cached is None:
+        header = list(spreadsheet_header_waterfront_lessons) + [name for (field_id, name) in questions]
+        field_ids = [field_id for (field_id, name) in questions]
+
+        cached = appointment_schemas[type_id] = (tuple(header), tuple(field_ids), questions)
+        logging.debug("Cached schema for appointment type %s: %s", type_id, cached)
+
+    return cached[:2]
+
+# format a lesson or race appointment into a row by projecting its form responses onto the schema for its type
+# returns tuple of header and row in lists
+def format_lesson_race(appointment):
+    (header, field_ids) = get_appointment_schema(appointment)
+
+    responses = {}
+    for form in appointment['forms']:
+        for question in form['values']:
+            responses[question['fieldID']] = question['value']
+
+    row = [
+            appointment['id'],
+            appointment['firstName'] + " " + appointment['lastName'],
+            appointment['email'],
+            appointment['phone'],
+            appointment['date'],
+        ]
+    row += [responses.get(field_id, '') for field_id in field_ids]
+
+    return (list(header), row)
+
+# format a lesson or race row from format_lesson_race the way the lessons table keeps it, with the worksheet it's listed
+# in and the form answers as JSON
+# returns row in list
+def format_lesson_record(worksheet_title, header, row):
+    fixed = len(spreadsheet_header_waterfront_lessons)
+
+    return row[:fixed] + [worksheet_title, json.dumps(dict(zip(header[fixed:], row[fixed:])))]
+
+# format a reservation appointment the same way add_reservation does
+# returns row in list
+def format_reservation(appointment, membership):
+    return [
+            appointment['id'],
+            appointment['firstName'] + " " + appointment['lastName'],
+            appointment['email'],
+            appointment['phone'],
+            appointment['date'],
+            appointment['time'],
+            appointment['endTime'],
+            appointment['type'],
+            membership,
+        ]
+
+# read every value out of the memberships worksheet for the year in one call, or from sheets_cache if the
+# spreadsheet hasn't changed since it was last read
+# returns set of cell values, which verify_member style lookups can check emails against
+def get_member_emails(client, year):
+    store = storage.get_store()
+    if store:
+        return store.values('memberships', year, ['primary_email', 'secondary_email'])
+
+    member_emails = set()
+
     try:
-        (spreadsheet, worksheet_id, cell) = find_order_by_id(client, appointment['id'], spreadsheet_titles)
-        logging.debug("FOUND IT!")
-    except TypeError:
-        logging.warning("Could not find order in find_order_by_id")
+        worksheets = sheets_cache.read_worksheets(client, "SYC Waterfront - Year %s" % year, worksheet_titles=['Memberships'])
+    except gspread.exceptions.SpreadsheetNotFound:
+        worksheets = []
+
+    if not worksheets:
+        logging.warning("Couldn't open up membership spreadsheet for membership verification")
+
+    for (worksheet_id, title, rows) in worksheets:
+        for row in rows:
+            member_emails.update(row)
+
+    return member_emails
+
+# compare the rows we want in a spreadsheet against what's there and fix up the difference in batched writes
+# takes the spreadsheet title, a dictionary of order id to (worksheet title, header, row) and optionally the
+# worksheet titles we own in the spreadsheet. worksheets we don't own are never read or touched
+# returns tuple of counts of rows added, updated and removed
+def reconcile_spreadsheet(client, spreadsheet_title, wanted, worksheet_titles=None, addtl_share_perms=None):
+    logging.debug("Entering reconcile_spreadsheet for %s", spreadsheet_title)
+
+    gs = get_or_create_spreadsheet(client, spreadsheet_title, addtl_share_perms=addtl_share_perms)
+
+    worksheets = [sheet for sheet in gs.worksheets() if worksheet_titles is None or sheet.title in worksheet_titles]
+
+    # one read for every worksheet we care about. unformatted, so numbers come back as numbers rather than however
+    # the cell displays them, see cells_match
+    value_ranges = []
+    if worksheets:
+        value_ranges = gs.values_batch_get([sheets_writer.quote_title(sheet.title) for sheet in worksheets],
+                                           params={'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'FORMATTED_STRING'})['valueRanges']
+
+    current = {}
+    headers = {}
+    updates = []
+    removes = {}
+
+    for sheet, value_range in zip(worksheets, value_ranges):
+        values = value_range.get('values', [])
+        headers[sheet.title] = values[0] if values else []
+
+        for row_number, row in enumerate(values[1:], start=2):
+            if not row or row[0] == '':
+                continue
+
+            order_id = str(row[0])
+            if order_id in current:
+                # duplicate rows left over from replayed webhooks, keep the first
+                removes.setdefault(sheet, []).append(row_number)
+            else:
+                current[order_id] = (sheet, row_number, row)
+
+    adds = {}
+    for order_id, (worksheet_title, header, row) in wanted.items():
+        if order_id not in current:
+            adds.setdefault(worksheet_title, (header, []))[1].append(row)
+
+    for order_id, (sheet, row_number, row) in current.items():
+        if order_id not in wanted:
+            removes.setdefault(sheet, []).append(row_number)
+            continue
+
+        (worksheet_title, header, wanted_row) = wanted[order_id]
+        if sheet.title != worksheet_title:
+            # appointment type changed, move it to the right worksheet
+            removes.setdefault(sheet, []).append(row_number)
+            adds.setdefault(worksheet_title, (header, []))[1].append(wanted_row)
+            continue
+
+        if not row_matches(row, wanted_row):
+            updates.append(("%s!A%s" % (sheets_writer.quote_title(sheet.title), row_number), wanted_row))
+
+        if headers[sheet.title] != header:
+            headers[sheet.title] = header
+            updates.append(("%s!A1" % sheets_writer.quote_title(sheet.title), header))
+
+    logging.info("Reconciling %s: %s to add, %s to update, %s to remove", spreadsheet_title, sum(len(rows) for (header, rows) in adds.values()), len(updates), sum(len(rows) for rows in removes.values()))
+
+    # updates go first while the row numbers we read are still good
+    if updates:
+        gs.values_batch_update(body={
+            'valueInputOption': 'USER_ENTERED',
+            'data': [{'range': cell_range, 'values': [row]} for (cell_range, row) in updates],
+        })
+
+    if removes:
+        delete_requests = []
+        for sheet, rows in removes.items():
+            delete_requests += delete_rows_requests(sheet, rows)
+
+        gs.batch_update({'requests': delete_requests})
+
+    if adds:
+        existing_sheets = {sheet.title: sheet for sheet in gs.worksheets()}
+
+        for worksheet_title, (header, rows) in adds.items():
+            target_sheet = existing_sheets.get(worksheet_title)
+            if target_sheet is None:
+                logging.warning("Couldn't find worksheet %s. Creating", worksheet_title)
+                target_sheet = gs.add_worksheet(title=worksheet_title, rows=1, cols=len(header))
+                target_sheet.append_row(header, value_input_option='USER_ENTERED')
+                target_sheet.freeze(rows=1)
+
+            target_sheet.append_rows(rows, value_input_option='USER_ENTERED', table_range='A1')
+
+    counts = (sum(len(rows) for (header, rows) in adds.values()), len(updates), sum(len(rows) for rows in removes.values()))
+    tracing.count('sheets.rows', sum(counts))
+    return counts
+
+# value to compare a cell on. Sheets parses what's written USER_ENTERED, so 10:00am is read back as 10:00 AM, an
+# age of 12 as the number 12 and a date in whatever format the cell picked. numbers, dates and times are compared
+# on what they parse to and anything else as text
+# returns float, datetime or string
+def comparable_value(value):
+    text = str(value).strip()
+    if text == '':
+        return text
+
+    try:
+        return round(float(text.replace('$', '').replace(',', '')), 6)
+    except ValueError:
+        pass
+
+    try:
+        return parsedate.parse(text)
+    except (ValueError, OverflowError):
+        return text
+
+# compare a row read from a worksheet with the row we'd write. the values api drops trailing empty cells, so those
+# don't count, and only cells that differ as text go through comparable_value
+# returns True if the row doesn't need rewriting
+def row_matches(row, wanted_row):
+    wanted_values = list(wanted_row)
+    while wanted_values and str(wanted_values[-1]) == '':
+        wanted_values.pop()
+
+    if len(row) != len(wanted_values):
+        return False
+
+    for (value, wanted_value) in zip(row, wanted_values):
+        if str(value) != str(wanted_value) and comparable_value(value) != comparable_value(wanted_value):
+            return False
+
+    return True
+
+# pull every appointment for the year from acuity and make the reservations and lessons spreadsheets match it
+# this picks up anything a missed or failed webhook left behind
+# returns 0 if successful
+def reconcile_appointments(client, year):
+    logging.info("Reconciling appointments for %s", year)
+
+    appointments = []
+    try:
+        for month in range(1, 13):
+            month_start = date(year, month, 1)
+            month_end = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+            appointments += get_appointments(month_start, month_end)
+    except requests.exceptions.HTTPError as e:
+        logging.critical("Got error from requests call: %s", e)
         return 1
 
-    # Time to remove the row from the sheet
+    logging.info("Got %s appointments from Acuity for %s", len(appointments), year)
+
+    member_emails = get_member_emails(client, year)
+
+    waterfront_title = "SYC Waterfront - Year %s" % year
+    lessons_title = "SYC Sailing Lessons and Races - %s" % year
 
-    if not remove_row_from_spreadsheet(client, spreadsheet, worksheet_id, cell.row):
-        logging.info("Removed cell %s from spreadsheet %s worksheet %s" % (cell, spreadsheet, worksheet_id))
+    wanted_reservations = {}
+    wanted_lessons = {}
 
+    for appointment in appointments:
+        if appointment['forms'] == []:
+            membership = 'Member' if appointment['email'] in member_emails else 'Non-Member'
+            wanted_reservations[str(appointment['id'])] = ('Reservations', spreadsheet_header_waterfront_reservations, format_reservation(appointment, membership))
+        else:
+            worksheet_title = re.sub(r"\W+|_", " ", appointment['type'])
+            (header, row) = format_lesson_race(appointment)
+            wanted_lessons[str(appointment['id'])] = (worksheet_title, header, row)
+
+    storage.persist('reservations', year, [row for (worksheet_title, header, row) in wanted_reservations.values()], mode='replace')
+    lesson_records = [format_lesson_record(worksheet_title, header, row) for (worksheet_title, header, row) in wanted_lessons.values()]
+    if not storage.persist('lessons', year, lesson_records, mode='replace'):
+        logging.info("Finished reconciling appointments for %s", year)
+        return 0
+
+    try:
+        reconcile_spreadsheet(client, waterfront_title, wanted_reservations, worksheet_titles=['Reservations'], addtl_share_perms=waterfront_email_accts)
+        reconcile_spreadsheet(client, lessons_title, wanted_lessons)
+    except gspread.exceptions.APIError as api_error:
+        logging.error("Failure reconciling google sheets: %s", api_error)
+        return 1
+
+    logging.info("Finished reconciling appointments for %s", year)
     return 0
 
 # parse out the string that is received by lambda in the body of the json document
@@ -575,10 +957,10 @@ def parse_lambda_event(unparsed_event):
     logging.debug("Entering parse_lambda_event")
 
     if unparsed_event['isBase64Encoded']:
-        logging.debug("Decoding from Lambda: %s" % unparsed_event['body'])
+        logging.debug("Decoding from Lambda: %s", unparsed_event['body'])
         body = base64.b64decode(unparsed_event['body']).decode('ascii')
     else:
-        logging.debug("Decoding from test harness: %s" % unparsed_event['body'])
+        logging.debug("Decoding from test harness: %s", unparsed_event['body'])
         body = unparsed_event['body']
 
     parameters = body.split('&')
@@ -590,9 +972,9 @@ def parse_lambda_event(unparsed_event):
         parsed_event[label] = value
 
     for label in parsed_event:
-        logging.debug(("Figured out parsed_event[label] in parse_lambda_event, value as: %s, %s") % (label, parsed_event[label]))
+        logging.debug("Figured out parsed_event[label] in parse_lambda_event, value as: %s, %s", label, parsed_event[label])
 
-    logging.debug("Returning parsed_event from parse_lambda_event: %s" % parsed_event)
+    logging.debug("Returning parsed_event from parse_lambda_event: %s", parsed_event)
     return parsed_event
 
 # enter the main event
@@ -611,9 +993,17 @@ def main(event, context):
     if os.path.exists(google_credentials_file):
         logging.info("Found Google credentials file")
     else:
-        logging.critical("Could not find Google credentials file: %s. Exiting" % google_credentials_file)
+        logging.critical("Could not find Google credentials file: %s. Exiting", google_credentials_file)
         return 1
 
+    # a webhook Acuity delivers again after it was handled is dropped here, before any Acuity or Google request
+    parsed_event = None
+    if event.get('job') is None:
+        parsed_event = parse_lambda_event(event)
+        if parsed_event['action'] in idempotent_actions and idempotency.already_handled(parsed_event['action'], parsed_event['id'], parsed_event):
+            logging.info("Already handled %s for %s, skipping it", parsed_event['action'], parsed_event['id'])
+            return 0
+
     try:
         client = auth_google(google_credentials_file)
         # testing if Google client handler works
@@ -623,45 +1013,56 @@ def main(event, context):
         # ValueError if bad file
         logging.critical("Could not authenticate to Google. Your credentials file appears mangled")
         return 1
-    except google.auth.exceptions.RefreshError as google_error:
-        logging.critical("Could not authenticate to Google: %s \nCheck your credentials. Exiting" % google_error)
+    except google_auth_exceptions.RefreshError as google_error:
+        logging.critical("Could not authenticate to Google: %s \nCheck your credentials. Exiting", google_error)
         return 1
 
+    # scheduled or manual invocations can ask for a full reconcile instead of handling a webhook
+    # e.g. {"job": "reconcile", "year": 2024}
+    if event.get('job') == 'reconcile':
+        year = int(event.get('year', datetime.now().year))
+        return reconcile_appointments(client, year)
+
+    # or remove a batch of appointments in one go, e.g. {"job": "remove", "year": 2024, "ids": [1234, 5678]}
+    if event.get('job') == 'remove':
+        year = int(event.get('year', datetime.now().year))
+        return remove_appointments(client, event['ids'], year)
+
     appointment = {}
-    parsed_event = parse_lambda_event(event)
     action = parsed_event['action']
 
     try:
         appointment = get_appointment_by_id(parsed_event['id'])
     except requests.exceptions.HTTPError as e:
-        logging.critical("Got error from requests call: %s" % e)
+        logging.critical("Got error from requests call: %s", e)
         return 1
 
     if not appointment:
-        logging.critical("Got no response from Acuity for id: %s. Was the id correct?" % parsed_event['id'])
+        logging.critical("Got no response from Acuity for id: %s. Was the id correct?", parsed_event['id'])
         return 1
 
-    logging.debug("appointment['forms'] is %s" % appointment['forms'])
+    logging.debug("appointment['forms'] is %s", appointment['forms'])
 
-    logging.info("Got an action of %s" % action)
+    logging.info("Got an action of %s", action)
+    handled = 0
     if action == 'scheduled':
         if appointment['forms'] == []:
             logging.info("Found a calendar event without a form. Forwarding to waterfront reservations")
             # If there's no forms attached, its a reservation
-            add_reservation(client, appointment)
+            handled = add_reservation(client, appointment)
         else:
             logging.info("Found a calendar event with forms attached. Forwarding to lessons and races")
             # If there are forms attached, its either a race or a lesson
-            add_lesson_race(client, appointment)
+            handled = add_lesson_race(client, appointment)
 
     elif action == 'canceled':
         logging.info("Caught a canceled event. Forwarding to remove_appointment")
         # if canceled we'll need to look for the event id in the waterfront spreadsheet/reservations worksheet, and the lessons spreadsheet/all worksheets for the order id
-        remove_appointment(client, appointment)
+        handled = remove_appointment(client, appointment)
 
         # if it has forms then add the transaction to the log
         if appointment['forms'] != []:
-            add_lesson_transaction(client, appointment)
+            handled = add_lesson_transaction(client, appointment, action) or handled
 
     elif action == 'rescheduled' or action == 'changed':
         logging.info("Caught a rescheduled or changed event. Forwarding to update_appointment")
@@ -670,16 +1071,23 @@ def main(event, context):
     elif action == 'order.completed':
         # Add to the transaction log
         logging.info("Caught order.completed. Adding the appointment to the transaction log")
-        add_lesson_transaction(client, appointment)
+        handled = add_lesson_transaction(client, appointment, action)
 
     else:
         logging.warning("Caught an unhandled action. Not doing anything with it.")
 
+    # only a webhook that went through is remembered, a failed one can still be delivered again
+    if action in idempotent_actions and handled == 0:
+        idempotency.record_handled(action, parsed_event['id'], parsed_event)
+
     logging.info("Finished")
     return 0
 
 def handler(event, context):
+    tracing.start('ScheduleBot')
     return_value = main(event, context)
+    ratelimit.flush_deferred()
+    tracing.finish(return_value=return_value)
     status_code = 200
 
     if return_value > 0:
@@ -692,7 +1100,7 @@ def handler(event, context):
                     "body": return_string,
                 }
 
-    logging.debug("Returning response of: %s" % json.dumps(response))
+    logging.debug("Returning response of: %s", json.dumps(response))
     return json.dumps(response)
 
 if __name__ == "__main__":
@@ -703,15 +1111,16 @@ if __name__ == "__main__":
         test_event = json.load(test_event_handler)
         test_event_handler.close()
     except FileNotFoundError as e:
-        logging.warning("Caught error opening test file: %s" % e)
+        logging.warning("Caught error opening test file: %s", e)
         sys.exit(return_val)
 
     context = None
 
     try:
         return_val = main(test_event, context)
+        ratelimit.flush_deferred()
     except KeyboardInterrupt:
         logging.critical("Caught a control-C. Bailing out")
 
-    logging.debug("Exiting test harness with %s" % return_val)
+    logging.debug("Exiting test harness with %s", return_val)
     sys.exit(return_val)
@@ -1,3 +1,7 @@
+-- Member search over the BigQuery order history. Takes named query parameters instead of values spliced into the
+-- SQL: @search matches any part of a member's name, the same as search_members in Postgres, with names where a word
+-- starts with it ranked first. @year_from/@year_to bound the order years and @page_size/@page_offset select one page
+-- of results. An empty search returns every member in the range.
 SELECT
   o.createdOn,
   o.customerEmail AS primaryEmail,
@@ -46,7 +50,8 @@ LEFT JOIN UNNEST(li.customizations) AS confirmMembershipTypeCust
   ON confirmMembershipTypeCust.label = 'Confirm Membership Type'
 WHERE
   li.productName LIKE '%Member%'
-  AND EXTRACT(YEAR FROM o.createdOn) = 2023
+  AND o.createdOn >= TIMESTAMP(DATE(@year_from, 1, 1))
+  AND o.createdOn < TIMESTAMP(DATE(@year_to + 1, 1, 1))
   AND (
     cust.label IN (
       'Primary Member Name',
@@ -60,7 +65,8 @@ WHERE
     AND cust.value IS NOT NULL
     AND cust.value <> ''
   )
-  AND LOWER(cust.value) LIKE {{'%' + textInput1.value.trim().toLowerCase() + '%'}}
+  -- STRPOS matches the search text literally, without the wildcards LIKE would give % and _
+  AND (TRIM(@search) = '' OR STRPOS(LOWER(cust.value), LOWER(TRIM(@search))) > 0)
 GROUP BY
   o.createdOn,
   primaryEmail,
@@ -75,4 +81,10 @@ GROUP BY
   emergencyContactPhone,
   dateOfBirth,
   confirmMembershipType,
-  primaryMemberName
\ No newline at end of file
+  primaryMemberName
+ORDER BY
+  STRPOS(CONCAT(' ', LOWER(memberName)), CONCAT(' ', LOWER(TRIM(@search)))) > 0 DESC,
+  memberName,
+  o.createdOn
+LIMIT @page_size
+OFFSET @page_offset
@@ -0,0 +1,38 @@
+-- Adds the extracted columns and indexes from syc_orders.sql to an existing syc_orders table and fills them in
+-- for rows inserted before OrderBot started writing them.
+ALTER TABLE syc_orders
+    ADD COLUMN IF NOT EXISTS custom_fields JSONB,
+    ADD COLUMN IF NOT EXISTS variant_fields JSONB,
+    ADD COLUMN IF NOT EXISTS product_category VARCHAR(20);
+
+-- Same rules as OrderBot's product_category()
+UPDATE syc_orders SET
+    custom_fields = CASE
+        WHEN jsonb_typeof(customizations) = 'array' THEN (
+            SELECT COALESCE(jsonb_object_agg(elem->>'label', elem->>'value'), '{}'::jsonb)
+            FROM jsonb_array_elements(customizations) elem
+            WHERE elem->>'label' IS NOT NULL
+        )
+        ELSE '{}'::jsonb
+    END,
+    variant_fields = CASE
+        WHEN jsonb_typeof(variant_options) = 'array' THEN (
+            SELECT COALESCE(jsonb_object_agg(elem->>'optionName', elem->>'value'), '{}'::jsonb)
+            FROM jsonb_array_elements(variant_options) elem
+            WHERE elem->>'optionName' IS NOT NULL
+        )
+        ELSE '{}'::jsonb
+    END,
+    product_category = CASE
+        WHEN product_name ILIKE '%Mooring Services%' THEN 'mooring_services'
+        WHEN product_name ILIKE '%Moorings%' THEN 'mooring'
+        WHEN product_name ILIKE '%Membership%' THEN 'membership'
+        ELSE 'other'
+    END
+WHERE product_category IS NULL;
+
+CREATE INDEX IF NOT EXISTS syc_orders_custom_fields_idx ON syc_orders USING GIN (custom_fields jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS syc_orders_created_on_idx ON syc_orders (created_on);
+CREATE INDEX IF NOT EXISTS syc_orders_category_created_on_idx ON syc_orders (product_category, created_on);
+
+ANALYZE syc_orders;
@@ -0,0 +1,47 @@
+-- Converts an existing flat syc_orders table into the partitioned table from syc_orders.sql, with one partition per
+-- order year. Run after 001_syc_orders_custom_fields.sql, with OrderBot paused so no orders arrive mid-copy.
+BEGIN;
+
+ALTER TABLE syc_orders RENAME TO syc_orders_flat;
+ALTER INDEX syc_orders_pkey RENAME TO syc_orders_flat_pkey;
+DROP INDEX IF EXISTS syc_orders_custom_fields_idx;
+DROP INDEX IF EXISTS syc_orders_created_on_idx;
+DROP INDEX IF EXISTS syc_orders_category_created_on_idx;
+
+CREATE TABLE syc_orders (LIKE syc_orders_flat INCLUDING DEFAULTS, PRIMARY KEY (id, created_on))
+    PARTITION BY RANGE (created_on);
+
+CREATE INDEX syc_orders_custom_fields_idx ON syc_orders USING GIN (custom_fields jsonb_path_ops);
+CREATE INDEX syc_orders_created_on_idx ON syc_orders (created_on);
+CREATE INDEX syc_orders_category_created_on_idx ON syc_orders (product_category, created_on);
+
+CREATE OR REPLACE FUNCTION create_syc_orders_partition(year INT)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('syc_orders_partition'));
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF syc_orders FOR VALUES FROM (%L) TO (%L)',
+        'syc_orders_' || year,
+        make_date(year, 1, 1),
+        make_date(year + 1, 1, 1)
+    );
+END
+$$;
+
+-- A partition for every year that has orders, plus the current one
+SELECT create_syc_orders_partition(year)
+FROM (
+    SELECT DISTINCT CAST(EXTRACT(YEAR FROM created_on) AS INT) AS year FROM syc_orders_flat
+    UNION
+    SELECT CAST(EXTRACT(YEAR FROM CURRENT_DATE) AS INT)
+) years;
+
+INSERT INTO syc_orders SELECT * FROM syc_orders_flat;
+
+DROP TABLE syc_orders_flat;
+
+COMMIT;
+
+ANALYZE syc_orders;
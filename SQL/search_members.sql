@@ -0,0 +1,72 @@
+-- Member search used by the Member Lookup app. Matches any part of a member's name through the trigram index on
+-- syc_members, ranks names where a word starts with the search text first, and returns one page of results
+-- for any range of years. total_count is the number of matches across all pages, for the table's pagination.
+-- An empty search returns every member in the range.
+CREATE OR REPLACE FUNCTION search_members(
+    search TEXT,
+    year_from INT,
+    year_to INT,
+    page_size INT DEFAULT 100,
+    page_offset INT DEFAULT 0
+)
+RETURNS TABLE (
+    id VARCHAR(24),
+    order_number VARCHAR(20),
+    created_on TIMESTAMP,
+    product_name VARCHAR(255),
+    renewal_type VARCHAR(255),
+    home_address VARCHAR(255),
+    home_phone VARCHAR(50),
+    cell_phone VARCHAR(50),
+    member_name VARCHAR(255),
+    primary_email VARCHAR(255),
+    emergency_contact VARCHAR(255),
+    emergency_phone VARCHAR(50),
+    child_photo VARCHAR(255),
+    customizations JSONB,
+    relationship VARCHAR(20),
+    primary_name VARCHAR(255),
+    total_count BIGINT
+)
+LANGUAGE sql STABLE
+AS $$
+    WITH pattern AS (
+        -- escape LIKE wildcards so the search text is matched literally
+        SELECT REPLACE(REPLACE(REPLACE(LOWER(TRIM(COALESCE(search, ''))), '\', '\\'), '%', '\%'), '_', '\_') AS text
+    )
+    SELECT
+        m.line_item_id,
+        m.order_number,
+        m.created_on,
+        m.product_name,
+        m.renewal_type,
+        m.home_address,
+        m.home_phone,
+        m.cell_phone,
+        m.member_name,
+        m.primary_email,
+        m.emergency_contact,
+        m.emergency_phone,
+        m.child_photo,
+        o.customizations,
+        m.relationship,
+        m.primary_name,
+        COUNT(*) OVER ()
+    FROM syc_members m
+    CROSS JOIN pattern
+    JOIN syc_orders o ON o.id = m.line_item_id AND o.created_on = m.created_on
+    -- ranges on created_on rather than EXTRACT(YEAR ...) so the created_on indexes apply and syc_orders only reads
+    -- the partitions for the years searched
+    WHERE m.created_on >= MAKE_TIMESTAMP(year_from, 1, 1, 0, 0, 0)
+    AND m.created_on < MAKE_TIMESTAMP(year_to + 1, 1, 1, 0, 0, 0)
+    AND o.created_on >= MAKE_TIMESTAMP(year_from, 1, 1, 0, 0, 0)
+    AND o.created_on < MAKE_TIMESTAMP(year_to + 1, 1, 1, 0, 0, 0)
+    AND LOWER(m.member_name) LIKE '%' || pattern.text || '%'
+    ORDER BY
+        (' ' || LOWER(m.member_name)) LIKE '% ' || pattern.text || '%' DESC,
+        m.member_index,
+        m.created_on,
+        m.line_item_id
+    LIMIT GREATEST(page_size, 1)
+    OFFSET GREATEST(page_offset, 0)
+$$;
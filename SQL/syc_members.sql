@@ -0,0 +1,100 @@
+-- One row per person on a membership order: the primary member, the secondary member and each child.
+-- OrderBot fills this in as orders arrive, so Member Lookup searches an indexed name column instead of
+-- unpacking customizations on every keystroke.
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE TABLE syc_members (
+    line_item_id VARCHAR(24) NOT NULL,
+    member_index INT NOT NULL,
+    relationship VARCHAR(20) NOT NULL,
+    member_name VARCHAR(255) NOT NULL,
+    date_of_birth VARCHAR(50),
+    order_number VARCHAR(20) NOT NULL,
+    created_on TIMESTAMP NOT NULL,
+    product_name VARCHAR(255),
+    renewal_type VARCHAR(255),
+    home_address VARCHAR(255),
+    home_phone VARCHAR(50),
+    cell_phone VARCHAR(50),
+    primary_name VARCHAR(255),
+    primary_email VARCHAR(255),
+    emergency_contact VARCHAR(255),
+    emergency_phone VARCHAR(50),
+    child_photo VARCHAR(255),
+    PRIMARY KEY (line_item_id, member_index)
+);
+
+CREATE INDEX syc_members_name_trgm_idx ON syc_members USING GIN (LOWER(member_name) gin_trgm_ops);
+CREATE INDEX syc_members_created_on_idx ON syc_members (created_on);
+
+-- Backfill from orders that arrived before OrderBot started filling syc_members.
+-- member_index is 0 for the primary member, 1 for the secondary and 2-6 for children #1-#5, and a child's
+-- date of birth is the customization right after their name, the same as MembershipBot reads it.
+INSERT INTO syc_members (
+    line_item_id, member_index, relationship, member_name, date_of_birth, order_number, created_on, product_name,
+    renewal_type, home_address, home_phone, cell_phone, primary_name, primary_email, emergency_contact,
+    emergency_phone, child_photo
+)
+SELECT
+    o.id,
+    people.member_index,
+    people.relationship,
+    people.member_name,
+    people.date_of_birth,
+    o.order_number,
+    o.created_on,
+    o.product_name,
+    fields.renewal_type,
+    fields.home_address,
+    fields.home_phone,
+    fields.cell_phone,
+    fields.primary_name,
+    fields.primary_email,
+    fields.emergency_contact,
+    fields.emergency_phone,
+    fields.child_photo
+FROM syc_orders o
+CROSS JOIN LATERAL (
+    SELECT
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'Confirm Membership Type') AS renewal_type,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' IN ('Primary Address', 'Address')) AS home_address,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'Home Phone') AS home_phone,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'Cell Phone') AS cell_phone,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'Primary Member Name') AS primary_name,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'Primary Email') AS primary_email,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'Emergency Contact Name') AS emergency_contact,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'Emergency Contact Phone') AS emergency_phone,
+        MAX(elem->>'value') FILTER (WHERE elem->>'label' = 'SYC Photography') AS child_photo
+    FROM jsonb_array_elements(o.customizations) elem
+) fields
+CROSS JOIN LATERAL (
+    SELECT
+        CASE
+            WHEN elem->>'label' = 'Primary Member Name' THEN 0
+            WHEN elem->>'label' = 'Secondary Member Name' THEN 1
+            ELSE 1 + CAST(RIGHT(elem->>'label', 1) AS INT)
+        END AS member_index,
+        CASE
+            WHEN elem->>'label' = 'Primary Member Name' THEN 'Primary Member'
+            WHEN elem->>'label' = 'Secondary Member Name' THEN 'Secondary Member'
+            ELSE 'Child Member'
+        END AS relationship,
+        elem->>'value' AS member_name,
+        CASE
+            WHEN elem->>'label' LIKE 'Child Family Member #%' THEN o.customizations->(CAST(pos AS INT))->>'value'
+        END AS date_of_birth
+    FROM jsonb_array_elements(o.customizations) WITH ORDINALITY AS elements(elem, pos)
+    WHERE elem->>'label' IN (
+        'Primary Member Name',
+        'Secondary Member Name',
+        'Child Family Member #1',
+        'Child Family Member #2',
+        'Child Family Member #3',
+        'Child Family Member #4',
+        'Child Family Member #5'
+    )
+    AND elem->>'value' IS NOT NULL
+    AND elem->>'value' <> ''
+) people
+WHERE o.product_name ILIKE '%Membership%'
+ON CONFLICT (line_item_id, member_index) DO NOTHING;
@@ -0,0 +1,24 @@
+-- One row per order with flags for what was bought on it. OrderBot keeps this up to date as orders arrive,
+-- so apps can answer "did this order include mooring services" with one indexed join instead of
+-- re-scanning syc_orders per row.
+CREATE TABLE syc_order_rollup (
+    order_number VARCHAR(20) PRIMARY KEY,
+    created_on TIMESTAMP NOT NULL,
+    customer_email VARCHAR(255),
+    has_membership BOOLEAN NOT NULL DEFAULT FALSE,
+    has_mooring BOOLEAN NOT NULL DEFAULT FALSE,
+    has_mooring_services BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+-- Backfill from orders that arrived before OrderBot started filling syc_order_rollup
+INSERT INTO syc_order_rollup (order_number, created_on, customer_email, has_membership, has_mooring, has_mooring_services)
+SELECT
+    order_number,
+    MIN(created_on),
+    MAX(customer_email),
+    BOOL_OR(product_category = 'membership'),
+    BOOL_OR(product_category = 'mooring'),
+    BOOL_OR(product_category = 'mooring_services')
+FROM syc_orders
+GROUP BY order_number
+ON CONFLICT (order_number) DO NOTHING;
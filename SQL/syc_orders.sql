@@ -1,5 +1,8 @@
+-- Partitioned by order year: syc_orders_<year> holds the orders created that year. OrderBot creates a year's partition
+-- with create_syc_orders_partition() before inserting its first order, and closed years can be archived and dropped
+-- with Scripts/ArchiveOrders. Queries that filter on a created_on range only read the partitions for those years.
 CREATE TABLE syc_orders (
-    id VARCHAR(24) PRIMARY KEY,
+    id VARCHAR(24) NOT NULL,
     order_number VARCHAR(20) NOT NULL,
     created_on TIMESTAMP NOT NULL,
     modified_on TIMESTAMP NOT NULL,
@@ -36,5 +39,34 @@ CREATE TABLE syc_orders (
     channel_name VARCHAR(50),
     external_order_reference VARCHAR(50),
     fulfilled_on TIMESTAMP,
-    price_tax_interpretation VARCHAR(20)
-);
+    price_tax_interpretation VARCHAR(20),
+    custom_fields JSONB,
+    variant_fields JSONB,
+    product_category VARCHAR(20),
+    PRIMARY KEY (id, created_on)
+) PARTITION BY RANGE (created_on);
+
+-- custom_fields and variant_fields are customizations and variantOptions folded into label -> value maps by OrderBot,
+-- so queries read custom_fields->>'Boat Color' instead of unpacking the arrays with jsonb_array_elements
+CREATE INDEX syc_orders_custom_fields_idx ON syc_orders USING GIN (custom_fields jsonb_path_ops);
+CREATE INDEX syc_orders_created_on_idx ON syc_orders (created_on);
+CREATE INDEX syc_orders_category_created_on_idx ON syc_orders (product_category, created_on);
+
+-- Create the partition for a year if it doesn't exist yet. Indexes on syc_orders are added to the new partition
+-- automatically. The advisory lock keeps two OrderBot invocations from racing to create the same partition.
+CREATE OR REPLACE FUNCTION create_syc_orders_partition(year INT)
+RETURNS VOID
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('syc_orders_partition'));
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF syc_orders FOR VALUES FROM (%L) TO (%L)',
+        'syc_orders_' || year,
+        make_date(year, 1, 1),
+        make_date(year + 1, 1, 1)
+    );
+END
+$$;
+
+SELECT create_syc_orders_partition(CAST(EXTRACT(YEAR FROM CURRENT_DATE) AS INT));
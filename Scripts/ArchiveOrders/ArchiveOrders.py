@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import argparse
+import csv
+import gzip
+import os
+import sys
+from datetime import date
+import psycopg2
+from psycopg2 import sql
+
+## function to connect to the orders database with the same credentials OrderBot uses
+## returns: psycopg2 connection
+def get_connection():
+    db_user = os.environ.get('DB_USER')
+    db_password = os.environ.get('DB_PASS')
+    db_server = os.environ.get('DB_SERVER')
+
+    return psycopg2.connect("postgresql://%s:%s@%s.us-west-2.retooldb.com/retool?sslmode=require" % (db_user, db_password, db_server))
+
+## function to check whether the syc_orders partition for a year exists
+## returns: True if it does
+def partition_exists(cursor, year):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", ("syc_orders_%s" % year,))
+    return cursor.fetchone()[0]
+
+## function to export one year's syc_orders partition to a gzipped CSV file with a header row
+## returns: number of rows exported
+def export_partition(cursor, year, output_dir):
+    partition = sql.Identifier("syc_orders_%s" % year)
+    path = os.path.join(output_dir, "syc_orders_%s.csv.gz" % year)
+
+    cursor.execute(sql.SQL("SELECT COUNT(*) FROM {}").format(partition))
+    row_count = cursor.fetchone()[0]
+
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as archive:
+        cursor.copy_expert(sql.SQL("COPY (SELECT * FROM {} ORDER BY created_on, id) TO STDOUT WITH (FORMAT csv, HEADER)").format(partition), archive)
+
+    # read the archive back before anything gets dropped, the header row is the extra line
+    with gzip.open(path, 'rt', encoding='utf-8', newline='') as archive:
+        archived_rows = sum(1 for row in csv.reader(archive)) - 1
+
+    if archived_rows != row_count:
+        raise RuntimeError("%s has %s rows but the partition has %s" % (path, archived_rows, row_count))
+
+    print("Exported %s rows from syc_orders_%s to %s" % (row_count, year, path))
+    return row_count
+
+## function to detach a year's partition from syc_orders and drop it, once it has been archived
+def drop_partition(cursor, year):
+    partition = sql.Identifier("syc_orders_%s" % year)
+
+    cursor.execute(sql.SQL("ALTER TABLE syc_orders DETACH PARTITION {}").format(partition))
+    cursor.execute(sql.SQL("DROP TABLE {}").format(partition))
+    print("Dropped partition syc_orders_%s" % year)
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive closed years of syc_orders to gzipped CSV files")
+    parser.add_argument('years', metavar='YEAR', type=int, nargs='+', help="order year to archive")
+    parser.add_argument('--output-dir', default='.', help="directory to write syc_orders_<year>.csv.gz files to")
+    parser.add_argument('--drop', action='store_true', help="drop each partition after it has been exported")
+    args = parser.parse_args()
+
+    if not all(os.environ.get(var) for var in ['DB_USER', 'DB_PASS', 'DB_SERVER']):
+        print("Failed to pass DB_USER, DB_PASS and DB_SERVER")
+        return 1
+
+    # only closed seasons get archived, the current year is still taking orders
+    current_year = date.today().year
+    if any(year >= current_year for year in args.years):
+        print("Only years before %s can be archived" % current_year)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    conn = get_connection()
+    cursor = conn.cursor()
+
+    try:
+        for year in args.years:
+            if not partition_exists(cursor, year):
+                print("No partition for %s, skipping" % year)
+                continue
+
+            export_partition(cursor, year, args.output_dir)
+            if args.drop:
+                drop_partition(cursor, year)
+            conn.commit()
+    except (psycopg2.Error, RuntimeError) as error:
+        conn.rollback()
+        print("Failed to archive orders: %s" % error)
+        return 1
+    finally:
+        cursor.close()
+        conn.close()
+
+    return 0
+
+if __name__ == "__main__":
+    return_val = 1
+    try:
+        return_val = main()
+    except KeyboardInterrupt:
+        print("Caught a control-C. Bailing out")
+
+    sys.exit(return_val)
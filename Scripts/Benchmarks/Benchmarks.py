@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# the bots and the modules they share, imported the same way they're laid out in the Lambda layers
+here = os.path.dirname(os.path.abspath(__file__))
+for directory in ('Common', 'MembershipBot', 'ScheduleBot', 'OrderBot'):
+    sys.path.insert(0, os.path.join(here, '..', '..', 'Bots', directory))
+
+import MembershipBot
+import ScheduleBot
+import idempotency
+import order_mapping
+import ratelimit
+import rollups
+import sheets_cache
+import sheets_writer
+import timestamps
+import tracing
+import fakeservices
+
+default_scales = [100, 1000, 10000]
+
+# cases that only get interesting well past the usual scales
+case_scales = {'write_worksheet': [5000, 50000]}
+year = 2024
+
+## function to map a Squarespace order to syc_orders rows the way OrderBot did before order_mapping, reading every
+## field off the payload once per line item. kept as the baseline the order_mapping case is compared against
+## returns: list of row tuples in order_mapping.order_columns order
+def per_field_order_rows(payload):
+    rows = []
+    for line_item in payload['lineItems']:
+        # Handle missing variantOptions
+        variant_options = json.dumps(line_item['variantOptions']) if 'variantOptions' in line_item else None
+
+        rows.append((
+            line_item['id'], payload['orderNumber'], payload['createdOn'], payload['modifiedOn'], payload['channel'], payload['testmode'],
+            payload['customerEmail'], payload['billingAddress']['firstName'], payload['billingAddress']['lastName'],
+            payload['billingAddress']['address1'], payload['billingAddress']['address2'], payload['billingAddress']['city'],
+            payload['billingAddress']['state'], payload['billingAddress']['countryCode'], payload['billingAddress']['postalCode'],
+            payload['billingAddress']['phone'], payload['fulfillmentStatus'], line_item['id'], line_item['variantId'],
+            variant_options, line_item['sku'], line_item['productId'], line_item['productName'], line_item['quantity'],
+            line_item['unitPricePaid']['value'], line_item['imageUrl'], line_item['lineItemType'],
+            json.dumps(line_item['customizations']), payload['subtotal']['value'], payload['shippingTotal']['value'],
+            payload['discountTotal']['value'], payload['taxTotal']['value'], payload['refundedTotal']['value'],
+            payload['grandTotal']['value'], payload['channelName'], payload['externalOrderReference'], payload['fulfilledOn'],
+            payload['priceTaxInterpretation'], json.dumps(order_mapping.label_map(line_item['customizations'], 'label')),
+            json.dumps(order_mapping.label_map(line_item.get('variantOptions'), 'optionName')), order_mapping.product_category(line_item['productName'])
+        ))
+
+    return rows
+
+## function to swap attributes for the length of a block, putting the originals back afterwards
+@contextmanager
+def patched(*patches):
+    originals = [(target, name, getattr(target, name)) for (target, name, value) in patches]
+    for (target, name, value) in patches:
+        setattr(target, name, value)
+    try:
+        yield
+    finally:
+        for (target, name, value) in originals:
+            setattr(target, name, value)
+
+## function to point the bots at the fake services. gspread gets a plain requests session instead of service account
+## credentials, the Sheets bucket gets the quota given (unlimited by default) and retries back off in milliseconds
+## so a benchmark measures the bots rather than sleeps
+@contextmanager
+def fake_environment(services, sheets_per_minute):
+    import gspread
+    import requests
+    from oauth2client import service_account
+
+    bucket_rate = sheets_per_minute if sheets_per_minute else 10 ** 9
+    environment = {
+        'SQUARESPACE_API_KEY': 'fake',
+        'STRIPE_API_KEY': 'sk_test_fake',
+        'ACUITY_API_USER': 'fake',
+        'ACUITY_API_KEY': 'fake',
+        'STORAGE_BACKEND': 'sheets',
+    }
+    saved_environment = {name: os.environ.get(name) for name in list(environment) + ['READ_CACHE_DIR', 'IDEMPOTENCY_PATH']}
+    os.environ.update(environment)
+
+    # ScheduleBot checks for a credentials file before it authenticates
+    working_directory = os.getcwd()
+    scratch = tempfile.TemporaryDirectory()
+    os.chdir(scratch.name)
+    with open('googleCreds.json', 'w') as credentials:
+        credentials.write('{}')
+    # and every case starts with a cold read cache
+    os.environ['READ_CACHE_DIR'] = os.path.join(scratch.name, 'sheets_cache')
+    # and no webhooks handled yet
+    os.environ['IDEMPOTENCY_PATH'] = os.path.join(scratch.name, 'idempotency.sqlite3')
+
+    try:
+        with patched(
+            (gspread, 'authorize', lambda credentials: gspread.Client(None, requests.Session())),
+            (service_account.ServiceAccountCredentials, 'from_json_keyfile_name', classmethod(lambda cls, *args, **kwargs: None)),
+            (ratelimit, 'sheets_bucket', ratelimit.TokenBucket(bucket_rate / 60.0, bucket_rate)),
+            (ratelimit, 'backoff_seconds', 0.001),
+            (ratelimit, 'max_backoff_seconds', 0.01),
+        ), services.install():
+            ratelimit.deferred_calls.clear()
+            ScheduleBot.appointment_schemas.clear()
+            MembershipBot.run_state.clear()
+            MembershipBot.write_plan.spreadsheets.clear()
+            MembershipBot.parsed_payments.clear()
+            sheets_cache.entries.clear()
+            sheets_cache.spreadsheet_ids.clear()
+            timestamps.parse.cache_clear()
+            timestamps.format_day.cache_clear()
+            idempotency.cached_store = None
+            yield services
+    finally:
+        os.chdir(working_directory)
+        scratch.cleanup()
+        for (name, value) in saved_environment.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+## function to make the fake services for a case at a scale, loaded with what the case reads
+## returns: FakeServices
+def make_services(case, scale, options):
+    services = fakeservices.FakeServices(seed=options.seed)
+
+    if case == 'sync_squarespace':
+        services.squarespace.orders = fakeservices.make_orders(scale, year, options.seed)
+        services.squarespace.transactions = fakeservices.make_transactions(services.squarespace.orders)
+    elif case == 'sync_stripe':
+        services.stripe = fakeservices.FakeStripe(fakeservices.make_balance_transactions(scale, year, options.seed))
+    elif case in ('order_mapping', 'order_mapping_per_field'):
+        services.squarespace.orders = fakeservices.make_orders(scale, year, options.seed)
+    elif case == 'parse':
+        services.squarespace.orders = fakeservices.make_orders(scale, year, options.seed)
+        services.squarespace.transactions = fakeservices.make_transactions(services.squarespace.orders)
+        services.stripe = fakeservices.FakeStripe(fakeservices.make_balance_transactions(scale, year, options.seed))
+    elif case == 'payments':
+        services.squarespace.transactions = fakeservices.make_transactions(fakeservices.make_orders(scale, year, options.seed))
+        services.stripe = fakeservices.FakeStripe(fakeservices.make_matching_balance_transactions(services.squarespace.transactions, options.seed))
+    elif case == 'summary':
+        # several years of orders, as if the summary were kept over all of them
+        services.squarespace.orders = fakeservices.make_orders(scale, year, options.seed)
+        services.squarespace.transactions = fakeservices.make_transactions(services.squarespace.orders)
+        services.stripe = fakeservices.FakeStripe(fakeservices.make_matching_balance_transactions(services.squarespace.transactions, options.seed))
+    elif case == 'write_worksheet':
+        # an all-years worksheet like FindNonRenewedMembers' "Prior 2022 All", over a worksheet already holding rows
+        orders = fakeservices.make_orders(scale, year, options.seed)
+        services.worksheet_rows = MembershipBot.format_orders(MembershipBot.parse_squarespace_orders(orders, MembershipBot.filter_type_orders))
+        services.google.add_spreadsheet("SYC Members", {'All Years': [list(MembershipBot.spreadsheet_header_orders)] + services.worksheet_rows[:100]})
+    else:
+        # ScheduleBot cases run against a year that already has scale appointments in the spreadsheets and a
+        # memberships worksheet to check against, plus one more reservation for the scheduled event to add
+        appointments = fakeservices.make_appointments(scale, year, options.seed)
+        reservation = next(a for a in reversed(appointments) if not a['forms'])
+        appointments.append(dict(reservation, id=appointments[-1]['id'] + 1))
+        services.acuity = fakeservices.FakeAcuity(appointments)
+
+        members = [list(MembershipBot.spreadsheet_header_members)]
+        members += [[str(1000 + index), a['firstName'] + ' ' + a['lastName'], a['email']] for (index, a) in enumerate(appointments[::2])]
+        services.google.add_spreadsheet("SYC Waterfront - Year %s" % year, {'Memberships': members})
+
+        if case != 'reconcile':
+            existing = fakeservices.FakeAcuity(appointments[:-1])
+            with fake_environment(services, None):
+                services.acuity, acuity = existing, services.acuity
+                ScheduleBot.reconcile_appointments(ScheduleBot.auth_google('googleCreds.json'), year)
+                services.acuity = acuity
+
+    # latency, errors and the quota only apply to the run being measured, not to loading the spreadsheets
+    services.latency = options.latency
+    services.error_rate = options.error_rate
+    services.sheets_quota = options.sheets_quota
+    services.reset_counts()
+    return services
+
+## function to pick the appointment a ScheduleBot event is about
+## returns: appointment dictionary
+def event_appointment(services, case, wants_forms):
+    appointments = sorted(services.acuity.appointments.values(), key=lambda a: a['id'])
+    if case == 'scheduled':
+        return appointments[-1]
+    for appointment in appointments[len(appointments) // 2:]:
+        if bool(appointment['forms']) == wants_forms:
+            return appointment
+    return appointments[0]
+
+## function to run one case against the fake services
+def run_case(case, services):
+    if case == 'sync_squarespace':
+        MembershipBot.sync_squarespace(year)
+        MembershipBot.write_planned()
+    elif case == 'sync_stripe':
+        MembershipBot.sync_stripe(year)
+        MembershipBot.write_planned()
+    elif case == 'parse':
+        # MembershipBot's parsers on their own, the CPU side of a sync. orders are parsed once per worksheet
+        for filter_types in (MembershipBot.filter_type_orders, MembershipBot.filter_type_members, MembershipBot.filter_type_moorings_all):
+            MembershipBot.parse_squarespace_orders(services.squarespace.orders, filter_types)
+        MembershipBot.parse_squarespace_transactions(services.squarespace.transactions)
+        MembershipBot.parse_stripe_transactions(services.stripe.balance_transactions, year)
+    elif case == 'order_mapping':
+        services.mapped_rows = order_mapping.orders_rows(services.squarespace.orders)
+    elif case == 'order_mapping_per_field':
+        services.mapped_rows = [row for order in services.squarespace.orders for row in per_field_order_rows(order)]
+    elif case == 'payments':
+        # parse both sides and reconcile them, as the end of a full MembershipBot run does
+        MembershipBot.reconcile_payments(MembershipBot.parse_squarespace_transactions(services.squarespace.transactions),
+                                         MembershipBot.parse_stripe_transactions(services.stripe.balance_transactions, year))
+    elif case == 'summary':
+        # add up the summary totals from nothing, then again from the run state after a new payment in the last
+        # month, as the next run does
+        squarespace_transacts = MembershipBot.parse_squarespace_transactions(services.squarespace.transactions)
+        stripe_transacts = MembershipBot.parse_stripe_transactions(services.stripe.balance_transactions, year)
+        partitions = MembershipBot.summary_partitions(squarespace_transacts, stripe_transacts, services.squarespace.orders)
+        rollup = rollups.Rollup(MembershipBot.summary_measures)
+        rollup.update(partitions, MembershipBot.summary_records)
+
+        last_month = max(partitions)
+        partitions[last_month] = partitions[last_month] + partitions[last_month][:1]
+        rollup = rollups.Rollup.from_state(json.loads(json.dumps(rollup.to_state())), MembershipBot.summary_measures)
+        rollup.update(partitions, MembershipBot.summary_records)
+        rollup.rows()
+    elif case == 'write_worksheet':
+        spreadsheet = MembershipBot.get_spreadsheet("SYC Members")
+        sheets_writer.rewrite_worksheet(spreadsheet, 'All Years', MembershipBot.spreadsheet_header_orders, services.worksheet_rows)
+    elif case == 'reconcile':
+        ScheduleBot.main({'job': 'reconcile', 'year': year}, None)
+    elif case == 'redelivered':
+        # a scheduled webhook delivered twice. only the second delivery's calls are counted, it should make none
+        appointment = event_appointment(services, 'scheduled', wants_forms=False)
+        event = {'isBase64Encoded': False, 'body': 'action=scheduled&id=%s&calendarID=1&appointmentTypeID=%s' % (appointment['id'], appointment['appointmentTypeID'])}
+        ScheduleBot.main(event, None)
+        ratelimit.flush_deferred()
+        services.reset_counts()
+        ScheduleBot.main(event, None)
+    else:
+        action = case.split(':')[1]
+        appointment = event_appointment(services, action, wants_forms=action in ('canceled', 'order.completed'))
+        event = {'isBase64Encoded': False, 'body': 'action=%s&id=%s&calendarID=1&appointmentTypeID=%s' % (action, appointment['id'], appointment['appointmentTypeID'])}
+        ScheduleBot.main(event, None)
+
+    ratelimit.flush_deferred()
+
+## function to run a case once for timing and once more under tracemalloc for memory, on fresh services each time
+## returns: dictionary of results
+def measure(case, scale, options):
+    services = make_services(case, scale, options)
+    with fake_environment(services, options.sheets_per_minute):
+        tracing.start(case)
+        started = time.perf_counter()
+        error = None
+        try:
+            run_case(case, services)
+        except Exception as e:
+            # e.g. retries running out against --sheets-quota, report it with the calls made up to that point
+            error = "%s: %s" % (type(e).__name__, e)
+        seconds = time.perf_counter() - started
+        counters = dict(tracing.counters)
+
+    result = {
+        'case': case,
+        'scale': scale,
+        'seconds': round(seconds, 4),
+        'calls': {service: services.service_calls(service) for service in ('squarespace', 'stripe', 'acuity', 'sheets', 'drive')},
+        'endpoints': dict(services.calls),
+        'sheets_bytes_sent': services.bytes_out['sheets'],
+        'errors': sum(services.errors.values()),
+        'retries': sum(value for (name, value) in counters.items() if name.endswith('.retries')),
+        'throttled_seconds': round(counters.get('sheets.throttled_seconds', 0), 4),
+    }
+
+    # the mapping cases are about throughput rather than calls
+    if hasattr(services, 'mapped_rows') and seconds > 0:
+        result['rows_per_second'] = round(len(services.mapped_rows) / seconds)
+
+    if error:
+        result['error'] = error
+    elif options.memory:
+        services = make_services(case, scale, options)
+        with fake_environment(services, options.sheets_per_minute):
+            tracing.start(case)
+            tracemalloc.start()
+            run_case(case, services)
+            (current, peak) = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        result['peak_mib'] = round(peak / 2 ** 20, 2)
+
+    return result
+
+table_columns = ['case', 'scale', 'seconds', 'peak_mib', 'squarespace', 'stripe', 'acuity', 'sheets', 'drive', 'retries']
+
+## function to print the header of the results table
+def print_header():
+    print('%-24s' % table_columns[0] + ''.join('%12s' % column for column in table_columns[1:]))
+
+## function to print one result as a row of the table, as soon as it's measured
+def print_row(result):
+    values = [result['scale'], result['seconds'], result.get('peak_mib', '-')]
+    values += [result['calls'][service] for service in table_columns[4:9]] + [result['retries']]
+    print('%-24s' % result['case'] + ''.join('%12s' % value for value in values))
+    if 'rows_per_second' in result:
+        print("  %s rows/sec" % result['rows_per_second'])
+    if 'error' in result:
+        print("  failed with %s" % result['error'][:200])
+
+cases = ['sync_squarespace', 'sync_stripe', 'parse', 'order_mapping', 'order_mapping_per_field', 'payments', 'summary', 'write_worksheet', 'reconcile', 'redelivered', 'event:scheduled', 'event:rescheduled', 'event:canceled', 'event:order.completed']
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the bots against fake Squarespace, Stripe, Acuity and Google services and report API calls, time and memory")
+    parser.add_argument('--scales', help="comma separated record counts (default 100,1000,10000, and 5000,50000 for write_worksheet)")
+    parser.add_argument('--cases', default=','.join(cases), help="comma separated cases to run (default all): %s" % ', '.join(cases))
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every fake API request (default 0)")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="share of requests answered with a 429 or 503 (default 0)")
+    parser.add_argument('--sheets-quota', type=int, help="Sheets requests per minute the fake allows before answering 429")
+    parser.add_argument('--sheets-per-minute', type=int, help="Sheets requests per minute the bots' rate limiter allows (default unlimited)")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="skip the tracemalloc run")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the generated data and injected errors")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=os.environ.get('LOGLEVEL', 'ERROR').upper())
+
+    unknown = set(args.cases.split(',')) - set(cases)
+    if unknown:
+        print("Unknown cases: %s" % ', '.join(sorted(unknown)))
+        return 1
+
+    results = []
+    print_header()
+    for case in args.cases.split(','):
+        if args.scales:
+            scales = [int(scale) for scale in args.scales.split(',')]
+        else:
+            scales = case_scales.get(case, default_scales)
+
+        for scale in scales:
+            results.append(measure(case, scale, args))
+            print_row(results[-1])
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    return 0
+
+if __name__ == "__main__":
+    return_val = 1
+    try:
+        return_val = main()
+    except KeyboardInterrupt:
+        print("Caught a control-C. Bailing out")
+
+    sys.exit(return_val)
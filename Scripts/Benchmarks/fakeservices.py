@@ -0,0 +1,1067 @@
+#!/usr/bin/env python3
+
+import base64
+import http.client
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from urllib.parse import parse_qs, unquote, urlencode, urlsplit
+import requests
+
+# In-process stand-ins for the APIs the bots call: the Squarespace orders and transactions APIs, Acuity appointments,
+# Stripe balance transactions, and the parts of the Google Sheets and Drive APIs gspread uses. install() swaps out
+# requests' HTTP adapter, so the bots, gspread and the stripe library all run unchanged down to the HTTP request,
+# and tracing and ratelimit see every call just like they would against the real services.
+
+squarespace_page_size = 50
+# Sheets turns away requests bigger than this
+sheets_max_request_bytes = 10 * 2 ** 20
+
+stripe_default_limit = 10
+stripe_max_limit = 100
+acuity_default_max = 100
+
+# a new spreadsheet gets one worksheet of this size, the same as a spreadsheet created in Google Drive
+default_rows = 1000
+default_columns = 26
+
+google_sheets_mime_type = 'application/vnd.google-apps.spreadsheet'
+
+## function to turn a zero based column index into a column letter, 0 is A and 26 is AA
+## returns: column letters in string
+def column_letters(index):
+    letters = ''
+    index += 1
+    while index:
+        (index, remainder) = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+## function to turn column letters into a zero based column index
+## returns: index in int
+def column_index(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - 64
+    return index - 1
+
+## function to format a value the way Sheets stores what gspread sends with USER_ENTERED
+## returns: cell value in string
+def cell_value(value):
+    if value is None:
+        return ''
+    if value is True or value is False:
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+## function to read a stored cell back the way an UNFORMATTED_VALUE read does, with numbers as numbers
+## returns: cell value in int, float or string
+def unformatted_value(value):
+    try:
+        number = float(value)
+    except ValueError:
+        return value
+    return int(number) if number.is_integer() and 'e' not in value.lower() else number
+
+## function to drop the empty cells and rows off the end of a block of values, like the values API does
+## returns: list of rows
+def trim_values(values):
+    trimmed = []
+    for row in values:
+        end = len(row)
+        while end and row[end - 1] == '':
+            end -= 1
+        trimmed.append(row[:end])
+
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+# raised by a handler to send an error response in the format the service uses
+class FakeError(Exception):
+
+    def __init__(self, status, message, reason=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.reason = reason or http.client.responses.get(status, 'Error')
+
+class Worksheet:
+
+    def __init__(self, sheet_id, title, index, rows=default_rows, columns=default_columns):
+        self.id = sheet_id
+        self.title = title
+        self.index = index
+        self.row_count = rows
+        self.column_count = columns
+        self.frozen_row_count = 0
+        self.frozen_column_count = 0
+        # only rows that have been written are stored, the rest of the grid is empty
+        self.values = []
+
+    def properties(self):
+        grid = {'rowCount': self.row_count, 'columnCount': self.column_count}
+        if self.frozen_row_count:
+            grid['frozenRowCount'] = self.frozen_row_count
+        if self.frozen_column_count:
+            grid['frozenColumnCount'] = self.frozen_column_count
+
+        return {'sheetId': self.id, 'title': self.title, 'index': self.index, 'sheetType': 'GRID', 'gridProperties': grid}
+
+    # write a block of values with its top left corner at row, column. the grid has to be big enough already
+    def write(self, row, column, values):
+        if row + len(values) > self.row_count or column + max((len(v) for v in values), default=0) > self.column_count:
+            raise FakeError(400, "Range ('%s'!%s%s) exceeds grid limits. Max rows: %s, max columns: %s" % (self.title, column_letters(column), row + 1, self.row_count, self.column_count))
+
+        while len(self.values) < row + len(values):
+            self.values.append([])
+
+        for (offset, new_values) in enumerate(values):
+            target = self.values[row + offset]
+            if len(target) < column + len(new_values):
+                target.extend([''] * (column + len(new_values) - len(target)))
+            target[column:column + len(new_values)] = [cell_value(value) for value in new_values]
+
+    # number of rows down to the last one with anything in it
+    def used_rows(self):
+        end = len(self.values)
+        while end and not any(self.values[end - 1]):
+            end -= 1
+        return end
+
+class Spreadsheet:
+
+    def __init__(self, spreadsheet_id, title, clock):
+        self.id = spreadsheet_id
+        self.title = title
+        self.created = clock()
+        self.modified = self.created
+        self.version = 0
+        self.permissions = []
+        self.worksheets = [Worksheet(0, 'Sheet1', 0)]
+
+    def worksheet(self, title):
+        for worksheet in self.worksheets:
+            if worksheet.title == title:
+                return worksheet
+        return None
+
+    def worksheet_by_id(self, sheet_id):
+        for worksheet in self.worksheets:
+            if worksheet.id == sheet_id:
+                return worksheet
+        raise FakeError(400, "No grid with id: %s" % sheet_id)
+
+    def metadata(self):
+        return {
+            'spreadsheetId': self.id,
+            'properties': {'title': self.title, 'locale': 'en_US', 'timeZone': 'America/New_York'},
+            'sheets': [{'properties': worksheet.properties()} for worksheet in self.worksheets],
+            'spreadsheetUrl': 'https://docs.google.com/spreadsheets/d/%s' % self.id,
+        }
+
+    # resolve an A1 range like 'Title'!A1:C5, Title!A:A or 'Title' to a worksheet and zero based bounds, with None
+    # for an open end
+    # returns tuple of worksheet, start row, start column, end row and end column
+    def parse_range(self, range_name):
+        if range_name.startswith("'"):
+            match = re.match(r"'((?:[^']|'')*)'(?:!(.*))?$", range_name)
+            if not match:
+                raise FakeError(400, "Unable to parse range: %s" % range_name)
+            (title, cells) = (match.group(1).replace("''", "'"), match.group(2))
+        elif '!' in range_name:
+            (title, cells) = range_name.split('!', 1)
+        elif self.worksheet(range_name):
+            (title, cells) = (range_name, None)
+        else:
+            # a bare A1 range refers to the first worksheet
+            (title, cells) = (self.worksheets[0].title, range_name)
+
+        worksheet = self.worksheet(title)
+        if worksheet is None:
+            raise FakeError(400, "Unable to parse range: %s" % range_name)
+
+        if not cells:
+            return (worksheet, 0, 0, None, None)
+
+        bounds = []
+        for corner in cells.split(':'):
+            match = re.match(r"([A-Z]*)(\d*)$", corner.upper())
+            if not match:
+                raise FakeError(400, "Unable to parse range: %s" % range_name)
+            column = column_index(match.group(1)) if match.group(1) else None
+            row = int(match.group(2)) - 1 if match.group(2) else None
+            bounds.append((row, column))
+
+        (start_row, start_column) = bounds[0]
+        (end_row, end_column) = bounds[-1]
+        return (
+            worksheet,
+            start_row or 0,
+            start_column or 0,
+            None if end_row is None else end_row + 1,
+            None if end_column is None else end_column + 1,
+        )
+
+# The Sheets and Drive side of Google. spreadsheets live in memory as lists of rows of strings
+class FakeGoogle:
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.spreadsheets = {}
+        self.next_id = 1
+
+    def new_spreadsheet(self, title):
+        spreadsheet_id = 'fake-%06d' % self.next_id
+        self.next_id += 1
+        spreadsheet = self.spreadsheets[spreadsheet_id] = Spreadsheet(spreadsheet_id, title, self.clock)
+        return spreadsheet
+
+    ## function to load a spreadsheet with worksheets before a run, e.g. a year of memberships for ScheduleBot to check
+    ## takes the title and a dictionary of worksheet title to rows, the first row being the header
+    ## returns: the spreadsheet
+    def add_spreadsheet(self, title, worksheets):
+        spreadsheet = self.new_spreadsheet(title)
+        spreadsheet.worksheets = []
+
+        for (index, (worksheet_title, rows)) in enumerate(worksheets.items()):
+            columns = max([len(row) for row in rows] + [default_columns])
+            worksheet = Worksheet(index, worksheet_title, index, rows=max(len(rows), 1), columns=columns)
+            worksheet.write(0, 0, rows)
+            spreadsheet.worksheets.append(worksheet)
+
+        return spreadsheet
+
+    def find(self, title):
+        for spreadsheet in self.spreadsheets.values():
+            if spreadsheet.title == title:
+                return spreadsheet
+        return None
+
+    def get(self, spreadsheet_id):
+        if spreadsheet_id not in self.spreadsheets:
+            raise FakeError(404, "Requested entity was not found.")
+        return self.spreadsheets[spreadsheet_id]
+
+    def touch(self, spreadsheet):
+        spreadsheet.version += 1
+        spreadsheet.modified = self.clock()
+
+    def drive_file(self, spreadsheet):
+        return {
+            'kind': 'drive#file',
+            'id': spreadsheet.id,
+            'name': spreadsheet.title,
+            'mimeType': google_sheets_mime_type,
+            'createdTime': rfc3339(spreadsheet.created),
+            'modifiedTime': rfc3339(spreadsheet.modified),
+            'version': str(spreadsheet.version),
+        }
+
+    def handle_drive(self, method, path, query, body):
+        # /drive/v3/files, /drive/v3/files/{id} or /drive/v3/files/{id}/permissions
+        parts = path.split('/')[4:]
+
+        if method == 'GET' and not parts:
+            match = re.search(r'name = "(.*?)"', query.get('q', [''])[0])
+            files = [self.drive_file(s) for s in self.spreadsheets.values() if match is None or s.title == match.group(1)]
+            return ('drive.files.list', {'kind': 'drive#fileList', 'files': files})
+
+        if method == 'POST' and not parts:
+            spreadsheet = self.new_spreadsheet(body['name'])
+            return ('drive.files.create', self.drive_file(spreadsheet))
+
+        spreadsheet = self.get(parts[0])
+
+        if method == 'GET' and len(parts) == 1:
+            return ('drive.files.get', self.drive_file(spreadsheet))
+
+        if method == 'DELETE' and len(parts) == 1:
+            del self.spreadsheets[spreadsheet.id]
+            return ('drive.files.delete', {})
+
+        if method == 'POST' and parts[1:] == ['permissions']:
+            permission = dict(body, id='perm-%s' % len(spreadsheet.permissions))
+            spreadsheet.permissions.append(permission)
+            return ('drive.permissions.create', permission)
+
+        raise FakeError(404, "No fake for Drive %s %s" % (method, path))
+
+    def handle_sheets(self, method, path, query, body):
+        # /v4/spreadsheets/{id}, /v4/spreadsheets/{id}:batchUpdate, /v4/spreadsheets/{id}/values/{range}:append, ...
+        match = re.match(r"/v4/spreadsheets/([^/:]+)(?::(\w+))?(?:/values(?:/([^:]+))?(?::(\w+))?)?$", path)
+        if not match:
+            raise FakeError(404, "No fake for Sheets %s %s" % (method, path))
+
+        (spreadsheet_id, spreadsheet_call, range_name, values_call) = match.groups()
+        spreadsheet = self.get(spreadsheet_id)
+        range_name = unquote(range_name) if range_name else None
+
+        if spreadsheet_call == 'batchUpdate':
+            replies = [self.apply_request(spreadsheet, request) for request in body.get('requests', [])]
+            self.touch(spreadsheet)
+            return ('sheets.batchUpdate', {'spreadsheetId': spreadsheet.id, 'replies': replies})
+
+        if '/values' not in path:
+            return ('sheets.get', spreadsheet.metadata())
+
+        if values_call == 'batchGet':
+            value_ranges = [self.read_range(spreadsheet, name, query) for name in query.get('ranges', [])]
+            return ('sheets.values.batchGet', {'spreadsheetId': spreadsheet.id, 'valueRanges': value_ranges})
+
+        if values_call == 'batchUpdate':
+            responses = []
+            for data in body.get('data', []):
+                responses.append(self.write_range(spreadsheet, data['range'], data.get('values', [])))
+            self.touch(spreadsheet)
+            return ('sheets.values.batchUpdate', {
+                'spreadsheetId': spreadsheet.id,
+                'totalUpdatedCells': sum(response['updatedCells'] for response in responses),
+                'responses': responses,
+            })
+
+        if values_call == 'batchClear':
+            for name in body.get('ranges', []):
+                self.clear_range(spreadsheet, name)
+            self.touch(spreadsheet)
+            return ('sheets.values.batchClear', {'spreadsheetId': spreadsheet.id, 'clearedRanges': body.get('ranges', [])})
+
+        if values_call == 'append':
+            insert_rows = query.get('insertDataOption', ['OVERWRITE'])[0] == 'INSERT_ROWS'
+            updates = self.append_range(spreadsheet, range_name, body.get('values', []), insert_rows)
+            self.touch(spreadsheet)
+            return ('sheets.values.append', {'spreadsheetId': spreadsheet.id, 'updates': updates})
+
+        if values_call == 'clear':
+            self.clear_range(spreadsheet, range_name)
+            self.touch(spreadsheet)
+            return ('sheets.values.clear', {'spreadsheetId': spreadsheet.id, 'clearedRange': range_name})
+
+        if method == 'PUT':
+            response = self.write_range(spreadsheet, range_name, body.get('values', []))
+            self.touch(spreadsheet)
+            return ('sheets.values.update', response)
+
+        return ('sheets.values.get', self.read_range(spreadsheet, range_name, query))
+
+    def read_range(self, spreadsheet, range_name, query):
+        (worksheet, start_row, start_column, end_row, end_column) = spreadsheet.parse_range(range_name)
+        end_row = min(end_row or worksheet.row_count, worksheet.row_count)
+        end_column = min(end_column or worksheet.column_count, worksheet.column_count)
+
+        values = trim_values([row[start_column:end_column] for row in worksheet.values[start_row:end_row]])
+        value_range = {
+            'range': "'%s'!%s%s:%s%s" % (worksheet.title, column_letters(start_column), start_row + 1, column_letters(end_column - 1), end_row),
+            'majorDimension': query.get('majorDimension', ['ROWS'])[0],
+        }
+
+        if query.get('valueRenderOption', ['FORMATTED_VALUE'])[0] == 'UNFORMATTED_VALUE':
+            values = [[unformatted_value(value) for value in row] for row in values]
+
+        if value_range['majorDimension'] == 'COLUMNS' and values:
+            width = max(len(row) for row in values)
+            values = trim_values([[row[c] if c < len(row) else '' for row in values] for c in range(width)])
+
+        if values:
+            value_range['values'] = values
+        return value_range
+
+    def write_range(self, spreadsheet, range_name, values):
+        (worksheet, start_row, start_column, end_row, end_column) = spreadsheet.parse_range(range_name)
+        worksheet.write(start_row, start_column, values)
+
+        return {
+            'spreadsheetId': spreadsheet.id,
+            'updatedRange': range_name,
+            'updatedRows': len(values),
+            'updatedCells': sum(len(row) for row in values),
+        }
+
+    # append after the last row of the table the range points at, growing the grid if the rows don't fit
+    def append_range(self, spreadsheet, range_name, values, insert_rows):
+        (worksheet, start_row, start_column, end_row, end_column) = spreadsheet.parse_range(range_name)
+        row = max(worksheet.used_rows(), start_row)
+        width = start_column + max((len(v) for v in values), default=0)
+
+        if insert_rows:
+            worksheet.values[row:row] = [[] for _ in values]
+            worksheet.row_count += len(values)
+        else:
+            worksheet.row_count = max(worksheet.row_count, row + len(values))
+        worksheet.column_count = max(worksheet.column_count, width)
+
+        worksheet.write(row, start_column, values)
+
+        return {
+            'spreadsheetId': spreadsheet.id,
+            'updatedRange': "'%s'!%s%s" % (worksheet.title, column_letters(start_column), row + 1),
+            'updatedRows': len(values),
+            'updatedCells': sum(len(v) for v in values),
+        }
+
+    def clear_range(self, spreadsheet, range_name):
+        (worksheet, start_row, start_column, end_row, end_column) = spreadsheet.parse_range(range_name)
+
+        for row in worksheet.values[start_row:end_row]:
+            for column in range(start_column, min(end_column or len(row), len(row))):
+                row[column] = ''
+
+    # apply one request from a spreadsheets batchUpdate
+    # returns the reply for it
+    def apply_request(self, spreadsheet, request):
+        (kind, details) = next(iter(request.items()))
+
+        if kind == 'addSheet':
+            properties = details.get('properties', {})
+            title = properties.get('title') or 'Sheet%s' % (len(spreadsheet.worksheets) + 1)
+            if spreadsheet.worksheet(title):
+                raise FakeError(400, 'Invalid requests[0].addSheet: A sheet with the name "%s" already exists. Please enter another name.' % title)
+
+            sheet_id = properties.get('sheetId')
+            if sheet_id is None:
+                sheet_id = max(worksheet.id for worksheet in spreadsheet.worksheets) + 1 if spreadsheet.worksheets else 0
+            elif any(worksheet.id == sheet_id for worksheet in spreadsheet.worksheets):
+                raise FakeError(400, "Invalid requests[0].addSheet: Sheet with id %s already exists." % sheet_id)
+
+            grid = properties.get('gridProperties', {})
+            worksheet = Worksheet(sheet_id, title, properties.get('index', len(spreadsheet.worksheets)), grid.get('rowCount', default_rows), grid.get('columnCount', default_columns))
+            worksheet.frozen_row_count = grid.get('frozenRowCount', 0)
+            spreadsheet.worksheets.append(worksheet)
+            return {'addSheet': {'properties': worksheet.properties()}}
+
+        if kind == 'deleteSheet':
+            worksheet = spreadsheet.worksheet_by_id(details['sheetId'])
+            if len(spreadsheet.worksheets) == 1:
+                raise FakeError(400, "Invalid requests[0].deleteSheet: You can't remove all the sheets in a document.")
+            spreadsheet.worksheets.remove(worksheet)
+            return {}
+
+        if kind in ('deleteDimension', 'insertDimension', 'appendDimension', 'autoResizeDimensions'):
+            dimension_range = details.get('range') or details.get('dimensions') or details
+            worksheet = spreadsheet.worksheet_by_id(dimension_range['sheetId'])
+            rows = dimension_range['dimension'] == 'ROWS'
+
+            if kind == 'deleteDimension':
+                (start, end) = (dimension_range['startIndex'], dimension_range['endIndex'])
+                if rows:
+                    if worksheet.row_count - (end - start) <= worksheet.frozen_row_count:
+                        raise FakeError(400, "Invalid requests[0].deleteDimension: You can't delete all the rows on the sheet.")
+                    del worksheet.values[start:end]
+                    worksheet.row_count -= end - start
+                else:
+                    for row in worksheet.values:
+                        del row[start:end]
+                    worksheet.column_count -= end - start
+            elif kind == 'insertDimension':
+                (start, end) = (dimension_range['startIndex'], dimension_range['endIndex'])
+                if rows:
+                    worksheet.values[start:start] = [[] for _ in range(end - start)]
+                    worksheet.row_count += end - start
+                else:
+                    for row in worksheet.values:
+                        row[start:start] = [''] * (end - start)
+                    worksheet.column_count += end - start
+            elif kind == 'appendDimension':
+                if rows:
+                    worksheet.row_count += details['length']
+                else:
+                    worksheet.column_count += details['length']
+            return {}
+
+        if kind == 'updateSheetProperties':
+            properties = details['properties']
+            worksheet = spreadsheet.worksheet_by_id(properties['sheetId'])
+            grid = properties.get('gridProperties', {})
+
+            for field in details.get('fields', '').replace('/', '.').split(','):
+                if field == 'title':
+                    worksheet.title = properties['title']
+                elif field == 'index':
+                    worksheet.index = properties['index']
+                elif field == 'gridProperties.rowCount':
+                    worksheet.row_count = grid['rowCount']
+                    del worksheet.values[grid['rowCount']:]
+                elif field == 'gridProperties.columnCount':
+                    worksheet.column_count = grid['columnCount']
+                    for row in worksheet.values:
+                        del row[grid['columnCount']:]
+                elif field == 'gridProperties.frozenRowCount':
+                    worksheet.frozen_row_count = grid.get('frozenRowCount', 0)
+                elif field == 'gridProperties.frozenColumnCount':
+                    worksheet.frozen_column_count = grid.get('frozenColumnCount', 0)
+            return {}
+
+        # formatting, filters and the like don't change any values, so they're accepted and ignored
+        return {}
+
+# Squarespace orders and transactions, paged with a cursor like the real API
+class FakeSquarespace:
+
+    def __init__(self, orders=None, transactions=None):
+        self.orders = orders or []
+        self.transactions = transactions or []
+
+    def handle(self, method, path, query, url):
+        if path == '/1.0/commerce/orders':
+            return ('squarespace.orders', self.page(self.orders, 'result', query, url))
+        if path == '/1.0/commerce/transactions':
+            return ('squarespace.transactions', self.page(self.transactions, 'documents', query, url))
+        if path.startswith('/1.0/commerce/orders/'):
+            for order in self.orders:
+                if order['id'] == path.rsplit('/', 1)[1]:
+                    return ('squarespace.order', order)
+            raise FakeError(404, "Order not found")
+
+        raise FakeError(404, "No fake for Squarespace %s %s" % (method, path))
+
+    def page(self, items, key, query, url):
+        if 'cursor' in query:
+            if set(query) - {'cursor'}:
+                raise FakeError(400, "Cannot specify other query parameters with a cursor")
+            state = json.loads(base64.urlsafe_b64decode(query['cursor'][0]))
+        else:
+            state = {'offset': 0, 'after': query.get('modifiedAfter', [None])[0], 'before': query.get('modifiedBefore', [None])[0]}
+
+        matching = [
+            item for item in items
+            if (state['after'] is None or item['modifiedOn'] > state['after']) and (state['before'] is None or item['modifiedOn'] < state['before'])
+        ]
+
+        offset = state['offset']
+        page = matching[offset:offset + squarespace_page_size]
+        pagination = {'hasNextPage': offset + squarespace_page_size < len(matching)}
+
+        if pagination['hasNextPage']:
+            cursor = base64.urlsafe_b64encode(json.dumps(dict(state, offset=offset + squarespace_page_size)).encode()).decode()
+            pagination['nextPageCursor'] = cursor
+            pagination['nextPageUrl'] = url.split('?')[0] + '?' + urlencode({'cursor': cursor})
+
+        return {key: page, 'pagination': pagination}
+
+# Acuity appointments, by id and by date range
+class FakeAcuity:
+
+    def __init__(self, appointments=None):
+        self.appointments = {str(appointment['id']): appointment for appointment in appointments or []}
+
+    def handle(self, method, path, query):
+        if path.startswith('/api/v1/appointments/'):
+            appointment = self.appointments.get(path.rsplit('/', 1)[1])
+            if appointment is None:
+                raise FakeError(404, "Appointment not found", 'not_found')
+            return ('acuity.appointment', appointment)
+
+        if path == '/api/v1/appointments':
+            min_date = query.get('minDate', ['0000'])[0]
+            max_date = query.get('maxDate', ['9999'])[0]
+            canceled = query.get('canceled', ['false'])[0] == 'true'
+            limit = int(query.get('max', [acuity_default_max])[0])
+
+            matching = sorted(
+                (a for a in self.appointments.values() if min_date <= a['datetime'][:10] <= max_date and a.get('canceled', False) == canceled),
+                key=lambda a: a['datetime'],
+                reverse=query.get('direction', ['DESC'])[0] == 'DESC',
+            )
+            return ('acuity.appointments', matching[:limit])
+
+        raise FakeError(404, "No fake for Acuity %s %s" % (method, path))
+
+# Stripe balance transactions, newest first and paged with starting_after like the real list API
+class FakeStripe:
+
+    def __init__(self, balance_transactions=None):
+        self.balance_transactions = sorted(balance_transactions or [], key=lambda tx: tx['created'], reverse=True)
+
+    def handle(self, method, path, query):
+        if path != '/v1/balance_transactions':
+            raise FakeError(404, "Unrecognized request URL (%s: %s)" % (method, path))
+
+        limit = min(int(query.get('limit', [stripe_default_limit])[0]), stripe_max_limit)
+        transactions = self.balance_transactions
+
+        for (parameter, test) in (('gte', lambda a, b: a >= b), ('gt', lambda a, b: a > b), ('lte', lambda a, b: a <= b), ('lt', lambda a, b: a < b)):
+            if 'created[%s]' % parameter in query:
+                bound = int(query['created[%s]' % parameter][0])
+                transactions = [tx for tx in transactions if test(tx['created'], bound)]
+
+        start = 0
+        if 'starting_after' in query:
+            ids = [tx['id'] for tx in transactions]
+            if query['starting_after'][0] not in ids:
+                raise FakeError(400, "No such balance transaction: '%s'" % query['starting_after'][0])
+            start = ids.index(query['starting_after'][0]) + 1
+
+        page = transactions[start:start + limit]
+        return ('stripe.balance_transactions', {
+            'object': 'list',
+            'data': page,
+            'has_more': start + limit < len(transactions),
+            'url': '/v1/balance_transactions',
+        })
+
+## function to format a unix time the way Drive does
+## returns: RFC 3339 string
+def rfc3339(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+# All of the services behind one HTTP adapter. latency is seconds added to every request, or a dictionary of service
+# to seconds. error_rate is the share of requests that fail with a 429 (Google) or 503 (the rest) before they reach
+# the service, and sheets_quota caps Sheets requests per minute the way Google's per-user quota does
+class FakeServices:
+
+    def __init__(self, orders=None, transactions=None, balance_transactions=None, appointments=None,
+                 latency=0.0, error_rate=0.0, sheets_quota=None, seed=0, clock=time.time):
+        self.google = FakeGoogle(clock)
+        self.squarespace = FakeSquarespace(orders, transactions)
+        self.acuity = FakeAcuity(appointments)
+        self.stripe = FakeStripe(balance_transactions)
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sheets_quota = sheets_quota
+        self.random = random.Random(seed)
+        self.sheets_requests = deque()
+        self.lock = threading.Lock()
+
+        # calls per service and per endpoint, and bytes sent and received per service
+        self.calls = Counter()
+        self.bytes_in = Counter()
+        self.bytes_out = Counter()
+        self.errors = Counter()
+
+    def reset_counts(self):
+        self.calls.clear()
+        self.bytes_in.clear()
+        self.bytes_out.clear()
+        self.errors.clear()
+
+    ## function to sum up the calls made to one service, e.g. 'sheets', 'drive' or 'stripe'
+    ## returns: number of calls
+    def service_calls(self, service):
+        return sum(count for (endpoint, count) in self.calls.items() if endpoint.split('.')[0] == service)
+
+    def service_for(self, host, path):
+        if host == 'sheets.googleapis.com':
+            return 'sheets'
+        if host == 'www.googleapis.com' and path.startswith('/drive/'):
+            return 'drive'
+        if host == 'api.squarespace.com':
+            return 'squarespace'
+        if host == 'acuityscheduling.com':
+            return 'acuity'
+        if host == 'api.stripe.com':
+            return 'stripe'
+        return None
+
+    # decide whether this request gets turned away before reaching the service
+    # returns FakeError or None
+    def injected_error(self, service):
+        if service == 'sheets' and self.sheets_quota:
+            now = time.monotonic()
+            while self.sheets_requests and now - self.sheets_requests[0] >= 60:
+                self.sheets_requests.popleft()
+            if len(self.sheets_requests) >= self.sheets_quota:
+                return FakeError(429, "Quota exceeded for quota metric 'Requests' and limit 'Requests per minute per user'", 'RESOURCE_EXHAUSTED')
+            self.sheets_requests.append(now)
+
+        if self.error_rate and self.random.random() < self.error_rate:
+            if service in ('sheets', 'drive'):
+                return FakeError(429, "Quota exceeded", 'RESOURCE_EXHAUSTED')
+            return FakeError(503, "Service unavailable")
+
+        return None
+
+    ## function to answer one prepared request from requests
+    ## returns: requests.Response
+    def handle(self, request):
+        url = urlsplit(request.url)
+        query = parse_qs(url.query, keep_blank_values=True)
+        service = self.service_for(url.hostname, url.path)
+
+        if service is None:
+            raise requests.exceptions.ConnectionError("No fake service for %s" % url.hostname, request=request)
+
+        body = request.body or b''
+        if isinstance(body, str):
+            body = body.encode()
+
+        latency = self.latency.get(service, 0.0) if isinstance(self.latency, dict) else self.latency
+        if latency:
+            time.sleep(latency)
+
+        with self.lock:
+            self.bytes_out[service] += len(body)
+            error = self.injected_error(service)
+
+            try:
+                if error:
+                    raise error
+                if service == 'sheets' and len(body) > sheets_max_request_bytes:
+                    raise FakeError(400, "Request payload size exceeds the limit: %s bytes." % sheets_max_request_bytes, 'INVALID_ARGUMENT')
+
+                payload = json.loads(body) if body and 'json' in request.headers.get('Content-Type', '') else {}
+                if service == 'sheets':
+                    (endpoint, result) = self.google.handle_sheets(request.method, url.path, query, payload)
+                elif service == 'drive':
+                    (endpoint, result) = self.google.handle_drive(request.method, url.path.rstrip('/'), query, payload)
+                elif service == 'squarespace':
+                    (endpoint, result) = self.squarespace.handle(request.method, url.path, query, request.url)
+                elif service == 'acuity':
+                    (endpoint, result) = self.acuity.handle(request.method, url.path, query)
+                else:
+                    (endpoint, result) = self.stripe.handle(request.method, url.path, query)
+                status = 200
+            except FakeError as e:
+                (endpoint, status) = ('%s.error' % service, e.status)
+                self.errors[service] += 1
+                result = error_body(service, e)
+
+            self.calls[endpoint] += 1
+            content = json.dumps(result).encode()
+            self.bytes_in[service] += len(content)
+
+        return make_response(request, status, content)
+
+    ## function to route every request made through requests to the fake services while the block runs
+    ## e.g. with services.install(): MembershipBot.sync_stripe(2024)
+    @contextmanager
+    def install(self):
+        original_send = requests.adapters.HTTPAdapter.send
+        services = self
+
+        def send(adapter, request, **kwargs):
+            return services.handle(request)
+
+        requests.adapters.HTTPAdapter.send = send
+        try:
+            yield self
+        finally:
+            requests.adapters.HTTPAdapter.send = original_send
+
+## function to build the error body each service sends
+## returns: dictionary
+def error_body(service, error):
+    if service in ('sheets', 'drive'):
+        return {'error': {'code': error.status, 'message': error.message, 'status': error.reason}}
+    if service == 'stripe':
+        return {'error': {'message': error.message, 'type': 'invalid_request_error'}}
+    if service == 'acuity':
+        return {'status_code': error.status, 'message': error.message, 'error': error.reason}
+    return {'type': error.reason, 'message': error.message}
+
+## function to wrap a fake result in a real requests.Response so raise_for_status, json() and the rest work
+## returns: requests.Response
+def make_response(request, status, content):
+    response = requests.Response()
+    response.status_code = status
+    response.reason = http.client.responses.get(status, '')
+    response._content = content
+    response.headers = requests.structures.CaseInsensitiveDict({'Content-Type': 'application/json; charset=UTF-8', 'Content-Length': str(len(content))})
+    response.encoding = 'utf-8'
+    response.url = request.url
+    response.request = request
+    return response
+
+first_names = ['Alex', 'Jamie', 'Morgan', 'Taylor', 'Jordan', 'Casey', 'Riley', 'Avery', 'Quinn', 'Parker']
+last_names = ['Smith', 'Johnson', 'Lee', 'Brown', 'Garcia', 'Miller', 'Davis', 'Wilson', 'Moore', 'Clark']
+membership_products = ['Family Membership', 'Partner Membership', 'Individual Membership', 'Emeritus Membership', 'Junior Membership']
+mooring_products = ['Shoreline', 'Water-Row A', 'Water-Row B', 'Water-Row C', 'Water-Row D']
+lesson_types = [(101, 'Opti Lessons - Week 1'), (102, 'Laser Racing Series'), (103, 'Adult Learn to Sail')]
+reservation_types = [(201, 'Kayak Reservation'), (202, 'Paddleboard Reservation')]
+
+def money(value):
+    return {'currency': 'USD', 'value': '%.2f' % value}
+
+## function to pick a time in the year, spread evenly over it so paging by date sees a realistic mix
+## returns: datetime
+def time_in_year(year, index, count):
+    start = datetime(year, 1, 1, tzinfo=timezone.utc)
+    seconds = (datetime(year, 12, 29, tzinfo=timezone.utc) - start).total_seconds()
+    return start + timedelta(seconds=seconds * index / max(count, 1))
+
+def squarespace_time(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.') + '%03dZ' % (moment.microsecond // 1000)
+
+## function to make Squarespace orders for a year: memberships, moorings and mooring services in about the mix
+## the club sees. each order has one or two line items shaped like the orders API returns them. mooring services
+## bought on their own come from someone who already has a mooring, sometimes with their email typed differently
+## returns: list of orders
+def make_orders(count, year, seed=0):
+    chooser = random.Random(seed)
+    orders = []
+    mooring_customers = []
+
+    for index in range(count):
+        first = chooser.choice(first_names)
+        last = chooser.choice(last_names)
+        email = '%s.%s%s@example.com' % (first.lower(), last.lower(), index)
+        created = time_in_year(year, index, count)
+        line_items = []
+
+        kind = chooser.random()
+        if kind < 0.6:
+            product = chooser.choice(membership_products)
+            customizations = [
+                {'label': 'Confirm Membership Type', 'value': chooser.choice(['New', 'Renewal'])},
+                {'label': 'Home Phone', 'value': ' 508-555-%04d ' % index},
+                {'label': 'Cell Phone', 'value': '508-555-%04d' % (index + 1)},
+                {'label': 'Secondary Member Name', 'value': '%s %s' % (chooser.choice(first_names), last)},
+                {'label': 'Secondary Member Email', 'value': 'partner%s@example.com' % index},
+                {'label': 'Emergency Contact Name', 'value': chooser.choice(first_names)},
+                {'label': 'Emergency Contact Phone', 'value': '508-555-9999'},
+            ]
+            if product == 'Family Membership':
+                customizations += [
+                    {'label': 'Child Family Member #1', 'value': '%s %s' % (chooser.choice(first_names), last)},
+                    {'label': 'Date of Birth', 'value': '05/17/2014'},
+                    {'label': 'SYC Photography', 'value': "SYC may publish my child's photo."},
+                ]
+            line_items.append((product, customizations, []))
+        elif kind < 0.9:
+            product = chooser.choice(mooring_products)
+            customizations = [
+                {'label': 'Phone', 'value': '508-555-%04d' % index},
+                {'label': 'Type of Boat', 'value': chooser.choice(['Kayak', 'Sunfish', 'Canoe'])},
+                {'label': 'Boat Color', 'value': chooser.choice(['Red', 'White', 'Green'])},
+                {'label': 'Town Boat Permit #', 'value': str(10000 + index)},
+            ]
+            line_items.append((product, customizations, [{'optionName': 'Color', 'value': chooser.choice(['Red', 'Blue'])}]))
+            if chooser.random() < 0.3:
+                line_items.append(('Mooring Services', None, []))
+            mooring_customers.append((first, last, email))
+        else:
+            if mooring_customers:
+                (first, last, email) = chooser.choice(mooring_customers)
+                email = chooser.choice([email, email.upper(), ' %s ' % email.capitalize()])
+            line_items.append(('Mooring Services', None, []))
+
+        total = 0.0
+        items = []
+        for (item_index, (product, customizations, variant_options)) in enumerate(line_items):
+            price = chooser.choice([75.0, 150.0, 250.0, 400.0])
+            total += price
+            items.append({
+                'id': '%024x' % (index * 4 + item_index),
+                'variantId': 'variant-%s' % product,
+                'variantOptions': variant_options,
+                'sku': 'SQ%07d' % chooser.randrange(10 ** 7),
+                'productId': 'product-%s' % product,
+                'productName': product,
+                'quantity': 1,
+                'unitPricePaid': money(price),
+                'imageUrl': 'https://images.example.com/%s.png' % item_index,
+                'lineItemType': 'PHYSICAL',
+                'customizations': customizations,
+            })
+
+        orders.append({
+            'id': '%024x' % (10 ** 9 + index),
+            'orderNumber': str(1000 + index),
+            'createdOn': squarespace_time(created),
+            'modifiedOn': squarespace_time(created + timedelta(minutes=5)),
+            'channel': 'web',
+            'testmode': False,
+            'customerEmail': email,
+            'billingAddress': {
+                'firstName': first,
+                'lastName': last,
+                'address1': '%s Farm Road' % (index + 1),
+                'address2': None if index % 3 else 'Unit 2',
+                'city': 'Sherborn',
+                'state': 'MA',
+                'countryCode': 'US',
+                'postalCode': '01770',
+                'phone': '508-555-%04d' % index,
+            },
+            'fulfillmentStatus': 'PENDING',
+            'lineItems': items,
+            'subtotal': money(total),
+            'shippingTotal': money(0),
+            'discountTotal': money(0),
+            'taxTotal': money(0),
+            'refundedTotal': money(0),
+            'grandTotal': money(total),
+            'channelName': 'Squarespace',
+            'externalOrderReference': None,
+            'fulfilledOn': None,
+            'priceTaxInterpretation': 'EXCLUSIVE',
+        })
+
+    return orders
+
+## function to make the Squarespace transactions that go with a list of orders, one payment each
+## returns: list of transactions
+def make_transactions(orders):
+    transactions = []
+
+    for (index, order) in enumerate(orders):
+        total = float(order['grandTotal']['value'])
+        fee = round(total * 0.029 + 0.3, 2)
+        transactions.append({
+            'id': '%024x' % (2 * 10 ** 9 + index),
+            'createdOn': order['createdOn'],
+            'modifiedOn': order['modifiedOn'],
+            'customerEmail': order['customerEmail'],
+            'salesOrderId': order['id'],
+            'voided': False,
+            'totalSales': money(total),
+            'totalNetSales': money(total),
+            'totalTaxes': money(0),
+            'total': money(total),
+            'totalNetPayment': money(total - fee),
+            'discounts': [],
+            'payments': [{
+                'id': 'payment-%s' % index,
+                'amount': money(total),
+                'refundedAmount': money(0),
+                'netAmount': money(total - fee),
+                'creditCardType': 'VISA',
+                'provider': 'STRIPE',
+                'refunds': [],
+                'processingFees': [{'id': 'fee-%s' % index, 'amount': money(fee), 'amountGatewayTransactionId': 'txn_%s' % index}],
+                'giftCardId': None,
+                'paidOn': order['createdOn'],
+                'externalTransactionId': 'ch_%024d' % index,
+            }],
+            'salesLineItems': [],
+            'documentNumber': order['orderNumber'],
+            'shippingLineItems': [],
+            'paymentGatewayError': None,
+        })
+
+    return transactions
+
+## function to make Stripe balance transactions for a year, charges with the odd refund and payout
+## returns: list of balance transactions
+def make_balance_transactions(count, year, seed=0):
+    chooser = random.Random(seed)
+    transactions = []
+
+    for index in range(count):
+        created = int(time_in_year(year, index, count).timestamp())
+        kind = chooser.random()
+        (tx_type, category) = ('charge', 'charge') if kind < 0.85 else (('refund', 'refund') if kind < 0.93 else ('payout', 'payout'))
+        amount = chooser.choice([7500, 15000, 25000, 40000]) * (-1 if tx_type != 'charge' else 1)
+        fee = int(abs(amount) * 0.029 + 30) if tx_type == 'charge' else 0
+
+        transactions.append({
+            'id': 'txn_%024d' % index,
+            'object': 'balance_transaction',
+            'amount': amount,
+            'available_on': created + 2 * 86400,
+            'created': created,
+            'currency': 'usd',
+            'description': 'Charge for member%s@example.com' % index if tx_type == 'charge' else 'STRIPE %s' % tx_type.upper(),
+            'exchange_rate': None,
+            'fee': fee,
+            'fee_details': [],
+            'net': amount - fee,
+            'reporting_category': category,
+            'source': 'ch_%024d' % index,
+            'status': 'available',
+            'type': tx_type,
+        })
+
+    return transactions
+
+## function to make the Stripe side of some Squarespace transactions: a charge for each Stripe payment, with the odd
+## one missing or its fee off by a few cents, plus charges Squarespace never saw and a payout now and then
+## returns: list of balance transactions
+def make_matching_balance_transactions(transactions, seed=0):
+    chooser = random.Random(seed)
+    balance_transactions = []
+
+    for (index, tx) in enumerate(transactions):
+        payment = tx['payments'][0]
+        created = int(datetime.fromisoformat(payment['paidOn'].replace('Z', '+00:00')).timestamp())
+        amount = int(round(float(payment['amount']['value']) * 100))
+        fee = int(round(float(payment['processingFees'][0]['amount']['value']) * 100))
+
+        kind = chooser.random()
+        if kind < 0.01:
+            continue
+        if kind < 0.03:
+            fee += chooser.choice([-5, 1, 12])
+
+        balance_transactions.append({
+            'id': 'txn_%024d' % index,
+            'object': 'balance_transaction',
+            'amount': amount,
+            'available_on': created + 2 * 86400,
+            'created': created,
+            'currency': 'usd',
+            'description': 'Charge for %s' % tx['customerEmail'],
+            'exchange_rate': None,
+            'fee': fee,
+            'fee_details': [],
+            'net': amount - fee,
+            'reporting_category': 'charge',
+            'source': payment['externalTransactionId'],
+            'status': 'available',
+            'type': 'charge',
+        })
+
+        if kind > 0.99:
+            balance_transactions.append(dict(balance_transactions[-1], id='txn_x%023d' % index, source='ch_x%023d' % index, description='Charge for someone@example.com'))
+        elif kind > 0.97:
+            balance_transactions.append(dict(balance_transactions[-1], id='txn_p%023d' % index, source='po_%024d' % index, amount=-amount, fee=0, net=-amount,
+                                             description='STRIPE PAYOUT', reporting_category='payout', type='payout'))
+
+    return balance_transactions
+
+## function to make Acuity appointments for a year, a mix of reservations with no forms and lessons and races with
+## one intake form each, laid out the way the appointments API returns them
+## returns: list of appointments
+def make_appointments(count, year, seed=0, first_id=10000):
+    chooser = random.Random(seed)
+    appointments = []
+
+    for index in range(count):
+        start = time_in_year(year, index, count).replace(minute=0, second=0, microsecond=0, tzinfo=None)
+        first = chooser.choice(first_names)
+        last = chooser.choice(last_names)
+
+        if chooser.random() < 0.5:
+            (type_id, type_name) = chooser.choice(reservation_types)
+            forms = []
+        else:
+            (type_id, type_name) = chooser.choice(lesson_types)
+            forms = [{
+                'id': 900 + type_id,
+                'name': 'Sailor Information',
+                'values': [
+                    {'id': index * 3, 'fieldID': 1, 'name': 'Sailor Name', 'value': '%s %s' % (chooser.choice(first_names), last)},
+                    {'id': index * 3 + 1, 'fieldID': 2, 'name': 'Sailor Age', 'value': str(chooser.randrange(8, 17))},
+                    {'id': index * 3 + 2, 'fieldID': 3, 'name': 'Swim Test', 'value': chooser.choice(['yes', 'no'])},
+                ],
+            }]
+
+        price = chooser.choice([25.0, 150.0, 300.0])
+        appointments.append({
+            'id': first_id + index,
+            'firstName': first,
+            'lastName': last,
+            'phone': '508-555-%04d' % (index % 10000),
+            'email': '%s.%s%s@example.com' % (first.lower(), last.lower(), index),
+            'date': start.strftime('%B %-d, %Y'),
+            'time': start.strftime('%-I:%M%p').lower(),
+            'endTime': (start + timedelta(hours=1)).strftime('%-I:%M%p').lower(),
+            'datetime': start.strftime('%Y-%m-%dT%H:%M:%S') + '-0400',
+            'type': type_name,
+            'appointmentTypeID': type_id,
+            'calendarID': 1,
+            'price': '%.2f' % price,
+            'amountPaid': '%.2f' % price,
+            'paid': 'yes',
+            'canceled': False,
+            'forms': forms,
+        })
+
+    return appointments
@@ -8,7 +8,12 @@ import requests
 from requests.auth import HTTPBasicAuth
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import date, datetime, timedelta
-from dateutil import parser as parsedate
+
+# the Sheets rate limiter, writer and timestamp parsing are shared with the bots
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'Bots', 'Common'))
+import ratelimit
+import sheets_writer
+import timestamps
 
 filter_type_members = [
                         'Family Membership',
@@ -136,7 +141,7 @@ def parse_squarespace_orders(unparsed_orders, filter_types):
 
         parsed_order['home_address'] = street_address + ", " + member['billingAddress']['city'] + ", " + member['billingAddress']['state'] + " " + member['billingAddress']['postalCode']
 
-        parsed_order['year'] = parsedate.isoparse(member['modifiedOn']).year
+        parsed_order['year'] = timestamps.parse(member['modifiedOn']).year
         parsed_order['fulfillment'] = member['fulfillmentStatus']
         parsed_order['price_paid'] = member['grandTotal']['value']
         parsed_order['price_discount'] = member['discountTotal']['value']
@@ -199,7 +204,7 @@ def get_spreadsheet(spreadsheet_title, addtl_share_perms=[], notify_users=False)
     credentials = ServiceAccountCredentials.from_json_keyfile_name('googleCreds.json', scope)
 
     # authorize the clientsheet
-    client = gspread.authorize(credentials)
+    client = sheets_writer.keep_opened_metadata(ratelimit.limit_gspread(gspread.authorize(credentials)))
 
     # get the instance of the Spreadsheet
     try:
@@ -215,28 +220,10 @@ def get_spreadsheet(spreadsheet_title, addtl_share_perms=[], notify_users=False)
 
     return handler
 
+## function to rewrite a worksheet with a header and rows. the grid is sized once, and the all-years worksheets,
+## which can be too big for one request, are written in blocks several at a time
 def update_spreadsheet(spreadsheet, worksheet_title, header_row, rows_to_add):
-
-    # make a spreadsheet for the year if necessary
-    # set the target_sheet for the sheet we'll be writing to
-    worksheets = spreadsheet.worksheets()
-
-    target_sheet = None
-    for sheet in worksheets:
-        if sheet.title == worksheet_title:
-            target_sheet = sheet
-
-    # If sheet was not found create it
-    if not target_sheet:
-        target_sheet = spreadsheet.add_worksheet(title=worksheet_title, rows=1, cols=len(rows_to_add[0]))
-
-    target_sheet.clear()
-    target_sheet.resize(rows=1)
-    target_sheet.append_row(header_row, value_input_option='USER-ENTERED', table_range='A1:B1')
-
-    start_row = 1
-    target_sheet.append_rows(rows_to_add, value_input_option='USER-ENTERED', table_range='A{}'.format(start_row))
-    target_sheet.columns_auto_resize(0, len(rows_to_add[0]))
+    sheets_writer.rewrite_worksheet(spreadsheet, worksheet_title, header_row, rows_to_add)
 
     return True
 
@@ -371,6 +358,7 @@ if __name__ == "__main__":
     return_val = 1
     try:
         return_val = main()
+        ratelimit.flush_deferred()
     except KeyboardInterrupt:
         print("Caught a control-C. Bailing out")
 
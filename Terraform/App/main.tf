@@ -93,10 +93,27 @@ module "lambda_function_existing_package_s3" {
   environment_variables = {
     SQUARESPACE_API_KEY = var.SQUARESPACE_API_KEY
     STRIPE_API_KEY = var.STRIPE_API_KEY
+    RUN_STATE_BUCKET = module.s3-bucket.s3_bucket_id
   }
 
   timeout = 300
 
+  # run state (Bots/Common/runstate.py) lives under runstate/ in the lambda bucket. ListBucket lets a missing
+  # state come back as NoSuchKey rather than AccessDenied
+  attach_policy_statements = true
+  policy_statements = {
+    run_state = {
+      effect    = "Allow",
+      actions   = ["s3:GetObject", "s3:PutObject"],
+      resources = ["${module.s3-bucket.s3_bucket_arn}/runstate/*"]
+    },
+    run_state_list = {
+      effect    = "Allow",
+      actions   = ["s3:ListBucket"],
+      resources = [module.s3-bucket.s3_bucket_arn]
+    }
+  }
+
   allowed_triggers = {
     ScanAmiRule = {
       principal  = "events.amazonaws.com"
@@ -143,7 +160,7 @@ module "lambda_function_schedule_bot" {
   }
 
   layers = [
-    module.lambda_layer_s3.lambda_layer_arn,
+    module.lambda_layer_schedule_bot.lambda_layer_arn,
   ]
 
   tags = {
@@ -157,13 +174,33 @@ module "lambda_layer_s3" {
   create_layer = true
 
   layer_name          = "MembershipBot-layer"
-  description         = "General layer for gspread, google auth, stripe, and python-dateutil"
+  description         = "Layer for MembershipBot: Bots/MembershipBot/requirements.txt and Bots/Common"
+  compatible_runtimes = ["python3.9"]
+  create_package      = false
+
+  s3_existing_package = {
+    bucket = module.s3-bucket.s3_bucket_id
+    key    = "MembershipBotLayer.zip"
+  }
+
+  store_on_s3 = true
+  s3_bucket   = module.s3-bucket.s3_bucket_id
+}
+
+# ScheduleBot gets its own layer without stripe, so its cold starts don't unpack packages it never uses
+module "lambda_layer_schedule_bot" {
+  source = "terraform-aws-modules/lambda/aws"
+
+  create_layer = true
+
+  layer_name          = "ScheduleBot-layer"
+  description         = "Layer for ScheduleBot: Bots/ScheduleBot/requirements.txt and Bots/Common"
   compatible_runtimes = ["python3.9"]
   create_package      = false
 
   s3_existing_package = {
     bucket = module.s3-bucket.s3_bucket_id
-    key    = "LambdaLayer.zip"
+    key    = "ScheduleBotLayer.zip"
   }
 
   store_on_s3 = true
@@ -171,6 +208,9 @@ module "lambda_layer_s3" {
 }
 
 # define eventbridge cron job
+# the full sync runs hourly. OrderBot also hands each order to MembershipBot when its deployment sets
+# MEMBERSHIP_BOT_FUNCTION and allows lambda:InvokeFunction on MembershipBot, but OrderBot isn't deployed from here,
+# so the schedule can't rely on that
 module "eventbridge" {
   source  = "terraform-aws-modules/eventbridge/aws"
   version = "1.13.4"
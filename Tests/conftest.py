@@ -0,0 +1,17 @@
+import os
+import sys
+
+# the bots, the modules they share and the benchmark fakes, imported the same way they're laid out in the Lambda
+# layers and the way Scripts/Benchmarks imports them
+here = os.path.dirname(os.path.abspath(__file__))
+for directory in ('Bots/Common', 'Bots/MembershipBot', 'Bots/ScheduleBot', 'Bots/OrderBot', 'Scripts/Benchmarks'):
+    sys.path.insert(0, os.path.join(here, '..', directory))
+
+# the fake service options Benchmarks.make_services expects, with no latency, errors or quota
+class FakeOptions:
+    seed = 0
+    latency = 0.0
+    error_rate = 0.0
+    sheets_quota = None
+    sheets_per_minute = None
+    memory = False
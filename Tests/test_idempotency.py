@@ -0,0 +1,40 @@
+import idempotency
+import pytest
+
+@pytest.fixture
+def clock(tmp_path, monkeypatch):
+    monkeypatch.setattr(idempotency, 'cached_store', None)
+    monkeypatch.setenv('IDEMPOTENCY_BACKEND', 'sqlite')
+    monkeypatch.setenv('IDEMPOTENCY_PATH', str(tmp_path / 'idempotency.sqlite3'))
+    monkeypatch.setenv('IDEMPOTENCY_TTL', '60')
+
+    now = [1000000.0]
+    monkeypatch.setattr(idempotency.time, 'time', lambda: now[0])
+    yield now
+    idempotency.get_store().close()
+
+payload = {'action': 'scheduled', 'id': '1234', 'calendarID': '1', 'appointmentTypeID': '5'}
+
+def test_entries_expire_after_the_ttl(clock):
+    assert not idempotency.already_handled('scheduled', 1234, payload)
+    idempotency.record_handled('scheduled', 1234, payload)
+    assert idempotency.already_handled('scheduled', 1234, payload)
+
+    clock[0] += 59
+    assert idempotency.already_handled('scheduled', 1234, payload)
+    clock[0] += 1
+    assert not idempotency.already_handled('scheduled', 1234, payload)
+
+def test_entries_are_kept_per_action_id_and_payload(clock):
+    idempotency.record_handled('scheduled', 1234, payload)
+
+    assert not idempotency.already_handled('canceled', 1234, dict(payload, action='canceled'))
+    assert not idempotency.already_handled('scheduled', 1235, dict(payload, id='1235'))
+    assert not idempotency.already_handled('scheduled', 1234, dict(payload, appointmentTypeID='6'))
+
+def test_no_backend_handles_everything(monkeypatch):
+    monkeypatch.setattr(idempotency, 'cached_store', None)
+    monkeypatch.setenv('IDEMPOTENCY_BACKEND', 'none')
+
+    idempotency.record_handled('scheduled', 1234, payload)
+    assert not idempotency.already_handled('scheduled', 1234, payload)
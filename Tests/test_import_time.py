@@ -0,0 +1,44 @@
+import os
+import re
+import subprocess
+import sys
+import pytest
+
+# Lambda pays for a handler module's imports on every cold start. The bots load gspread, oauth2client, requests,
+# dateutil and stripe on first use through lazy.lazy_import, which keeps the handlers' own imports to tens of
+# milliseconds, against around 300 loading them up front
+budget_ms = 100
+
+# clients a handler module must not import until it uses them. the parent packages of the submodules, e.g. dateutil
+# for dateutil.parser, are imported up front to find the submodule, and cost around a millisecond
+lazy_modules = ['gspread', 'requests', 'stripe', 'oauth2client.service_account', 'dateutil.parser']
+
+here = os.path.dirname(os.path.abspath(__file__))
+path = os.pathsep.join(os.path.join(here, '..', 'Bots', directory) for directory in ('Common', 'MembershipBot', 'ScheduleBot', 'OrderBot'))
+
+# import a module in a fresh interpreter under python -X importtime
+# returns (cumulative microseconds for the module, names of every module imported along with it)
+def import_time(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], capture_output=True, text=True,
+                            env=dict(os.environ, PYTHONPATH=path), check=True)
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)$', line)
+        if match:
+            imported[match.group(3)] = int(match.group(1))
+
+    return imported[module], set(imported)
+
+@pytest.mark.parametrize('module', ['MembershipBot', 'ScheduleBot', 'orderbot'])
+def test_handler_imports_within_budget(module):
+    # best of a few runs, so a busy machine doesn't fail the check
+    microseconds = min(import_time(module)[0] for _ in range(3))
+
+    assert microseconds / 1000 < budget_ms
+
+@pytest.mark.parametrize('module', ['MembershipBot', 'ScheduleBot'])
+def test_handler_leaves_clients_to_first_use(module):
+    (_, imported) = import_time(module)
+
+    assert imported.isdisjoint(lazy_modules)
@@ -0,0 +1,57 @@
+import fakeservices
+import loadorders
+import orderbot
+
+# stands in for a psycopg2 connection, recording what load_batch sends
+class FakeCursor:
+
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, statement, params=None):
+        self.statements.append((str(statement), params))
+
+    def copy_expert(self, statement, buffer):
+        self.statements.append(('COPY', buffer.read().count('\n')))
+
+    def close(self):
+        pass
+
+class FakeConnection:
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+def test_load_batch_checks_each_year_once_and_loads_repeated_orders_once(monkeypatch):
+    monkeypatch.setattr(orderbot, 'partition_years', set())
+    monkeypatch.setattr(orderbot, 'upsert_members', lambda cursor, orders: None)
+    monkeypatch.setattr(orderbot, 'upsert_order_rollups', lambda cursor, orders: None)
+
+    # half the orders from the year before, the way a backfill range spans years
+    orders = fakeservices.make_orders(1000, 2024)
+    for order in orders[:500]:
+        order['createdOn'] = '2023' + order['createdOn'][4:]
+    # the same orders again, as if they were modified while the range was being paged through
+    repeated = orders + orders[:50]
+    conn = FakeConnection()
+
+    loaded = loadorders.load_batch(conn, repeated)
+
+    partitions = [params for statement, params in conn.statements if 'create_syc_orders_partition' in statement]
+    assert sorted(partitions) == [(2023,), (2024,)]
+
+    line_items = sum(len(order['lineItems']) for order in orders)
+    assert loaded == line_items
+    assert ('COPY', line_items) in conn.statements
+    assert conn.commits == 1
+    assert orderbot.partition_years == {2023, 2024}
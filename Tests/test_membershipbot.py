@@ -0,0 +1,234 @@
+import copy
+import Benchmarks
+import fakeservices
+import MembershipBot
+import sheets_writer
+from conftest import FakeOptions
+
+# a mooring services order on its own, for email, made from one of the generated orders
+def services_order(orders, email, order_number, fulfillment='PENDING'):
+    template = next(order for order in orders if [item['productName'] for item in order['lineItems']] == ['Mooring Services'])
+    order = copy.deepcopy(template)
+    order.update({'orderNumber': order_number, 'customerEmail': email, 'fulfillmentStatus': fulfillment})
+    return order
+
+def test_services_order_marks_existing_moorings_with_the_same_email():
+    services = Benchmarks.make_services('sync_squarespace', 300, FakeOptions)
+
+    with Benchmarks.fake_environment(services, None):
+        assert MembershipBot.sync_squarespace(Benchmarks.year) == 0
+        MembershipBot.write_planned()
+
+        moorings = services.google.find("SYC Waterfront - Year %s" % Benchmarks.year).worksheet('Moorings')
+        before = fakeservices.trim_values(moorings.values)
+        row = next(row for row in before[1:] if row[9] == 'No')
+
+        # canceled services don't count
+        assert MembershipBot.sync_order(services_order(services.squarespace.orders, row[2], '90001', 'CANCELED')) == 0
+        assert fakeservices.trim_values(moorings.values) == before
+
+        # Squarespace keeps the email however it was typed
+        assert MembershipBot.sync_order(services_order(services.squarespace.orders, ' %s ' % row[2].upper(), '90002')) == 0
+        after = fakeservices.trim_values(moorings.values)
+
+    changed = [index for index in range(len(before)) if before[index] != after[index]]
+    assert changed and all(MembershipBot.email_key(before[index][2]) == MembershipBot.email_key(row[2]) for index in changed)
+    assert all(after[index][9] == 'Yes' and after[index][:9] == before[index][:9] for index in changed)
+    assert len(after) == len(before)
+
+# what format_moorings should say for each mooring, worked out the slow way: a mooring has services if its own order
+# bought them, or any order bought them on their own under the same email, ignoring case and spacing, unless that
+# order was canceled
+def expected_services(parsed_orders):
+    expected = {}
+    for mooring in parsed_orders:
+        if mooring['mooring_location'] == '':
+            continue
+
+        has_services = mooring['mooring_svcs'] == 'Yes' or any(
+            order['mooring_location'] == '' and order['mooring_svcs'] == 'Yes' and order['fulfillment'] != 'CANCELED'
+            and order['email'].strip().lower() == mooring['email'].strip().lower()
+            for order in parsed_orders)
+        expected[mooring['order_no']] = 'Yes' if has_services else 'No'
+    return expected
+
+def test_format_moorings_joins_services_on_email_over_a_season():
+    orders = fakeservices.make_orders(3000, Benchmarks.year)
+    # some of the season's orders canceled, services-only ones among them
+    for order in orders[::7]:
+        order['fulfillmentStatus'] = 'CANCELED'
+
+    moorings = [order for order in orders if any(item['productName'] in MembershipBot.filter_type_moorings for item in order['lineItems'])]
+    services_only = [order for order in orders if [item['productName'] for item in order['lineItems']] == ['Mooring Services']]
+
+    # one person with several moorings, services on one order of their own typed with different case and spacing
+    several = moorings[0]['customerEmail']
+    for order in moorings[1:4]:
+        order['customerEmail'] = several.upper()
+    services_only[0]['customerEmail'] = '  %s ' % several.capitalize()
+    services_only[0]['fulfillmentStatus'] = 'PENDING'
+
+    # and someone whose only services order was canceled
+    canceled = moorings[10]['customerEmail']
+    moorings[10]['lineItems'] = [item for item in moorings[10]['lineItems'] if item['productName'] != 'Mooring Services']
+    for order in services_only:
+        if order['customerEmail'].strip().lower() == canceled.strip().lower():
+            order['customerEmail'] = 'someone.else@example.com'
+    services_only[1]['customerEmail'] = canceled
+    services_only[1]['fulfillmentStatus'] = 'CANCELED'
+
+    parsed = MembershipBot.parse_squarespace_orders(orders, MembershipBot.filter_type_moorings_all)
+    rows = MembershipBot.format_moorings(parsed)
+    services = {row[0]: row[9] for row in rows}
+
+    assert services == expected_services(parsed)
+    assert [services[order['orderNumber']] for order in [moorings[0]] + moorings[1:4]] == ['Yes'] * 4
+    assert services[moorings[10]['orderNumber']] == 'No'
+    assert 'Yes' in services.values() and 'No' in services.values()
+
+# a Squarespace payment the way parse_squarespace_transactions leaves it
+def squarespace_payment(charge_id, order_id, total, fees, voided='No', provider='STRIPE'):
+    return {'payments_externalid': charge_id, 'voided': voided, 'payments_provider': provider, 'order_id': order_id,
+            'email': 'member%s@example.com' % order_id, 'payments_paidon': '2024-05-01', 'total': total, 'payments_processing_fees': fees}
+
+# a Stripe balance transaction the way parse_stripe_transactions leaves it
+def stripe_charge(charge_id, total, fees, tx_type='charge'):
+    return {'type': tx_type, 'payments_externalid': charge_id, 'total': total, 'payments_processing_fees': fees,
+            'email': ' stripe@example.com ', 'payments_paidon': '2024-05-01', 'order_id': 'pi_%s' % charge_id}
+
+def test_reconcile_payments_sorts_every_payment_into_a_status():
+    squarespace = [
+        squarespace_payment('ch_match', 1, 100.0, 3.2),
+        squarespace_payment('ch_amount', 2, 100.0, 3.2),
+        squarespace_payment('ch_fee', 3, 50.0, 1.75),
+        squarespace_payment('ch_missing', 4, 25.0, 1.03),
+        # two payments that share one charge id, each matched to a Stripe charge of its own
+        squarespace_payment('ch_shared', 5, 40.0, 1.46),
+        squarespace_payment('ch_shared', 6, 60.0, 2.04),
+        # none of these are looked for in Stripe
+        squarespace_payment('ch_voided', 7, 30.0, 1.17, voided='Yes'),
+        squarespace_payment('pp_paypal', 8, 30.0, 1.17, provider='PAYPAL'),
+        squarespace_payment('', 9, 30.0, 1.17),
+    ]
+    stripe = [
+        stripe_charge('ch_match', 100.0, 3.2),
+        stripe_charge('ch_amount', 90.0, 3.2),
+        stripe_charge('ch_fee', 50.0, 1.45),
+        stripe_charge('ch_shared', 40.0, 1.46),
+        stripe_charge('ch_shared', 60.0, 2.04),
+        stripe_charge('ch_stripe', 75.0, 2.48),
+        # only charges are matched against
+        stripe_charge('ch_voided', 30.0, 1.17),
+        stripe_charge('po_payout', -500.0, 0.0, tx_type='payout'),
+    ]
+
+    (rows, report) = MembershipBot.reconcile_payments(squarespace, stripe)
+
+    statuses = [(row[0], row[1], row[2]) for row in rows]
+    assert statuses == [
+        ('ch_fee', 'Fee discrepancy', 3),
+        ('ch_amount', 'Amount discrepancy', 2),
+        ('ch_missing', 'Squarespace only', 4),
+        ('ch_stripe', 'Stripe only', ''),
+        ('ch_voided', 'Stripe only', ''),
+        ('ch_match', 'Matched', 1),
+        ('ch_shared', 'Matched', 5),
+        ('ch_shared', 'Matched', 6),
+    ]
+
+    rows_by_charge = {(row[0], row[2]): row for row in rows}
+    assert rows_by_charge[('ch_fee', 3)][5:] == [50.0, 50.0, 1.75, 1.45, 0.3, 'pi_ch_fee']
+    assert rows_by_charge[('ch_amount', 2)][5:7] == [100.0, 90.0]
+    assert rows_by_charge[('ch_missing', 4)][5:] == [25.0, '', 1.03, '', '', '']
+    assert rows_by_charge[('ch_stripe', '')][3:] == ['stripe@example.com', '2024-05-01', '', 75.0, '', 2.48, '', 'pi_ch_stripe']
+    assert rows_by_charge[('ch_shared', 6)][6] == 60.0
+
+    assert report == {
+        'Fee discrepancy': {'count': 1, 'squarespace_total': 50.0, 'stripe_total': 50.0, 'fee_difference': 0.3},
+        'Amount discrepancy': {'count': 1, 'squarespace_total': 100.0, 'stripe_total': 90.0, 'fee_difference': 0.0},
+        'Squarespace only': {'count': 1, 'squarespace_total': 25.0, 'stripe_total': 0, 'fee_difference': 0},
+        'Stripe only': {'count': 2, 'squarespace_total': 0, 'stripe_total': 105.0, 'fee_difference': 0},
+        'Matched': {'count': 3, 'squarespace_total': 200.0, 'stripe_total': 200.0, 'fee_difference': 0.0},
+    }
+
+def summary_order(order_id, product_name, amount):
+    return {'id': order_id, 'lineItems': [{'productName': product_name, 'unitPricePaid': {'value': str(amount)}, 'quantity': 1}]}
+
+def summary_payment(order_id, month, total, fees, voided='No'):
+    return {'order_id': order_id, 'month': month, 'total': total, 'payments_processing_fees': fees, 'total_netpayment': total - fees,
+            'discounts': 0.0, 'voided': voided}
+
+def stripe_summary(month, category, total, fees):
+    return {'month': month, 'category': category, 'total': total, 'payments_processing_fees': fees, 'total_netpayment': total - fees}
+
+# run sync_summary on payments, returning the summary rows it planned to write and the months it added up
+def run_summary(monkeypatch, payments):
+    months = []
+    summary_records = MembershipBot.summary_records
+    monkeypatch.setattr(MembershipBot, 'summary_records', lambda month, items: (months.append(month), summary_records(month, items))[1])
+    monkeypatch.setattr(MembershipBot, 'parsed_payments', payments)
+    monkeypatch.setattr(MembershipBot, 'write_plan', sheets_writer.WritePlan())
+
+    assert MembershipBot.sync_summary(Benchmarks.year) == 0
+
+    (worksheet,) = MembershipBot.write_plan.spreadsheets['SYC Transactions']['worksheets']
+    return (worksheet['rows'], sorted(months))
+
+def test_sync_summary_adds_up_only_the_changed_months(monkeypatch):
+    monkeypatch.setattr(MembershipBot, 'run_state', {})
+    payments = {
+        'orders': [summary_order('o1', 'Family Membership', 100.0), summary_order('o2', 'Moorings', 300.0)],
+        'squarespace': [
+            summary_payment('o1', '2024-01', 100.0, 3.2),
+            summary_payment('o2', '2024-02', 300.0, 9.0),
+            summary_payment('o3', '2024-02', 40.0, 1.46, voided='Yes'),
+        ],
+        'stripe': [
+            stripe_summary('2024-01', 'charge', 100.0, 3.2),
+            stripe_summary('2024-02', 'charge', 300.0, 9.0),
+            # payouts only move money to the bank
+            stripe_summary('2024-02', 'payout', -390.0, 0.0),
+        ],
+    }
+
+    (rows, months) = run_summary(monkeypatch, copy.deepcopy(payments))
+    assert months == ['2024-01', '2024-02']
+    assert rows == [
+        ['Squarespace', 'Month', '2024-01', 1, 100.0, 3.2, 96.8, 0.0],
+        ['Squarespace', 'Month', '2024-02', 1, 300.0, 9.0, 291.0, 0.0],
+        ['Squarespace', 'Product', 'Family Membership', 1, 100.0, 0.0, 100.0, 0.0],
+        ['Squarespace', 'Product', 'Moorings', 1, 300.0, 0.0, 300.0, 0.0],
+        ['Stripe', 'Category', 'charge', 2, 400.0, 12.2, 387.8, 0.0],
+        ['Stripe', 'Category', 'payout', 1, -390.0, 0.0, -390.0, 0.0],
+        ['Stripe', 'Month', '2024-01', 1, 100.0, 3.2, 96.8, 0.0],
+        ['Stripe', 'Month', '2024-02', 1, 300.0, 9.0, 291.0, 0.0],
+    ]
+
+    # a new February payment only adds February up again, January comes from the run state
+    payments['orders'].append(summary_order('o4', 'Moorings', 150.0))
+    payments['squarespace'].append(summary_payment('o4', '2024-02', 150.0, 4.65))
+    (rows, months) = run_summary(monkeypatch, copy.deepcopy(payments))
+    assert months == ['2024-02']
+    assert ['Squarespace', 'Month', '2024-02', 2, 450.0, 13.65, 436.35, 0.0] in rows
+    assert ['Squarespace', 'Month', '2024-01', 1, 100.0, 3.2, 96.8, 0.0] in rows
+    assert ['Squarespace', 'Product', 'Moorings', 2, 450.0, 0.0, 450.0, 0.0] in rows
+
+    # nothing changed, so nothing is added up and the worksheet isn't planned again
+    monkeypatch.setattr(MembershipBot, 'parsed_payments', copy.deepcopy(payments))
+    monkeypatch.setattr(MembershipBot, 'write_plan', sheets_writer.WritePlan())
+    MembershipBot.run_state['fingerprints'] = {'SYC Transactions/Summary %s' % Benchmarks.year: {
+        'fingerprint': MembershipBot.runstate.fingerprint(MembershipBot.spreadsheet_header_summary, rows), 'written': MembershipBot.time.time()}}
+    assert MembershipBot.sync_summary(Benchmarks.year) == 0
+    assert MembershipBot.write_plan.spreadsheets == {}
+
+def test_upsert_rows_updates_worksheets_with_an_apostrophe_in_the_title():
+    services = Benchmarks.make_services('sync_squarespace', 100, FakeOptions)
+    header = ['Order No', 'Name']
+
+    with Benchmarks.fake_environment(services, None):
+        spreadsheet = MembershipBot.get_spreadsheet("SYC Orders")
+        assert MembershipBot.upsert_rows(spreadsheet, "O'Neil Orders", header, [['1001', 'Jane Doe'], ['1002', 'John Doe']]) == (0, 2)
+        assert MembershipBot.upsert_rows(spreadsheet, "O'Neil Orders", header, [['1002', 'John Smith'], ['1003', 'Jim Doe']]) == (1, 1)
+
+    worksheet = services.google.find("SYC Orders").worksheet("O'Neil Orders")
+    assert fakeservices.trim_values(worksheet.values) == [header, ['1001', 'Jane Doe'], ['1002', 'John Smith'], ['1003', 'Jim Doe']]
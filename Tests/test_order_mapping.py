@@ -0,0 +1,54 @@
+import json
+import Benchmarks
+import fakeservices
+import order_mapping
+
+def test_order_mapping_matches_the_per_field_mapping():
+    orders = fakeservices.make_orders(500, Benchmarks.year)
+    # an order without variantOptions on its line items and one with them null, which map to NULL and 'null'
+    del orders[0]['lineItems'][0]['variantOptions']
+    orders[1]['lineItems'][0]['variantOptions'] = None
+
+    expected = [row for order in orders for row in Benchmarks.per_field_order_rows(order)]
+
+    assert order_mapping.orders_rows(orders) == expected
+    assert [row for order in orders for row in order_mapping.order_rows(order)] == expected
+
+def test_rows_line_up_with_column_map():
+    # every plain field holds the name of the column it should land in
+    money = lambda column: {'value': column, 'currency': 'USD'}
+    order = {
+        'orderNumber': 'order_number', 'createdOn': 'created_on', 'modifiedOn': 'modified_on', 'channel': 'channel',
+        'testmode': 'testmode', 'customerEmail': 'customer_email', 'fulfillmentStatus': 'fulfillment_status',
+        'billingAddress': {
+            'firstName': 'billing_first_name', 'lastName': 'billing_last_name', 'address1': 'billing_address1',
+            'address2': 'billing_address2', 'city': 'billing_city', 'state': 'billing_state',
+            'countryCode': 'billing_country_code', 'postalCode': 'billing_postal_code', 'phone': 'billing_phone',
+        },
+        'subtotal': money('subtotal'), 'shippingTotal': money('shipping_total'), 'discountTotal': money('discount_total'),
+        'taxTotal': money('tax_total'), 'refundedTotal': money('refunded_total'), 'grandTotal': money('grand_total'),
+        'channelName': 'channel_name', 'externalOrderReference': 'external_order_reference', 'fulfilledOn': 'fulfilled_on',
+        'priceTaxInterpretation': 'price_tax_interpretation',
+        'lineItems': [{
+            'id': 'line_item_id', 'variantId': 'variant_id', 'sku': 'sku', 'productId': 'product_id',
+            'productName': '2024 Family Membership', 'quantity': 'quantity', 'unitPricePaid': money('unit_price_paid'),
+            'imageUrl': 'image_url', 'lineItemType': 'line_item_type',
+            'variantOptions': [{'optionName': 'Size', 'value': 'Family'}],
+            'customizations': [{'label': 'Name', 'value': 'Jane Doe'}],
+        }],
+    }
+
+    (row,) = order_mapping.order_rows(order)
+    assert len(row) == len(order_mapping.column_map)
+    mapped = dict(zip(order_mapping.column_map, row))
+
+    transformed = {
+        'id': 'line_item_id',
+        'product_name': '2024 Family Membership',
+        'variant_options': json.dumps([{'optionName': 'Size', 'value': 'Family'}]),
+        'customizations': json.dumps([{'label': 'Name', 'value': 'Jane Doe'}]),
+        'custom_fields': json.dumps({'Name': 'Jane Doe'}),
+        'variant_fields': json.dumps({'Size': 'Family'}),
+        'product_category': 'membership',
+    }
+    assert mapped == {column: transformed.get(column, column) for column in order_mapping.column_map}
@@ -0,0 +1,63 @@
+import json
+import rollups
+
+measures = ['Total', 'Fees']
+
+# records for a month of (category, total, fees) items, with the months they were made for in calls
+def make_records(calls):
+    def records(month, items):
+        calls.append(month)
+        for (category, total, fees) in items:
+            yield ((('Month', month), ('Category', category)), (total, fees))
+    return records
+
+partitions = {
+    '2024-01': [['dues', 100.0, 3.2], ['lessons', 50.0, 1.75]],
+    '2024-02': [['dues', 200.0, 6.1], ['dues', '', None]],
+}
+
+def test_state_round_trips_through_json():
+    rollup = rollups.Rollup(measures)
+    rollup.update(partitions, make_records([]))
+
+    state = json.loads(json.dumps(rollup.to_state()))
+    restored = rollups.Rollup.from_state(state, measures)
+
+    assert restored.rows() == rollup.rows() == [
+        ['Category', 'dues', 3, 300.0, 9.3],
+        ['Category', 'lessons', 1, 50.0, 1.75],
+        ['Month', '2024-01', 2, 150.0, 4.95],
+        ['Month', '2024-02', 2, 200.0, 6.1],
+    ]
+    assert restored.to_state() == state
+
+def test_only_changed_partitions_are_added_up_again():
+    calls = []
+    rollup = rollups.Rollup.from_state(None, measures)
+    assert rollup.update(partitions, make_records(calls)) == (2, 0)
+    assert sorted(calls) == ['2024-01', '2024-02']
+
+    rollup = rollups.Rollup.from_state(json.loads(json.dumps(rollup.to_state())), measures)
+    changed = dict(partitions, **{'2024-02': partitions['2024-02'] + [['lessons', 25.0, 1.03]]})
+    del calls[:]
+    assert rollup.update(changed, make_records(calls)) == (1, 0)
+    assert calls == ['2024-02']
+    assert ['Month', '2024-02', 3, 225.0, 7.13] in rollup.rows()
+
+    # a month that's no longer there is dropped, without adding anything up
+    del calls[:]
+    assert rollup.update({'2024-02': changed['2024-02']}, make_records(calls)) == (0, 1)
+    assert calls == []
+    assert [row[:2] for row in rollup.rows()] == [['Category', 'dues'], ['Category', 'lessons'], ['Month', '2024-02']]
+
+def test_state_for_other_measures_starts_over():
+    rollup = rollups.Rollup(measures)
+    rollup.update(partitions, make_records([]))
+
+    restored = rollups.Rollup.from_state(rollup.to_state(), measures + ['Net'])
+    assert restored.partitions == {}
+    assert restored.rows() == []
+
+    calls = []
+    assert restored.update(partitions, make_records(calls)) == (2, 0)
+    assert restored.rows()[0] == ['Category', 'dues', 3, 300.0, 9.3, 0.0]
@@ -0,0 +1,232 @@
+import copy
+import json
+import pytest
+import Benchmarks
+import fakeservices
+import ScheduleBot
+import storage
+from conftest import FakeOptions
+
+def test_row_matches_what_sheets_reads_back():
+    wanted = [1234, 'Jane Doe', 'jane@example.com', '5085551234', 'May 1, 2024', '10:00am', '11:00am', 'Laser', 'Member', '']
+    read_back = [1234, 'Jane Doe', 'jane@example.com', 5085551234, '5/1/2024', '10:00 AM', '11:00 AM', 'Laser', 'Member']
+
+    assert ScheduleBot.row_matches(read_back, wanted)
+    assert not ScheduleBot.row_matches(read_back[:5] + ['10:30 AM'] + read_back[6:], wanted)
+    assert not ScheduleBot.row_matches(read_back[:8] + ['Non-Member'], wanted)
+    assert not ScheduleBot.row_matches(read_back[:8], wanted)
+
+def test_reconcile_leaves_rows_sheets_reformatted_alone():
+    services = Benchmarks.make_services('reconcile', 200, FakeOptions)
+
+    with Benchmarks.fake_environment(services, None):
+        assert ScheduleBot.main({'job': 'reconcile', 'year': Benchmarks.year}, None) == 0
+
+        # Sheets shows the times it parsed out of 10:00am as 10:00 AM
+        reservations = services.google.find("SYC Waterfront - Year %s" % Benchmarks.year).worksheet('Reservations')
+        for row in reservations.values[1:]:
+            row[5:7] = [value.upper().replace('AM', ' AM').replace('PM', ' PM') for value in row[5:7]]
+
+        services.reset_counts()
+        assert ScheduleBot.main({'job': 'reconcile', 'year': Benchmarks.year}, None) == 0
+
+    assert services.calls['sheets.values.batchUpdate'] == 0
+    assert services.calls['sheets.batchUpdate'] == 0
+
+# a scheduled webhook for an appointment, as Acuity sends it
+def scheduled_event(appointment):
+    return {'isBase64Encoded': False, 'body': 'action=scheduled&id=%s&calendarID=1&appointmentTypeID=%s' % (appointment['id'], appointment['appointmentTypeID'])}
+
+def test_repeated_lesson_webhooks_keep_the_same_calls_and_row_width():
+    services = Benchmarks.make_services('event:scheduled', 400, FakeOptions)
+    lessons = [appointment for appointment in services.acuity.appointments.values() if appointment['forms']][:200]
+    calls = []
+
+    with Benchmarks.fake_environment(services, None):
+        for appointment in lessons:
+            services.reset_counts()
+            assert ScheduleBot.main(scheduled_event(appointment), None) == 0
+            calls.append(dict(services.calls))
+
+        spreadsheet = services.google.find("SYC Sailing Lessons and Races - %s" % Benchmarks.year)
+        type_ids = set(appointment['appointmentTypeID'] for appointment in lessons)
+        assert len(ScheduleBot.appointment_schemas) == len(type_ids)
+
+    # once the worksheets exist every webhook costs the same: one Acuity read and the same Sheets calls
+    assert all(call == calls[-1] for call in calls[len(calls) // 2:])
+    assert calls[-1]['acuity.appointment'] == 1
+
+    # and no row is wider than its worksheet's header
+    for worksheet in spreadsheet.worksheets[1:]:
+        rows = fakeservices.trim_values(worksheet.values[:worksheet.used_rows()])
+        assert max(len(row) for row in rows) == len(rows[0])
+
+def test_schema_is_built_again_when_form_questions_change():
+    services = Benchmarks.make_services('event:scheduled', 100, FakeOptions)
+    lesson = next(appointment for appointment in services.acuity.appointments.values() if appointment['forms'])
+
+    with Benchmarks.fake_environment(services, None):
+        (header, field_ids) = ScheduleBot.get_appointment_schema(lesson)
+        assert ScheduleBot.get_appointment_schema(lesson) == (header, field_ids)
+
+        changed = dict(lesson, forms=[dict(form, values=form['values'] + [{'id': 1, 'fieldID': 99, 'name': 'Life Jacket Size', 'value': 'M'}])
+                                      for form in lesson['forms']])
+        (changed_header, changed_field_ids) = ScheduleBot.get_appointment_schema(changed)
+
+    assert changed_header == header + ('Life Jacket Size',)
+    assert changed_field_ids == field_ids + (99,)
+    assert ScheduleBot.format_lesson_race(changed)[1][-1] == 'M'
+
+# the worksheet of a spreadsheet holding an appointment's row
+def worksheet_with(spreadsheet, appointment_id):
+    return next(worksheet for worksheet in spreadsheet.worksheets if any(row and row[0] == str(appointment_id) for row in worksheet.values))
+
+# add a row under the header the way someone editing the spreadsheet would, without Drive's version moving on yet,
+# so the cached column A read still has the old row numbers
+def insert_row_behind_the_cache(worksheet, row):
+    worksheet.values.insert(1, row)
+    worksheet.row_count += 1
+
+def test_cancel_removes_the_appointment_even_when_cached_rows_are_stale():
+    services = Benchmarks.make_services('event:canceled', 200, FakeOptions)
+    appointment = Benchmarks.event_appointment(services, 'canceled', wants_forms=True)
+    titles = ["SYC Sailing Lessons and Races - %s" % Benchmarks.year]
+
+    with Benchmarks.fake_environment(services, None):
+        client = ScheduleBot.auth_google('googleCreds.json')
+        ScheduleBot.find_orders_by_ids(client, [appointment['id']], titles)
+
+        worksheet = worksheet_with(services.google.find(titles[0]), appointment['id'])
+        insert_row_behind_the_cache(worksheet, ['99999', 'Added By Hand'])
+        before = [row[0] for row in fakeservices.trim_values(worksheet.values)]
+
+        event = {'isBase64Encoded': False, 'body': 'action=canceled&id=%s&calendarID=1&appointmentTypeID=%s' % (appointment['id'], appointment['appointmentTypeID'])}
+        assert ScheduleBot.main(event, None) == 0
+        after = [row[0] for row in fakeservices.trim_values(worksheet.values)]
+
+    assert after == [order_id for order_id in before if order_id != str(appointment['id'])]
+
+def test_reschedule_updates_the_appointment_even_when_cached_rows_are_stale():
+    services = Benchmarks.make_services('event:rescheduled', 200, FakeOptions)
+    appointment = Benchmarks.event_appointment(services, 'rescheduled', wants_forms=False)
+    titles = ["SYC Waterfront - Year %s" % Benchmarks.year]
+
+    with Benchmarks.fake_environment(services, None):
+        client = ScheduleBot.auth_google('googleCreds.json')
+        ScheduleBot.find_orders_by_ids(client, [appointment['id']], titles)
+
+        worksheet = worksheet_with(services.google.find(titles[0]), appointment['id'])
+        insert_row_behind_the_cache(worksheet, ['99999', 'Added By Hand'])
+        before = fakeservices.trim_values(worksheet.values)
+
+        services.acuity.appointments[str(appointment['id'])]['lastName'] = 'Rescheduled'
+        event = {'isBase64Encoded': False, 'body': 'action=rescheduled&id=%s&calendarID=1&appointmentTypeID=%s' % (appointment['id'], appointment['appointmentTypeID'])}
+        assert ScheduleBot.main(event, None) == 0
+        after = fakeservices.trim_values(worksheet.values)
+
+    # every appointment is still in its own row, and only the rescheduled one changed
+    assert [row[0] for row in after] == [row[0] for row in before]
+    changed = [index for index in range(len(before)) if before[index] != after[index]]
+    assert [after[index][0] for index in changed] == [str(appointment['id'])]
+    assert after[changed[0]][1].endswith('Rescheduled')
+
+def test_lessons_are_kept_in_storage_without_the_sheets_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'cached_store', None)
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('STORAGE_PATH', str(tmp_path / 'syc.sqlite3'))
+    monkeypatch.setenv('SHEETS_EXPORT', 'false')
+
+    lesson = copy.deepcopy([appointment for appointment in fakeservices.make_appointments(20, Benchmarks.year) if appointment['forms']][0])
+    store = storage.get_store()
+
+    # no client, so any spreadsheet call would fail
+    try:
+        assert ScheduleBot.add_lesson_race(None, lesson) == 0
+        record = store.find('lessons', Benchmarks.year, lesson['id'])
+        assert record[0] == str(lesson['id'])
+        assert json.loads(record[-1]) == {question['name']: question['value'] for question in lesson['forms'][0]['values']}
+
+        lesson['forms'][0]['values'][0]['value'] = 'Someone Else'
+        assert ScheduleBot.update_appointment(None, lesson) == 0
+        assert json.loads(store.find('lessons', Benchmarks.year, lesson['id'])[-1])['Sailor Name'] == 'Someone Else'
+
+        # the order and its cancellation each get a ledger row, as they do in All Transactions
+        assert ScheduleBot.add_lesson_transaction(None, lesson, 'order.completed') == 0
+        assert ScheduleBot.add_lesson_transaction(None, lesson, 'canceled') == 0
+        assert sorted(row[-1] for row in store.rows('lesson_transactions', Benchmarks.year)) == ['canceled', 'order.completed']
+
+        assert ScheduleBot.remove_appointments(None, [lesson['id']], Benchmarks.year) == 0
+        assert store.find('lessons', Benchmarks.year, lesson['id']) is None
+        assert len(store.rows('lesson_transactions', Benchmarks.year)) == 2
+    finally:
+        store.close()
+
+def fail_if_called(*args, **kwargs):
+    raise AssertionError("called for a webhook that was already handled")
+
+def test_redelivered_webhooks_are_skipped_before_any_request(monkeypatch):
+    services = Benchmarks.make_services('event:scheduled', 100, FakeOptions)
+    appointment = Benchmarks.event_appointment(services, 'scheduled', False)
+    event = scheduled_event(appointment)
+
+    with Benchmarks.fake_environment(services, None):
+        assert ScheduleBot.main(event, None) == 0
+        assert services.calls['acuity.appointment'] == 1
+
+        with monkeypatch.context() as patched:
+            patched.setattr(ScheduleBot, 'auth_google', fail_if_called)
+            patched.setattr(ScheduleBot, 'get_appointment_by_id', fail_if_called)
+            assert ScheduleBot.main(event, None) == 0
+
+            # the same id with a different payload isn't the same webhook
+            changed = scheduled_event(dict(appointment, appointmentTypeID=appointment['appointmentTypeID'] + 1))
+            with pytest.raises(AssertionError):
+                ScheduleBot.main(changed, None)
+
+        # and once the entry is past the TTL the webhook is handled again
+        handled_at = ScheduleBot.idempotency.time.time()
+        monkeypatch.setattr(ScheduleBot.idempotency.time, 'time', lambda: handled_at + ScheduleBot.idempotency.ttl_seconds() + 1)
+        services.reset_counts()
+        assert ScheduleBot.main(event, None) == 0
+        assert services.calls['acuity.appointment'] == 1
+
+def test_failed_webhooks_are_not_recorded(monkeypatch):
+    services = Benchmarks.make_services('event:scheduled', 100, FakeOptions)
+    appointment = Benchmarks.event_appointment(services, 'scheduled', False)
+    event = scheduled_event(appointment)
+    assert not appointment['forms']
+
+    with Benchmarks.fake_environment(services, None):
+        with monkeypatch.context() as patched:
+            patched.setattr(ScheduleBot, 'add_reservation', lambda client, appointment: 1)
+            patched.setattr(ScheduleBot, 'add_lesson_race', lambda client, appointment: 1)
+            assert ScheduleBot.main(event, None) == 0
+
+        # so Acuity delivering it again goes through
+        services.reset_counts()
+        assert ScheduleBot.main(event, None) == 0
+        assert services.calls['acuity.appointment'] == 1
+        assert str(appointment['id']) in [row[0] for row in services.google.find("SYC Waterfront - Year %s" % Benchmarks.year).worksheet('Reservations').values]
+
+def test_reconcile_reads_worksheets_with_an_apostrophe_in_the_title():
+    services = Benchmarks.make_services('reconcile', 200, FakeOptions)
+
+    with Benchmarks.fake_environment(services, None):
+        assert ScheduleBot.main({'job': 'reconcile', 'year': Benchmarks.year}, None) == 0
+
+        # a worksheet someone added by hand next to the ones the bot writes
+        spreadsheet = services.google.find("SYC Sailing Lessons and Races - %s" % Benchmarks.year)
+        notes = fakeservices.Worksheet(99, "Coach's Notes", len(spreadsheet.worksheets))
+        notes.write(0, 0, [['Notes']])
+        spreadsheet.worksheets.append(notes)
+
+        lessons = spreadsheet.worksheets[1]
+        lessons.values[1][1] = 'Someone Else'
+        services.google.touch(spreadsheet)
+
+        services.reset_counts()
+        assert ScheduleBot.main({'job': 'reconcile', 'year': Benchmarks.year}, None) == 0
+
+    assert services.calls['sheets.values.batchUpdate'] == 1
+    assert lessons.values[1][1] != 'Someone Else'
+    assert notes.values == [['Notes']]
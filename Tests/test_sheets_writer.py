@@ -0,0 +1,90 @@
+import Benchmarks
+import MembershipBot
+import pytest
+import sheets_writer
+import threading
+from conftest import FakeOptions
+
+def test_full_sync_takes_four_sheets_requests_per_spreadsheet():
+    services = Benchmarks.make_services('sync_squarespace', 300, FakeOptions)
+
+    with Benchmarks.fake_environment(services, None):
+        assert MembershipBot.sync_squarespace(Benchmarks.year) == 0
+        assert MembershipBot.write_planned() == 0
+
+    # orders, waterfront and transactions: opening each reads its metadata once, then the grid, values and auto-resize
+    assert services.calls['sheets.get'] == 3
+    assert services.service_calls('sheets') == 12
+
+def test_metadata_kept_from_opening_is_dropped_once_the_spreadsheet_changes():
+    services = Benchmarks.make_services('sync_squarespace', 100, FakeOptions)
+
+    with Benchmarks.fake_environment(services, None):
+        spreadsheet = MembershipBot.get_spreadsheet("SYC Orders")
+        assert spreadsheet.id in sheets_writer.opened_metadata
+
+        spreadsheet.add_worksheet(title='Added', rows=1, cols=1)
+        assert spreadsheet.id not in sheets_writer.opened_metadata
+
+        # so the write reads the metadata again and finds the new worksheet rather than adding it twice
+        services.reset_counts()
+        sheets_writer.rewrite_worksheet(spreadsheet, 'Added', ['Order No'], [['1001']])
+        assert services.calls['sheets.get'] == 1
+        assert [worksheet.title for worksheet in spreadsheet.worksheets()].count('Added') == 1
+
+# each of these rows is 8 bytes in a request: ["m01"] and a comma, so 27 bytes fit three
+def numbered_rows(prefix, count):
+    return [['%s%02d' % (prefix, number)] for number in range(1, count + 1)]
+
+def test_value_requests_split_at_row_boundaries_with_the_right_start_rows():
+    data = [
+        {'title': 'Members', 'values': numbered_rows('m', 5)},
+        {'title': "O'Neil", 'values': numbered_rows('o', 4)},
+    ]
+
+    requests = sheets_writer.value_requests(data, max_bytes=27)
+
+    assert [[(block['range'], block['values']) for block in blocks] for blocks in requests] == [
+        [("'Members'!A1", [['m01'], ['m02'], ['m03']])],
+        # the split lands in the middle of Members, and the next worksheet starts in the same request
+        [("'Members'!A4", [['m04'], ['m05']]), ("'O''Neil'!A1", [['o01']])],
+        [("'O''Neil'!A2", [['o02'], ['o03'], ['o04']])],
+    ]
+
+    # a row bigger than max_bytes still goes, in a request of its own
+    wide = sheets_writer.value_requests([{'title': 'Wide', 'values': [['x' * 40], ['y']]}], max_bytes=27)
+    assert [[block['range'] for block in blocks] for blocks in wide] == [["'Wide'!A1"], ["'Wide'!A2"]]
+
+# records every values.batchUpdate body it's sent, failing the ones that write to fail_range
+class RecordingSpreadsheet:
+
+    def __init__(self, fail_range=None):
+        self.title = 'Recording'
+        self.fail_range = fail_range
+        self.bodies = []
+        self.lock = threading.Lock()
+
+    def values_batch_update(self, body):
+        with self.lock:
+            self.bodies.append(body)
+        if any(block['range'] == self.fail_range for block in body['data']):
+            raise RuntimeError("quota exceeded")
+
+def test_write_values_sends_every_chunk_and_raises_the_failure(monkeypatch, caplog):
+    monkeypatch.setattr(sheets_writer, 'max_request_bytes', 27)
+    data = [{'title': 'Members', 'values': numbered_rows('m', 9)}]
+
+    spreadsheet = RecordingSpreadsheet(fail_range="'Members'!A4")
+    with pytest.raises(RuntimeError, match="quota exceeded"):
+        sheets_writer.write_values(spreadsheet, data)
+
+    # the failed chunk didn't stop the others
+    sent = sorted(block['range'] for body in spreadsheet.bodies for block in body['data'])
+    assert sent == ["'Members'!A1", "'Members'!A4", "'Members'!A7"]
+    assert all(body['valueInputOption'] == 'USER_ENTERED' for body in spreadsheet.bodies)
+    assert "Failed writing 'Members'!A4: quota exceeded" in caplog.text
+
+    # and values that fit go in one request
+    spreadsheet = RecordingSpreadsheet()
+    sheets_writer.write_values(spreadsheet, [{'title': 'Members', 'values': numbered_rows('m', 3)}])
+    assert [[block['range'] for block in body['data']] for body in spreadsheet.bodies] == [["'Members'!A1"]]
@@ -0,0 +1,107 @@
+import datetime
+import json
+import os
+import pytest
+
+# Plan checks for the queries the apps run against syc_orders. They need a Postgres database to build the schema in,
+# given as a libpq connection string in TEST_DATABASE_URL, and are skipped without one. Everything is created in a
+# schema of its own that's dropped afterwards
+psycopg2 = pytest.importorskip('psycopg2')
+database_url = os.environ.get('TEST_DATABASE_URL')
+pytestmark = pytest.mark.skipif(not database_url, reason="TEST_DATABASE_URL isn't set")
+
+sql_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'SQL')
+schema = 'plan_checks_%s' % os.getpid()
+current_year = datetime.date.today().year
+years = [current_year - 2, current_year - 1, current_year]
+
+def read_sql(name):
+    with open(os.path.join(sql_directory, name)) as f:
+        return f.read()
+
+@pytest.fixture(scope='module')
+def connection():
+    connection = psycopg2.connect(database_url)
+    connection.autocommit = True
+    cursor = connection.cursor()
+    cursor.execute("CREATE SCHEMA %s" % schema)
+    cursor.execute("SET search_path TO %s, public" % schema)
+
+    try:
+        for name in ('syc_orders.sql', 'syc_order_rollup.sql', 'syc_members.sql', 'search_members.sql'):
+            cursor.execute(read_sql(name))
+
+        # a few thousand orders a year across the categories, with a member row per membership order
+        for year in years:
+            cursor.execute("SELECT create_syc_orders_partition(%s)", (year,))
+            cursor.execute("""
+                INSERT INTO syc_orders (id, order_number, created_on, modified_on, customer_email, product_name, product_category, custom_fields, variant_fields, customizations)
+                SELECT
+                    %(year)s || '-' || n,
+                    %(year)s || '-' || n,
+                    MAKE_TIMESTAMP(%(year)s, 1, 1, 0, 0, 0) + n * INTERVAL '1 hour',
+                    MAKE_TIMESTAMP(%(year)s, 1, 1, 0, 0, 0) + n * INTERVAL '1 hour',
+                    'member' || n || '@example.com',
+                    CASE n %% 3 WHEN 0 THEN 'Moorings' WHEN 1 THEN 'Mooring Services' ELSE 'Family Membership' END,
+                    CASE n %% 3 WHEN 0 THEN 'mooring' WHEN 1 THEN 'mooring_services' ELSE 'membership' END,
+                    jsonb_build_object('Name', 'Member ' || n, 'Email', 'member' || n || '@example.com'),
+                    jsonb_build_object('Row', 'A', 'Letter', 'B'),
+                    '[]'::jsonb
+                FROM generate_series(1, 3000) n
+            """, {'year': year})
+            cursor.execute("""
+                INSERT INTO syc_members (line_item_id, member_index, relationship, member_name, order_number, created_on)
+                SELECT id, 0, 'Primary Member', custom_fields->>'Name', order_number, created_on
+                FROM syc_orders
+                WHERE product_category = 'membership' AND created_on >= MAKE_TIMESTAMP(%(year)s, 1, 1, 0, 0, 0)
+                AND created_on < MAKE_TIMESTAMP(%(year)s + 1, 1, 1, 0, 0, 0)
+            """, {'year': year})
+
+        cursor.execute("ANALYZE")
+        yield connection
+    finally:
+        cursor.execute("DROP SCHEMA %s CASCADE" % schema)
+        connection.close()
+
+# returns every node in a plan from EXPLAIN (FORMAT JSON)
+def plan_nodes(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from plan_nodes(child)
+
+# explain a query with sequential scans discouraged, so the plan shows whether an index can be used rather than what
+# is cheapest for this small a table
+# returns list of plan nodes
+def explain(connection, query, params=None):
+    cursor = connection.cursor()
+    cursor.execute("SET enable_seqscan = off")
+    try:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + query, params)
+        result = cursor.fetchone()[0]
+    finally:
+        cursor.execute("RESET enable_seqscan")
+
+    if isinstance(result, str):
+        result = json.loads(result)
+    return list(plan_nodes(result[0]['Plan']))
+
+# returns the syc_orders partitions a plan reads, with the scan types it reads them by
+def partition_scans(nodes):
+    return {(node['Relation Name'], node['Node Type']) for node in nodes if node.get('Relation Name', '').startswith('syc_orders_')}
+
+def test_moorings_curr_year_reads_only_the_current_partition_by_index(connection):
+    nodes = explain(connection, read_sql('moorings_curr_year.sql').rstrip().rstrip(';'))
+    scans = partition_scans(nodes)
+
+    assert {relation for relation, _ in scans} == {'syc_orders_%s' % current_year}
+    assert all(node_type in ('Index Scan', 'Bitmap Heap Scan', 'Index Only Scan') for _, node_type in scans)
+
+def test_search_members_reads_only_the_searched_years_by_index(connection):
+    nodes = explain(connection, "SELECT * FROM search_members(%s, %s, %s)", ('member 12', current_year - 1, current_year - 1))
+    scans = partition_scans(nodes)
+
+    assert {relation for relation, _ in scans} == {'syc_orders_%s' % (current_year - 1)}
+    assert all(node_type in ('Index Scan', 'Bitmap Heap Scan', 'Index Only Scan') for _, node_type in scans)
+
+    # the name search goes through the trigram index on syc_members
+    assert any(node.get('Index Name') == 'syc_members_name_trgm_idx' for node in nodes)
@@ -0,0 +1,100 @@
+import os
+import pytest
+import sqlite3
+import storage
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('STORAGE_PATH', str(tmp_path / 'syc.sqlite3'))
+    store = storage.open_store()
+    yield store
+    store.close()
+
+def reservation(order_id, name='Jane Doe', email='jane@example.com'):
+    return [order_id, name, email, '508-555-0100', 'May 1, 2024', '10:00am', '11:00am', 'Laser', 'Member']
+
+def test_replace_upsert_delete_and_find_round_trip(store):
+    assert store.replace('reservations', 2024, [reservation(1), reservation(2), reservation(3)]) == 3
+    assert store.replace('reservations', 2023, [reservation(1, name='Last Year')]) == 1
+    assert store.find('reservations', 2024, 2) == [str(value) for value in reservation(2)]
+
+    # replace drops the year's other rows, and only that year's
+    assert store.replace('reservations', 2024, [reservation(2), reservation(4)]) == 2
+    assert store.find('reservations', 2024, 1) is None
+    assert store.find('reservations', 2023, 1)[1] == 'Last Year'
+
+    assert store.upsert('reservations', 2024, [reservation(2, name='Jane Smith'), reservation(5)]) == 2
+    assert store.find('reservations', 2024, 2)[1] == 'Jane Smith'
+    assert store.find('reservations', 2024, 5) is not None
+
+    assert store.contains('reservations', 2024, ['email'], 'jane@example.com')
+    assert not store.contains('reservations', 2024, ['email'], 'nobody@example.com')
+    assert store.values('reservations', 2024, ['order_id']) == {'2', '4', '5'}
+    assert [row[:2] for row in store.rows('reservations', 2024)] == [['2', 'Jane Smith'], ['4', 'Jane Doe'], ['5', 'Jane Doe']]
+
+    # every deleted row is counted, across more keys than fit in one statement
+    assert store.delete('reservations', 2024, [2, 5, 99] + list(range(1000, 2000))) == 2
+    assert store.values('reservations', 2024, ['order_id']) == {'4'}
+    assert store.find('reservations', 2023, 1) is not None
+
+def test_failed_write_is_rolled_back(store):
+    store.replace('reservations', 2024, [reservation(1)])
+
+    # the second row is too short, so the whole replace goes, including its delete
+    with pytest.raises(ValueError):
+        store.replace('reservations', 2024, [reservation(2), reservation(3)[:4]])
+    assert store.values('reservations', 2024, ['order_id']) == {'1'}
+
+    with pytest.raises(sqlite3.Error):
+        with store.cursor() as cursor:
+            cursor.execute("DELETE FROM reservations")
+            cursor.execute("SELECT * FROM no_such_table")
+    assert store.values('reservations', 2024, ['order_id']) == {'1'}
+
+    # and the connection still works afterwards
+    assert store.upsert('reservations', 2024, [reservation(2)]) == 1
+
+def test_sqlite_defaults_to_the_temp_directory(tmp_path, monkeypatch):
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.delenv('STORAGE_PATH', raising=False)
+    monkeypatch.setattr('tempfile.tempdir', str(tmp_path))
+
+    storage.open_store().close()
+    assert os.path.exists(tmp_path / 'syc.sqlite3')
+
+def transaction(order_id, action, name='Jane Doe'):
+    return [order_id, name, 'jane@example.com', '508-555-0100', 'Laser Lesson', 'May 1, 2024', '$150.0', '$150.0', 'yes', 'Member', action]
+
+def test_insert_keeps_a_row_per_action_and_skips_repeats(store):
+    assert store.insert('lesson_transactions', 2024, [transaction(1, 'order.completed'), transaction(1, 'canceled')]) == 2
+
+    # a redelivered webhook's row is left as it was
+    assert store.insert('lesson_transactions', 2024, [transaction(1, 'canceled', name='Jane Smith'), transaction(2, 'order.completed')]) == 1
+    assert sorted((row[0], row[1], row[-1]) for row in store.rows('lesson_transactions', 2024)) == [('1', 'Jane Doe', 'canceled'), ('1', 'Jane Doe', 'order.completed'), ('2', 'Jane Doe', 'order.completed')]
+
+    # upserts only overwrite the row with the same action
+    assert store.upsert('lesson_transactions', 2024, [transaction(1, 'canceled', name='Jane Smith')]) == 1
+    assert sorted(row[1] for row in store.rows('lesson_transactions', 2024) if row[0] == '1') == ['Jane Doe', 'Jane Smith']
+
+    # and deleting an order takes every row it has
+    assert store.delete('lesson_transactions', 2024, [1]) == 2
+
+def test_persist_writes_the_store_and_reports_the_sheets_export(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, 'cached_store', None)
+    monkeypatch.setenv('STORAGE_BACKEND', 'sheets')
+    assert storage.persist('reservations', 2024, [reservation(1)]) is True
+    assert storage.cached_store is None
+
+    monkeypatch.setenv('STORAGE_BACKEND', 'sqlite')
+    monkeypatch.setenv('STORAGE_PATH', str(tmp_path / 'syc.sqlite3'))
+    monkeypatch.setenv('SHEETS_EXPORT', 'false')
+    try:
+        assert storage.persist('reservations', 2024, [reservation(1), reservation(2)], mode='replace') is False
+        assert storage.persist('reservations', 2024, [1], mode='delete') is False
+        assert storage.get_store().values('reservations', 2024, ['order_id']) == {'2'}
+
+        monkeypatch.setenv('SHEETS_EXPORT', 'true')
+        assert storage.persist('reservations', 2024, [reservation(3)]) is True
+    finally:
+        storage.get_store().close()